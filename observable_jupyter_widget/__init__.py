@@ -9,19 +9,11 @@ from .widget import (
     ObservableWidget,
     # interactive_embed_async,
 )
+from .headless import HeadlessRuntime
+from .output_cache import OutputCache
+from ._waiting import MapError, allow_nested_event_loops
 from ._version import __version__, version_info
 
-import sys
-
-# Colab support: https://github.com/googlecolab/colabtools/issues/498
-try:
-    if "google.colab" in sys.modules:
-        from google.colab import output
-
-        output.enable_custom_widget_manager()
-except ImportError:
-    pass
-
 
 def _jupyter_labextension_paths():
     """Called by Jupyter Lab Server to detect if it is a valid labextension and
@@ -67,3 +59,22 @@ def _jupyter_nbextension_paths():
             "require": "observable_jupyter_widget/extension",
         }
     ]
+
+
+def _jupyter_server_extension_points():
+    """Called by Jupyter Server to find the server extension that serves cached
+    Observable modules, see module_store.py
+    """
+    return [{"module": "observable_jupyter_widget._server_extension"}]
+
+
+# classic notebook server
+_jupyter_server_extension_paths = _jupyter_server_extension_points
+
+
+def load_jupyter_server_extension(nbapp):
+    "Called by the classic notebook server, which looks for it in the package"
+    # imported here, the kernel doesn't need tornado's web framework
+    from ._server_extension import load_jupyter_server_extension as load
+
+    load(nbapp)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Large DataFrames and arrays shared by the widgets on a page.
+
+Inputs over BlobStore.min_bytes are encoded once per distinct content and sent
+to a single page-level BlobStoreModel (src/blob_store.ts). Widgets' inputs hold
+{TYPE_KEY: "blob", "hash": ...} references instead, which views resolve before
+posting inputs to their iframes. Redefining a cell with equal data, or using
+the same DataFrame in another widget, sends nothing new.
+"""
+from typing import Any, Dict, Hashable, Set
+
+from ipywidgets import Widget
+from ipywidgets.widgets.widget import _remove_buffers
+import traitlets
+
+from ._frontend import module_name, module_version
+from ._serialization import TYPE_KEY, content_hash, encode, nbytes
+
+
+class BlobStore(Widget):
+    _model_name = traitlets.Unicode("BlobStoreModel").tag(sync=True)
+    _model_module = traitlets.Unicode(module_name).tag(sync=True)
+    _model_module_version = traitlets.Unicode(module_version).tag(sync=True)
+
+    # DataFrames and arrays smaller than this are encoded inline
+    min_bytes = 256 * 1024
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "BlobStore":
+        "The store shared by every ObservableWidget in this kernel"
+        if cls._instance is None or cls._instance.comm is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.on_msg(self._handle_custom_msg)
+        # encoded values by content hash, while some widget's inputs use them
+        self._encoded = {}
+        self._refcounts = {}
+        # hashes referenced by each (widget id, cell)
+        self._owners = {}
+        self._sent = set()
+
+    def encode(self, value: Any, owner: Hashable) -> Any:
+        """Encodes an input value, with references to blobs for large
+        DataFrames and arrays. owner's previous references are released."""
+        hashes = set()
+
+        def reference(obj):
+            if nbytes(obj) < self.min_bytes:
+                return None
+            digest = content_hash(obj)
+            if digest is None:
+                return None
+            if digest not in self._encoded:
+                self._encoded[digest] = encode(obj)
+            if digest not in self._sent:
+                self._send_blob(digest)
+            hashes.add(digest)
+            return {TYPE_KEY: "blob", "hash": digest}
+
+        encoded = encode(value, reference)
+        self._set_references(owner, hashes)
+        return encoded
+
+    def release(self, widget: Any) -> None:
+        "Releases the references of a closed widget"
+        for owner in [o for o in self._owners if o[0] == id(widget)]:
+            self._set_references(owner, set())
+
+    def resolve(self, value: Any) -> Any:
+        "Replaces references with the encoded values, e.g. for a headless process"
+        if isinstance(value, dict):
+            if value.get(TYPE_KEY) == "blob":
+                return self._encoded[value["hash"]]
+            return {k: self.resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        return value
+
+    def _set_references(self, owner: Hashable, hashes: Set[str]) -> None:
+        old = self._owners.pop(owner, set())
+        if hashes:
+            self._owners[owner] = hashes
+        for digest in hashes - old:
+            self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+        for digest in old - hashes:
+            self._refcounts[digest] -= 1
+            if not self._refcounts[digest]:
+                del self._refcounts[digest]
+                del self._encoded[digest]
+                self._sent.discard(digest)
+                self.send({"type": "drop", "hash": digest})
+
+    def _send_blob(self, digest: str) -> None:
+        msg: Dict[str, Any] = {
+            "type": "blob",
+            "hash": digest,
+            "value": self._encoded[digest],
+        }
+        state, buffer_paths, buffers = _remove_buffers(msg)
+        self.send({**state, "buffer_paths": buffer_paths}, buffers)
+        self._sent.add(digest)
+
+    def _handle_custom_msg(self, _, content, buffers):
+        # the page was reloaded, or the blob arrived before the store's model
+        if content.get("type") == "request" and content.get("hash") in self._encoded:
+            self._send_blob(content["hash"])
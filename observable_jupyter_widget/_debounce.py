@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Trailing-edge debouncing for traitlets observers.
+"""
+import asyncio
+import threading
+from typing import Any, Callable
+
+
+class Debounced:
+    """Wraps an observer so it runs once, with the latest change, after
+    changes have stopped arriving for `wait` seconds.
+
+    In a Jupyter kernel the call is scheduled on the kernel's event loop,
+    elsewhere on a timer thread.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], wait: float):
+        self.handler = handler
+        self.wait = wait
+        self._latest = None
+        self._scheduled = None
+
+    def __call__(self, change: Any) -> None:
+        self._latest = change
+        self.cancel()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._scheduled = threading.Timer(self.wait, self.flush)
+            self._scheduled.daemon = True
+            self._scheduled.start()
+        else:
+            self._scheduled = loop.call_later(self.wait, self.flush)
+
+    @property
+    def pending(self) -> bool:
+        return self._latest is not None
+
+    def cancel(self) -> None:
+        "Forget the scheduled call but keep the latest change"
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+
+    def flush(self) -> None:
+        "Run the handler now if a change is waiting"
+        self.cancel()
+        change, self._latest = self._latest, None
+        if change is not None:
+            self.handler(change)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Calls from Observable cells to Python handlers.
+
+Cells call `jupyter.call(name, args)`, which posts a 'call' message with a
+request id; the reply message resolves or rejects the Promise it returned.
+Handlers run as tasks on the kernel's event loop (sync handlers in its
+default executor), or on a background loop outside a kernel.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_loop.run_forever,
+                name="observable_jupyter_widget rpc",
+                daemon=True,
+            ).start()
+        return _background_loop
+
+
+class Handler:
+    def __init__(
+        self,
+        fn: Callable,
+        max_in_flight: int,
+        cache_size: int,
+        supersede: bool,
+    ):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.fn = fn
+        self.max_in_flight = max_in_flight
+        self.cache_size = cache_size
+        self.supersede = supersede
+        self.cache = OrderedDict()
+        # request ids of calls waiting for a slot, and their arguments
+        self.queue = deque()
+        # request ids of running calls and their tasks
+        self.running = {}
+        # request ids of sync calls and their executor futures; a cancelled
+        # call's thread can't be stopped, it keeps its slot until it returns
+        self.threads = {}
+
+    def in_flight(self) -> int:
+        return len(self.running.keys() | self.threads.keys())
+
+
+class RpcServer:
+    """Runs registered handlers for calls from the frontend.
+
+    send(msg) is called with each reply, {"type": "reply", "request_id": ...}
+    and one of "value", "error" or "cancelled".
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None]):
+        self.send = send
+        self.handlers = {}
+        self._loop = None
+
+    def register(
+        self,
+        name: str,
+        fn: Callable,
+        *,
+        max_in_flight: int = 4,
+        cache_size: int = 0,
+        supersede: bool = False,
+    ) -> None:
+        self.handlers[name] = Handler(fn, max_in_flight, cache_size, supersede)
+
+    def unregister(self, name: str) -> None:
+        handler = self.handlers.pop(name, None)
+        if handler is not None:
+            self._in_loop(self._cancel_all, handler)
+
+    def call(self, request_id: str, name: str, args: Any) -> None:
+        "Handle a 'call' message, from any thread"
+        self._in_loop(self._call, request_id, name, args)
+
+    def cancel(self, request_id: str) -> None:
+        "Handle a 'cancel' message, sent when the Promise is no longer wanted"
+        self._in_loop(self._cancel_request, request_id)
+
+    def _in_loop(self, fn: Callable, *args: Any) -> None:
+        # Calls arrive on the kernel's event loop, or from a headless
+        # process's reader thread.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._loop is None:
+            self._loop = loop or _get_background_loop()
+        if loop is self._loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _call(self, request_id: str, name: str, args: Any) -> None:
+        handler = self.handlers.get(name)
+        if handler is None:
+            self._reply(request_id, error=f"no handler named {name!r}")
+            return
+        if handler.supersede:
+            self._cancel_all(handler)
+        key = None
+        if handler.cache_size:
+            key = json.dumps(args, sort_keys=True)
+            if key in handler.cache:
+                handler.cache.move_to_end(key)
+                self._reply(request_id, value=handler.cache[key])
+                return
+        handler.queue.append((request_id, args, key))
+        self._start_next(handler)
+
+    def _start_next(self, handler: Handler) -> None:
+        while handler.queue and handler.in_flight() < handler.max_in_flight:
+            request_id, args, key = handler.queue.popleft()
+            handler.running[request_id] = self._loop.create_task(
+                self._run(handler, request_id, args, key)
+            )
+
+    async def _run(self, handler: Handler, request_id: str, args: Any, key: Any):
+        try:
+            if isinstance(args, dict):
+                call = functools.partial(handler.fn, **args)
+            elif isinstance(args, list):
+                call = functools.partial(handler.fn, *args)
+            else:
+                call = functools.partial(handler.fn, args)
+            if inspect.iscoroutinefunction(handler.fn):
+                result = await call()
+            else:
+                future = self._loop.run_in_executor(None, call)
+                handler.threads[request_id] = future
+                future.add_done_callback(
+                    functools.partial(self._thread_done, handler, request_id)
+                )
+                # cancelling the task doesn't cancel the future, see _thread_done
+                result = await asyncio.shield(future)
+            if inspect.isawaitable(result):
+                result = await result
+        except asyncio.CancelledError:
+            # _cancel has replied already
+            return
+        except Exception as e:
+            self._reply(request_id, error=f"{type(e).__name__}: {e}")
+        else:
+            if key is not None:
+                handler.cache[key] = result
+                while len(handler.cache) > handler.cache_size:
+                    handler.cache.popitem(last=False)
+            self._reply(request_id, value=result)
+        finally:
+            if handler.running.get(request_id) is asyncio.current_task():
+                del handler.running[request_id]
+            self._start_next(handler)
+
+    def _thread_done(
+        self, handler: Handler, request_id: str, future: asyncio.Future
+    ) -> None:
+        if not future.cancelled():
+            # retrieved here in case the call was cancelled
+            future.exception()
+        if handler.threads.get(request_id) is future:
+            del handler.threads[request_id]
+        self._start_next(handler)
+
+    def _cancel_request(self, request_id: str) -> None:
+        for handler in self.handlers.values():
+            if self._cancel(handler, request_id):
+                return
+
+    def _cancel_all(self, handler: Handler) -> None:
+        for request_id in [r for r, _, _ in handler.queue] + list(handler.running):
+            self._cancel(handler, request_id)
+
+    def _cancel(self, handler: Handler, request_id: str) -> bool:
+        for i, (queued_id, _, _) in enumerate(handler.queue):
+            if queued_id == request_id:
+                del handler.queue[i]
+                break
+        else:
+            task = handler.running.pop(request_id, None)
+            if task is None:
+                return False
+            # sync handlers keep running in their thread and their slot, the
+            # result is dropped
+            task.cancel()
+        self._reply(request_id, cancelled=True)
+        return True
+
+    def _reply(self, request_id: str, **reply: Any) -> None:
+        self.send({"type": "reply", "request_id": request_id, **reply})
+
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Encoding of Python values sent to Observable cells.
+
+DataFrames and NumPy arrays are sent as columns of raw bytes, which ipywidgets
+moves as binary message buffers instead of JSON. The iframe turns them back into
+typed arrays (and DataFrames into arrays of row objects, like d3.csvParse).
+
+Large DataFrames and arrays in inputs are replaced by references to their
+content hash, see _blobs.py.
+"""
+import hashlib
+from typing import Any, Callable, Dict, Optional
+
+# Key marking a dict as an encoded value rather than a plain JSON object.
+# Must match TYPE_KEY in src/iframe_code.js.
+TYPE_KEY = "__observable_jupyter_widget_type__"
+
+# dtypes with a matching JavaScript TypedArray
+TYPED_ARRAY_DTYPES = {
+    "int8",
+    "uint8",
+    "int16",
+    "uint16",
+    "int32",
+    "uint32",
+    "float32",
+    "float64",
+}
+
+# dtype kinds _encode_array sends as binary
+BINARY_KINDS = "bMmiuf"
+
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def is_dataframe(obj: Any) -> bool:
+    # checked by name to avoid importing pandas
+    return type(obj).__name__ == "DataFrame"
+
+
+def is_ndarray(obj: Any) -> bool:
+    return type(obj).__name__ == "ndarray" and type(obj).__module__ == "numpy"
+
+
+def encode(obj: Any, reference: Optional[Callable[[Any], Any]] = None) -> Any:
+    """Convert a Python value into JSON-able data plus memoryviews.
+
+    reference(obj) is called with each DataFrame and array and can return an
+    encoded reference to use instead, or None to encode it here."""
+    if is_dataframe(obj) or is_ndarray(obj):
+        encoded = reference(obj) if reference is not None else None
+        if encoded is not None:
+            return encoded
+        if is_dataframe(obj):
+            return encode_dataframe(obj)
+        return encode_ndarray(obj)
+    if isinstance(obj, dict):
+        return {k: encode(v, reference) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode(v, reference) for v in obj]
+    if type(obj).__module__ == "numpy" and hasattr(obj, "item"):
+        # NumPy scalars
+        return obj.item()
+    return obj
+
+
+def inputs_to_json(inputs: Optional[Dict[str, Any]], widget: Any) -> Any:
+    "Serializer for the inputs traitlet"
+    if inputs is None:
+        return None
+    blobs = getattr(widget, "_blob_store", None)
+    if blobs is None:
+        return {name: encode(value) for name, value in inputs.items()}
+    return {
+        name: blobs.encode(value, (id(widget), name)) for name, value in inputs.items()
+    }
+
+
+def check_inputs(inputs: Dict[str, Any]) -> None:
+    """Raises TypeError for inputs with values that can't be sent to
+    Observable, naming the input, rather than failing later in the comm send."""
+    for name, value in inputs.items():
+        _check(value, repr(name))
+
+
+def _check(obj: Any, where: str) -> None:
+    if is_dataframe(obj):
+        for name in obj.columns:
+            series = obj[name]
+            if not _is_binary(series):
+                values = series.astype(object)[series.notna()]
+                _check(values.tolist(), f"{where}, column {name!r}")
+    elif is_ndarray(obj):
+        if obj.dtype.kind not in BINARY_KINDS:
+            _check(obj.tolist(), where)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            if not isinstance(key, JSON_SCALARS):
+                raise TypeError(
+                    f"input {where} can't be sent to Observable: "
+                    f"{type(key).__name__} keys aren't supported"
+                )
+            _check(value, where)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _check(value, where)
+    elif type(obj).__module__ == "numpy" and hasattr(obj, "item"):
+        _check(obj.item(), where)
+    elif not isinstance(obj, JSON_SCALARS):
+        raise TypeError(
+            f"input {where} can't be sent to Observable: "
+            f"{type(obj).__name__} values aren't JSON serializable"
+        )
+
+
+def encode_dataframe(df: Any) -> Dict[str, Any]:
+    return {
+        TYPE_KEY: "dataframe",
+        "length": len(df),
+        "columns": [_encode_column(name, df[name]) for name in df.columns],
+    }
+
+
+def encode_ndarray(arr: Any) -> Dict[str, Any]:
+    encoded = _encode_array(arr.reshape(-1))
+    if encoded is None:
+        return encode(arr.tolist())
+    dtype, data = encoded
+    return {TYPE_KEY: "ndarray", "dtype": dtype, "shape": list(arr.shape), "data": data}
+
+
+def _is_binary(series: Any) -> bool:
+    return _is_tz_aware(series) or series.dtype.kind in BINARY_KINDS
+
+
+def _is_tz_aware(series: Any) -> bool:
+    return getattr(series.dtype, "tz", None) is not None
+
+
+def _encode_column(name: Any, series: Any) -> Dict[str, Any]:
+    if _is_tz_aware(series):
+        # the same instants in UTC, JavaScript Dates have no time zone
+        series = series.dt.tz_convert(None)
+    encoded = _encode_array(series.to_numpy())
+    if encoded is None:
+        values = series.astype(object).where(series.notna(), None).tolist()
+        return {"name": str(name), "values": encode(values)}
+    dtype, data = encoded
+    return {"name": str(name), "dtype": dtype, "data": data}
+
+
+def _encode_array(values: Any):
+    """Returns (dtype, little-endian bytes) for a 1-D array, or None if there
+    is no binary representation of its dtype."""
+    import numpy as np
+
+    kind = values.dtype.kind
+    if kind == "b":
+        dtype, values = "bool", values.astype("u1")
+    elif kind == "M":
+        # milliseconds since the epoch, NaT becomes NaN
+        missing = np.isnat(values)
+        values = values.astype("datetime64[ms]").astype("i8").astype("<f8")
+        values[missing] = np.nan
+        dtype = "datetime"
+    elif kind == "m":
+        # durations in milliseconds, NaT becomes NaN
+        missing = np.isnat(values)
+        values = values.astype("timedelta64[ns]").astype("i8") / 1e6
+        values[missing] = np.nan
+        dtype = "float64"
+    elif kind in "iuf":
+        dtype = values.dtype.name
+        if dtype not in TYPED_ARRAY_DTYPES:
+            # JavaScript numbers are doubles anyway
+            dtype, values = "float64", values.astype("<f8")
+        else:
+            values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    else:
+        return None
+    return dtype, memoryview(np.ascontiguousarray(values)).cast("B")
+
+
+def nbytes(obj: Any) -> int:
+    "Size of a DataFrame's or array's data, not counting Python objects"
+    if is_dataframe(obj):
+        return int(obj.memory_usage(index=False, deep=False).sum())
+    return obj.nbytes
+
+
+def content_hash(obj: Any) -> Optional[str]:
+    """Hash of a DataFrame's or array's contents, equal for equal data.
+    None for arrays of Python objects."""
+    import numpy as np
+
+    digest = hashlib.blake2b(digest_size=16)
+    if is_ndarray(obj):
+        if obj.dtype.hasobject:
+            return None
+        digest.update(repr(("ndarray", obj.dtype.str, obj.shape)).encode())
+        digest.update(np.ascontiguousarray(obj).view(np.uint8))
+        return digest.hexdigest()
+    import pandas as pd
+
+    digest.update(repr(("dataframe", len(obj))).encode())
+    for name in obj.columns:
+        series = obj[name]
+        digest.update(repr((str(name), str(series.dtype))).encode())
+        values = series.to_numpy()
+        if values.dtype.hasobject:
+            values = pd.util.hash_pandas_object(series, index=False).to_numpy()
+        digest.update(np.ascontiguousarray(values).view(np.uint8))
+    return digest.hexdigest()
+
+
+def decode(value: Any) -> Any:
+    """The inverse of encode() for an encoded DataFrame or array, like binary
+    outputs: numeric columns are NumPy arrays over the received buffers.
+    Other values are returned as they are."""
+    if isinstance(value, dict):
+        if value.get(TYPE_KEY) == "dataframe":
+            return decode_dataframe(value)
+        if value.get(TYPE_KEY) == "ndarray":
+            return decode_ndarray(value)
+    return value
+
+
+def decode_dataframe(encoded: Dict[str, Any]) -> Any:
+    import pandas as pd
+
+    columns = {}
+    for column in encoded["columns"]:
+        if "data" in column:
+            columns[column["name"]] = _decode_array(column["dtype"], column["data"])
+        else:
+            columns[column["name"]] = column["values"]
+    return pd.DataFrame(columns, index=pd.RangeIndex(encoded["length"]), copy=False)
+
+
+def decode_ndarray(encoded: Dict[str, Any]) -> Any:
+    return _decode_array(encoded["dtype"], encoded["data"]).reshape(encoded["shape"])
+
+
+def _decode_array(dtype: str, data: Any) -> Any:
+    "A read-only array over data where possible, the inverse of _encode_array"
+    import numpy as np
+
+    if dtype == "bool":
+        return np.frombuffer(data, dtype="u1").view(bool)
+    if dtype == "datetime":
+        ms = np.frombuffer(data, dtype="<f8")
+        values = np.full(len(ms), np.datetime64("NaT"), dtype="datetime64[ms]")
+        present = ~np.isnan(ms)
+        values[present] = ms[present].astype("i8").astype("datetime64[ms]")
+        return values
+    return np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"))
+
+
+def is_deferred(value: Any) -> bool:
+    """True for the placeholders in .value of outputs over output_budget,
+    {TYPE_KEY: "deferred", "size": <bytes>, "length": <if a list>}"""
+    return isinstance(value, dict) and value.get(TYPE_KEY) == "deferred"
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Jupyter server extension serving the ModuleStore to embeds.
+
+    <base_url>observable-jupyter-widget/iframe_code.js
+    <base_url>observable-jupyter-widget/runtime.js
+    <base_url>observable-jupyter-widget/inspector.css
+    <base_url>observable-jupyter-widget/modules/@user/notebook.js
+
+Embeds run in sandboxed iframes with an opaque origin, which send no cookies
+and can't be given the server's token without handing it to notebook code, so
+the handlers don't require authentication. Instead they only serve what's
+already in the store: the kernel caches a notebook's modules when a widget with
+local_modules=True is created (see module_store.prefetch), and the server only
+fetches missing modules itself with OBSERVABLE_JUPYTER_WIDGET_SERVER_FETCH=1.
+Responses are only readable by opaque origins ("null"), not by other sites.
+"""
+import os
+from typing import List, Optional
+
+from tornado import web
+from tornado.ioloop import IOLoop
+
+from .headless import _iframe_code_path
+from .module_store import MODULES_URL, ModuleStore
+
+URL_PREFIX = "observable-jupyter-widget/"
+
+# the origin of requests from sandboxed iframes
+ALLOW_ORIGIN = "null"
+
+CONTENT_TYPES = {
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+}
+
+
+class IframeCodeHandler(web.RequestHandler):
+    """The code each embed's iframe runs, imported as a module so browsers
+    compile it once instead of once per embed. Requested with ?v=<version>."""
+
+    def initialize(self, content: bytes):
+        self.content = content
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
+
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPES[".js"])
+        self.set_header("Cache-Control", "max-age=86400")
+        self.finish(self.content)
+
+
+class ModuleHandler(web.RequestHandler):
+    def initialize(self, store: ModuleStore, base_url: str):
+        self.store = store
+        self.base_url = base_url
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
+
+    async def get(self, modules: str, path: str):
+        try:
+            # fetching blocks, so not on the server's event loop
+            content = await IOLoop.current().run_in_executor(None, self.store.get, path)
+        except ValueError:
+            raise web.HTTPError(400)
+        except FileNotFoundError:
+            raise web.HTTPError(404)
+        if modules:
+            # imported notebooks should come through here too
+            host = f"{self.request.protocol}://{self.request.host}"
+            local = host + self.base_url + URL_PREFIX + "modules/"
+            content = content.replace(MODULES_URL.encode(), local.encode())
+        self.set_header("Content-Type", CONTENT_TYPES[path[path.rindex(".") :]])
+        self.set_header("Cache-Control", f"max-age={int(self.store.max_age)}")
+        self.finish(content)
+
+
+def _server_fetch() -> bool:
+    "Whether the server may fetch modules that aren't in the store"
+    return os.environ.get("OBSERVABLE_JUPYTER_WIDGET_SERVER_FETCH", "") not in (
+        "",
+        "0",
+    )
+
+
+def _handlers(base_url: str, store: ModuleStore, iframe_code: Optional[bytes]) -> List:
+    handlers = []
+    if iframe_code is not None:
+        handlers.append(
+            (
+                base_url + URL_PREFIX + "iframe_code.js",
+                IframeCodeHandler,
+                {"content": iframe_code},
+            )
+        )
+    handlers.append(
+        (
+            base_url + URL_PREFIX + r"(modules/)?(.+\.(?:js|css))",
+            ModuleHandler,
+            {"store": store, "base_url": base_url},
+        )
+    )
+    return handlers
+
+
+def _load_jupyter_server_extension(serverapp):
+    base_url = serverapp.web_app.settings["base_url"]
+    store = ModuleStore.from_environment()
+    if not _server_fetch():
+        store.offline = True
+    try:
+        with open(_iframe_code_path(), "rb") as f:
+            iframe_code = f.read()
+    except FileNotFoundError as e:
+        # embeds fall back to inlining it in each iframe
+        serverapp.log.warning(f"observable_jupyter_widget: {e}")
+        iframe_code = None
+    serverapp.web_app.add_handlers(".*$", _handlers(base_url, store, iframe_code))
+    serverapp.log.info(
+        f"observable_jupyter_widget serving modules from {store.directory}"
+    )
+
+
+# name used by the classic notebook server
+load_jupyter_server_extension = _load_jupyter_server_extension
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Waiting for values to arrive from the frontend.
+
+Widget values arrive as comm messages, which the kernel doesn't process while
+a cell is running. Blocking waits step the kernel along with ipython_blocking
+(https://gitter.im/jupyter-widgets/Lobby?at=5e86fe9381a582042e972b4d),
+sleeping on the shell socket between messages instead of a fixed interval.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ValueWaiter:
+    """Watches a widget trait until `satisfied` returns True for its value.
+
+    With next_change=True the current value doesn't count, only values
+    that arrive after the waiter is created. With pump_kernel=False, blocking
+    waits don't process kernel messages because the value is set by another
+    thread."""
+
+    def __init__(
+        self,
+        widget: Any,
+        satisfied: Callable[[Any], bool],
+        name: str = "value",
+        next_change: bool = False,
+        pump_kernel: bool = True,
+    ):
+        self.widget = widget
+        self.name = name
+        self._satisfied = satisfied
+        self._stale = next_change
+        self.pump_kernel = pump_kernel
+        self.changed = threading.Event()
+        self._callbacks = []
+        widget.observe(self._on_change, name)
+
+    def _on_change(self, change: Any) -> None:
+        self._stale = False
+        self.changed.set()
+        if self.satisfied():
+            for callback in self._callbacks:
+                callback()
+
+    def satisfied(self) -> bool:
+        return not self._stale and self._satisfied(getattr(self.widget, self.name))
+
+    def close(self) -> None:
+        self.widget.unobserve(self._on_change, self.name)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        "Block until satisfied, raising TimeoutError after timeout seconds"
+        try:
+            if not self.pump_kernel or _get_kernel() is None:
+                self._wait_for_other_threads(timeout)
+            else:
+                run_kernel_until(self.satisfied, timeout)
+        finally:
+            self.close()
+
+    def _wait_for_other_threads(self, timeout: Optional[float]) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.changed.clear()
+            if self.satisfied():
+                return
+            remaining = _remaining(deadline)
+            if not self.changed.wait(remaining) and remaining is not None:
+                raise TimeoutError(f"no value after {timeout} seconds")
+
+    async def wait_async(self, timeout: Optional[float] = None) -> None:
+        """Wait until satisfied without blocking the event loop.
+
+        This resolves as soon as the value notification arrives, but the kernel
+        only processes comm messages between cell executions, so in a notebook
+        await this from a task (asyncio.ensure_future) rather than directly in
+        the cell that is waiting; use wait() for that.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        def resolve_threadsafe():
+            loop.call_soon_threadsafe(resolve)
+
+        self._callbacks.append(resolve_threadsafe)
+        try:
+            if not self.satisfied():
+                await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"no value after {timeout} seconds") from None
+        finally:
+            self.close()
+
+
+def _get_kernel() -> Any:
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return None
+    return getattr(get_ipython(), "kernel", None)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def run_kernel_until(condition: Callable[[], bool], timeout: Optional[float] = None):
+    """Process kernel messages until condition() is True.
+
+    Cell executions requested meanwhile are queued and replayed afterwards.
+    On ipykernel 6+ ipython_blocking runs the kernel's coroutines with
+    nest_asyncio, which patches the event loop the first time, see
+    allow_nested_event_loops()."""
+    import ipython_blocking
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ctx = ipython_blocking.CaptureExecution(replay=True)
+    with ctx:
+        while not condition():
+            remaining = _remaining(deadline)
+            if remaining == 0:
+                raise TimeoutError(f"no value after {timeout} seconds")
+            _wait_for_message(ctx.kernel, remaining)
+            ctx.step()
+
+
+def _wait_for_message(kernel: Any, timeout: Optional[float]) -> None:
+    "Sleep until a shell message arrives (at most a second, to notice timeouts)"
+    queue = getattr(kernel, "msg_queue", None)
+    if queue is not None and queue.qsize():
+        return
+    socket = getattr(getattr(kernel, "shell_stream", None), "socket", None)
+    if socket is None:
+        return
+    socket.poll(1000 * (1 if timeout is None else min(timeout, 1)))
+
+
+class Replies:
+    """Replies from the frontend to requests sent as custom messages, by
+    request id. Only the first reply to a request counts (each view of a
+    widget answers)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._replies = {}
+        self._events = {}
+        self._callbacks = {}
+
+    def new_request(self) -> str:
+        # unique across widgets, in case a pooled iframe answers late
+        request_id = uuid.uuid4().hex
+        with self._lock:
+            self._events[request_id] = threading.Event()
+            return request_id
+
+    def resolve(self, request_id: str, reply: Any) -> None:
+        "Called with each reply, on whichever thread it arrives"
+        with self._lock:
+            event = self._events.get(request_id)
+            if event is None or event.is_set():
+                return
+            self._replies[request_id] = reply
+            event.set()
+            callback = self._callbacks.pop(request_id, None)
+        if callback is not None:
+            callback()
+
+    def _pop(self, request_id: str) -> Any:
+        with self._lock:
+            self._events.pop(request_id, None)
+            self._callbacks.pop(request_id, None)
+            return self._replies.pop(request_id, None)
+
+    def wait(
+        self, request_id: str, timeout: Optional[float] = None, pump_kernel=True
+    ) -> Any:
+        "Block until the reply arrives, raising TimeoutError after timeout seconds"
+        event = self._events[request_id]
+        try:
+            if not pump_kernel or _get_kernel() is None:
+                if not event.wait(timeout):
+                    raise TimeoutError(f"no reply after {timeout} seconds")
+            else:
+                run_kernel_until(event.is_set, timeout)
+            return self._replies[request_id]
+        finally:
+            self._pop(request_id)
+
+    async def wait_async(self, request_id: str, timeout: Optional[float] = None):
+        "Like wait() but without blocking the event loop, see ValueWaiter.wait_async"
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        with self._lock:
+            done = self._events[request_id].is_set()
+            if not done:
+                self._callbacks[request_id] = lambda: loop.call_soon_threadsafe(
+                    resolve
+                )
+        try:
+            if not done:
+                await asyncio.wait_for(future, timeout)
+            return self._replies[request_id]
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"no reply after {timeout} seconds") from None
+        finally:
+            self._pop(request_id)
+
+
+class MapError(Exception):
+    """Raised by ObservableWidget.map() when some input sets failed or timed
+    out. results has the outputs of the others (None for these) and errors
+    the error message of each failed input set, by index."""
+
+    def __init__(self, results: List[Any], errors: Dict[int, str]):
+        first = min(errors)
+        super().__init__(
+            f"{len(errors)} of {len(results)} input sets failed, "
+            f"first input set {first}: {errors[first]}"
+        )
+        self.results = results
+        self.errors = errors
+
+
+class Batch:
+    """Results of ObservableWidget.map() arriving from the frontend, by
+    index. Only the first result for each index counts."""
+
+    def __init__(
+        self, total: int, on_progress: Optional[Callable[[int, int], None]] = None
+    ):
+        self.results = [None] * total
+        self.errors = {}
+        self.on_progress = on_progress
+        self._received = set()
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+        if not total:
+            self.done.set()
+
+    def receive(self, index: int, value: Any = None, error: str = None) -> None:
+        "Called with each result, on whichever thread it arrives"
+        with self._lock:
+            if index in self._received or not 0 <= index < len(self.results):
+                return
+            self._received.add(index)
+            if error is not None:
+                self.errors[index] = error
+            else:
+                self.results[index] = value
+            received = len(self._received)
+            if received == len(self.results):
+                self.done.set()
+        if self.on_progress is not None:
+            self.on_progress(received, len(self.results))
+
+    def wait(self, timeout: Optional[float] = None, pump_kernel=True) -> None:
+        "Block until every result arrived, raising TimeoutError after timeout seconds"
+        if not pump_kernel or _get_kernel() is None:
+            if not self.done.wait(timeout):
+                raise TimeoutError(f"no results after {timeout} seconds")
+        else:
+            run_kernel_until(self.done.is_set, timeout)
+
+    def time_out(self, timeout: Optional[float]) -> None:
+        self.fail_remaining(f"no result after {timeout} seconds")
+
+    def fail_remaining(self, error: str) -> None:
+        "Marks the input sets without results as failed"
+        with self._lock:
+            for index in range(len(self.results)):
+                if index not in self._received:
+                    self._received.add(index)
+                    self.errors[index] = error
+            self.done.set()
+
+    def result(self) -> List[Any]:
+        if self.errors:
+            raise MapError(self.results, self.errors)
+        return self.results
+
+
+def allow_nested_event_loops() -> None:
+    """Patches asyncio with nest_asyncio, so that loop.run_until_complete() can
+    be called while the kernel's event loop is running.
+
+    This changes every event loop in the process, so it's opt-in rather than
+    done on import. Blocking waits that process kernel messages apply it too
+    on ipykernel 6+, see run_kernel_until()."""
+    import nest_asyncio
+
+    nest_asyncio.apply()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Running embeds without a browser, for papermill, nbconvert and scheduled jobs.
+"""
+import base64
+import json
+import os
+import subprocess
+import threading
+from typing import Any, Dict, Optional
+
+from ipywidgets.widgets.widget import _remove_buffers
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNNER = os.path.join(HERE, "node", "runner.mjs")
+# copied here by `yarn run build:lib`, or straight from the source tree
+IFRAME_CODE_PATHS = [
+    os.path.join(HERE, "node", "iframe_code.js"),
+    os.path.join(os.path.dirname(HERE), "src", "iframe_code.js"),
+]
+
+
+class HeadlessRuntime:
+    """Runs Observable notebooks in a Node.js process instead of a browser.
+
+    Pass one as ObservableWidget(..., runtime=HeadlessRuntime(modules_dir))
+    and inputs and outputs work as usual, whether or not the widget is ever
+    displayed. Each widget gets its own process.
+
+    Nothing is fetched from the network: modules_dir must contain the
+    Observable runtime as runtime.js and a compiled module for each notebook,
+    e.g. @user/notebook.js, as served by
+    https://api.observablehq.com/@user/notebook.js?v=3 (including any notebooks
+    it imports from). Cells that need a DOM won't run.
+    """
+
+    def __init__(self, modules_dir: str, *, node: str = "node"):
+        self.modules_dir = os.path.abspath(modules_dir)
+        self.node = node
+
+    def start(self, widget: Any) -> "HeadlessProcess":
+        return HeadlessProcess(self, widget)
+
+
+class HeadlessProcess:
+    "A Node.js process running one widget's notebook"
+
+    def __init__(self, runtime: HeadlessRuntime, widget: Any):
+        self.widget = widget
+        config = {
+            "slug": widget.slug,
+            "cells": widget.cells,
+            "outputs": widget.outputs,
+            "options": widget._embed_options(),
+            "modulesDir": runtime.modules_dir,
+            "iframeCode": _iframe_code_path(),
+        }
+        self.process = subprocess.Popen(
+            [runtime.node, RUNNER, json.dumps(config)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self._write_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def send_inputs(
+        self, encoded_inputs: Dict[str, Any], versions: Dict[str, int] = None
+    ) -> None:
+        """Sends already encoded inputs, see _serialization.inputs_to_json, and
+        their versions, which outputs computed from them are tagged with"""
+        self.send(
+            {"type": "inputs", "inputs": encoded_inputs, "versions": versions or {}}
+        )
+
+    def send(self, msg: Dict[str, Any]) -> None:
+        """Sends a message like the ones the widget view posts to its iframe,
+        already encoded (any memoryviews are sent base64 encoded)"""
+        state, buffer_paths, buffers = _remove_buffers(msg)
+        msg = {
+            **state,
+            "buffer_paths": buffer_paths,
+            "buffers": [base64.b64encode(b).decode("ascii") for b in buffers],
+        }
+        with self._write_lock:
+            self.process.stdin.write(json.dumps(msg) + "\n")
+            self.process.stdin.flush()
+
+    def _read(self) -> None:
+        for line in self.process.stdout:
+            # the same messages the widget view forwards to the kernel
+            msg = json.loads(line)
+            buffers = [base64.b64decode(b) for b in msg.pop("buffers", [])]
+            self.widget._handle_custom_msg(self.widget, msg, buffers)
+
+    @property
+    def running(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self, timeout: Optional[float] = 5) -> None:
+        if self.running:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def _iframe_code_path() -> str:
+    for path in IFRAME_CODE_PATHS:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        "iframe_code.js not found, run `yarn run build:lib` to copy it to "
+        + IFRAME_CODE_PATHS[0]
+    )
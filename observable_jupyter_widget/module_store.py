@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+On-disk cache of compiled Observable notebook modules and runtime assets.
+
+The Jupyter server extension (_server_extension.py) serves these to embeds
+created with ObservableWidget(..., local_modules=True), and the directory can
+be passed to HeadlessRuntime as its modules_dir.
+
+    <directory>/runtime.js                 @observablehq/runtime
+    <directory>/inspector.css              @observablehq/inspector styles
+    <directory>/@user/notebook.js          https://api.observablehq.com/@user/notebook.js?v=3
+    <directory>/@user/notebook.js.json     ETag and fetch time of the above
+"""
+import json
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Iterable, Optional
+
+# Exact versions, the same as the CDN URLs in src/iframe_code.js and
+# src/iframe_pool.ts, so embeds and headless runs get the same runtime whether
+# or not it's served from the store
+RUNTIME_VERSION = "4.18.0"
+INSPECTOR_VERSION = "3.2.4"
+
+MODULES_URL = "https://api.observablehq.com/"
+UPSTREAM_URLS = {
+    "runtime.js": f"https://cdn.jsdelivr.net/npm/@observablehq/runtime@{RUNTIME_VERSION}/dist/runtime.js",
+    "inspector.css": f"https://cdn.jsdelivr.net/npm/@observablehq/inspector@{INSPECTOR_VERSION}/dist/inspector.css",
+}
+
+# notebooks imported by a compiled notebook module
+IMPORT_RE = re.compile(r"https://api\.observablehq\.com/([^\"'?]+)\.js")
+
+
+def default_directory() -> str:
+    return os.environ.get(
+        "OBSERVABLE_JUPYTER_WIDGET_MODULES",
+        os.path.join(
+            os.path.expanduser("~"), ".cache", "observable_jupyter_widget", "modules"
+        ),
+    )
+
+
+class ModuleStore:
+    """A directory of cached modules, revalidated against upstream once they
+    are older than max_age seconds. When offline, only the directory is used.
+    If upstream can't be reached, stale copies are used rather than failing.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        *,
+        offline: bool = False,
+        max_age: float = 3600,
+    ):
+        self.directory = os.path.abspath(directory or default_directory())
+        self.offline = offline
+        self.max_age = max_age
+
+    @classmethod
+    def from_environment(cls) -> "ModuleStore":
+        "Configured by OBSERVABLE_JUPYTER_WIDGET_MODULES and _OFFLINE"
+        offline = os.environ.get("OBSERVABLE_JUPYTER_WIDGET_OFFLINE", "") not in (
+            "",
+            "0",
+        )
+        return cls(offline=offline)
+
+    def get(self, path: str) -> bytes:
+        """Contents of runtime.js, inspector.css or a notebook module like
+        @user/notebook.js, fetching or revalidating it if needed.
+
+        Raises FileNotFoundError if it's not cached and can't be fetched."""
+        filename = self._filename(path)
+        meta = self._read_meta(filename)
+        # not fresh if it came from a different URL, e.g. an older runtime
+        url = self.upstream_url(path)
+        fresh = (
+            meta
+            and meta.get("url", url) == url
+            and time.time() - meta.get("fetched_at", 0) < self.max_age
+        )
+        if os.path.exists(filename) and (fresh or self.offline):
+            return _read(filename)
+        if self.offline:
+            raise FileNotFoundError(f"{path} is not in {self.directory}")
+        try:
+            return self._fetch(path, filename, meta if os.path.exists(filename) else {})
+        except (urllib.error.URLError, OSError):
+            if os.path.exists(filename):
+                return _read(filename)
+            raise FileNotFoundError(f"could not fetch {self.upstream_url(path)}")
+
+    def prefetch(self, slugs: Iterable[str]) -> None:
+        """Cache the runtime and the modules for these notebooks, including
+        the notebooks they import."""
+        for path in UPSTREAM_URLS:
+            self.get(path)
+        todo = list(slugs)
+        seen = set()
+        while todo:
+            slug = todo.pop()
+            if slug in seen:
+                continue
+            seen.add(slug)
+            source = self.get(slug + ".js").decode("utf-8")
+            todo.extend(IMPORT_RE.findall(source))
+
+    def cached(self, slugs: Iterable[str]) -> bool:
+        """Whether the runtime and the modules for these notebooks, including
+        the notebooks they import, are all in the store, fresh or not."""
+        for path in UPSTREAM_URLS:
+            filename = self._filename(path)
+            url = self._read_meta(filename).get("url", self.upstream_url(path))
+            if not os.path.exists(filename) or url != self.upstream_url(path):
+                return False
+        todo = list(slugs)
+        seen = set()
+        while todo:
+            slug = todo.pop()
+            if slug in seen:
+                continue
+            seen.add(slug)
+            try:
+                source = _read(self._filename(slug + ".js")).decode("utf-8")
+            except OSError:
+                return False
+            todo.extend(IMPORT_RE.findall(source))
+        return True
+
+    def upstream_url(self, path: str) -> str:
+        if path in UPSTREAM_URLS:
+            return UPSTREAM_URLS[path]
+        return MODULES_URL + path + "?v=3"
+
+    def _filename(self, path: str) -> str:
+        filename = os.path.abspath(os.path.join(self.directory, path))
+        if not filename.startswith(self.directory + os.sep) or (
+            path not in UPSTREAM_URLS and not path.endswith(".js")
+        ):
+            raise ValueError(f"not a module path: {path!r}")
+        return filename
+
+    def _read_meta(self, filename: str) -> Dict:
+        try:
+            with open(filename + ".json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _fetch(self, path: str, filename: str, meta: Dict) -> bytes:
+        request = urllib.request.Request(self.upstream_url(path))
+        if meta.get("url", request.full_url) != request.full_url:
+            meta = {}
+        if meta.get("etag"):
+            request.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            request.add_header("If-Modified-Since", meta["last_modified"])
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                content = response.read()
+                meta = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            content = _read(filename)
+        else:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            _write(filename, content)
+        meta["url"] = request.full_url
+        meta["fetched_at"] = time.time()
+        _write(filename + ".json", json.dumps(meta).encode("utf-8"))
+        return content
+
+
+def prefetch(slugs: Iterable[str], directory: Optional[str] = None) -> None:
+    """Download notebook modules and the Observable runtime ahead of time,
+    e.g. prefetch(["@ballingt/embedding-example"])."""
+    ModuleStore(directory).prefetch(slugs)
+
+
+def _read(filename: str) -> bytes:
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def _write(filename: str, content: bytes) -> None:
+    # write then rename so readers never see a partial file
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, filename)
@@ -0,0 +1,40 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+// Node.js module resolution hooks for runner.mjs: the URLs that
+// iframe_code.js and compiled Observable notebooks import from are resolved
+// to files in a local directory, so headless embeds work offline.
+//
+//   https://api.observablehq.com/@user/notebook.js?v=3  ->  <dir>/@user/notebook.js
+//   https://cdn.jsdelivr.net/npm/@observablehq/runtime@4.18.0/dist/runtime.js  ->  <dir>/runtime.js
+
+let modulesDir;
+
+export async function initialize(data) {
+  modulesDir = data.modulesDir;
+}
+
+export async function resolve(specifier, context, nextResolve) {
+  let url;
+  try {
+    url = new URL(specifier);
+  } catch (e) {
+    // relative or bare specifier
+    return nextResolve(specifier, context);
+  }
+  if (url.hostname === 'api.observablehq.com') {
+    return {
+      url: new URL('.' + url.pathname, modulesDir).href,
+      shortCircuit: true,
+    };
+  }
+  if (url.pathname.startsWith('/npm/@observablehq/runtime')) {
+    return { url: new URL('runtime.js', modulesDir).href, shortCircuit: true };
+  }
+  if (url.protocol === 'https:' || url.protocol === 'http:') {
+    throw new Error(
+      `${specifier} is not available offline, add it to ${modulesDir}`
+    );
+  }
+  return nextResolve(specifier, context);
+}
@@ -0,0 +1,128 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+// Runs embed() from iframe_code.js in Node.js, for HeadlessRuntime.
+// The parent window is replaced by stdin and stdout: each line is one JSON
+// message, the same messages the widget view exchanges with its iframe.
+// Binary buffers of inputs arrive base64 encoded alongside their paths, and
+// those of binary outputs are sent the same way.
+//
+// usage: node runner.mjs '<config json>'
+import { register } from 'node:module';
+import { createInterface } from 'node:readline';
+import { pathToFileURL } from 'node:url';
+
+const config = JSON.parse(process.argv[2]);
+register('./loader.mjs', import.meta.url, {
+  data: { modulesDir: pathToFileURL(config.modulesDir + '/').href },
+});
+
+const listeners = [];
+const parent = {
+  postMessage(data) {
+    if (data.type !== 'iframeSize') {
+      process.stdout.write(JSON.stringify(removeBuffers(data)) + '\n');
+    }
+  },
+};
+globalThis.window = {
+  parent,
+  addEventListener(type, listener) {
+    if (type === 'message') {
+      listeners.push(listener);
+    }
+  },
+  removeEventListener(type, listener) {
+    const i = listeners.indexOf(listener);
+    if (i !== -1) {
+      listeners.splice(i, 1);
+    }
+  },
+};
+
+function putBuffers(msg) {
+  const { buffer_paths = [], buffers = [] } = msg;
+  buffer_paths.forEach((path, i) => {
+    const bytes = Buffer.from(buffers[i], 'base64');
+    let obj = msg;
+    for (const key of path.slice(0, -1)) {
+      obj = obj[key];
+    }
+    obj[path[path.length - 1]] = bytes.buffer.slice(
+      bytes.byteOffset,
+      bytes.byteOffset + bytes.byteLength
+    );
+  });
+  return msg;
+}
+
+function removeBuffers(data) {
+  const buffer_paths = [];
+  const buffers = [];
+  const walk = (value, path) => {
+    if (value instanceof ArrayBuffer) {
+      buffer_paths.push(path);
+      buffers.push(Buffer.from(value).toString('base64'));
+      return null;
+    }
+    if (value === null || typeof value !== 'object') {
+      return value;
+    }
+    if (Array.isArray(value)) {
+      return value.map((v, i) => walk(v, [...path, i]));
+    }
+    const copy = {};
+    for (const key of Object.keys(value)) {
+      copy[key] = walk(value[key], [...path, key]);
+    }
+    return copy;
+  };
+  const state = walk(data, []);
+  return buffers.length ? { ...state, buffer_paths, buffers } : state;
+}
+
+const { embed, evaluate } = await import(pathToFileURL(config.iframeCode).href);
+await embed(config.slug, null, config.cells, config.outputs, config.options);
+
+// ObservableWidget.map(): up to `workers` runtimes evaluating input sets
+// concurrently in this process
+const cancelledMaps = new Set();
+async function runMap({ request_id, inputs, outputs, workers }) {
+  let next = 0;
+  const worker = async () => {
+    while (next < inputs.length && !cancelledMaps.has(request_id)) {
+      const index = next++;
+      const result = { type: 'mapped', request_id, index };
+      try {
+        result.value = await evaluate(
+          config.slug,
+          outputs,
+          inputs[index],
+          config.options
+        );
+      } catch (error) {
+        result.error = String(error?.message ?? error);
+      }
+      parent.postMessage(result);
+    }
+  };
+  const count = Math.max(1, Math.min(workers, inputs.length));
+  await Promise.all(Array.from({ length: count }, worker));
+  cancelledMaps.delete(request_id);
+}
+
+createInterface({ input: process.stdin }).on('line', (line) => {
+  const data = putBuffers(JSON.parse(line));
+  if (data.type === 'map') {
+    runMap(data);
+    return;
+  }
+  if (data.type === 'cancel_map') {
+    cancelledMaps.add(data.request_id);
+    return;
+  }
+  for (const listener of listeners) {
+    listener({ data, source: parent });
+  }
+});
+process.stdin.on('end', () => process.exit(0));
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+On-disk cache of the outputs computed for a notebook and its inputs.
+
+With ObservableWidget(..., output_cache=OutputCache()) a widget whose notebook,
+cells, outputs, inputs and options match an earlier run gets that run's .value
+as soon as it's constructed, so "Restart and Run All" doesn't wait for the
+browser. Only the first complete value computed for the inputs a widget was
+created with is stored, later redefine() and append() calls and interactions
+aren't.
+
+    <directory>/<key>.out     JSON line of the value and buffer sizes, then the buffers
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from ipywidgets.widgets.widget import _put_buffers, _remove_buffers
+
+from ._serialization import encode
+
+
+def default_directory() -> str:
+    return os.environ.get(
+        "OBSERVABLE_JUPYTER_WIDGET_OUTPUTS",
+        os.path.join(
+            os.path.expanduser("~"), ".cache", "observable_jupyter_widget", "outputs"
+        ),
+    )
+
+
+class OutputCache:
+    """A directory of cached outputs, the least recently used evicted once
+    they add up to more than max_bytes.
+
+    Keys include the compiled notebook module's version when it's in
+    modules_dir (the module store, or a HeadlessRuntime's modules_dir).
+    Outputs of notebooks loaded from the CDN aren't invalidated when the
+    notebook changes, call clear() after editing one.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        *,
+        max_bytes: int = 256 * 1024 * 1024,
+        modules_dir: Optional[str] = None,
+    ):
+        self.directory = os.path.abspath(directory or default_directory())
+        self.max_bytes = max_bytes
+        if modules_dir is None:
+            # imported here, module_store imports urllib
+            from .module_store import default_directory as modules_directory
+
+            modules_dir = modules_directory()
+        self.modules_dir = os.path.abspath(modules_dir)
+
+    def key(
+        self,
+        slug: str,
+        cells: Optional[List[str]],
+        outputs: Optional[List[str]],
+        inputs: Optional[Dict[str, Any]],
+        modules_dir: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """The key of a notebook's outputs for these cells and inputs, and the
+        widget options that change what .value holds (binary_outputs,
+        output_budget, lazy...)"""
+        state, buffer_paths, buffers = _remove_buffers(encode(inputs or {}))
+        h = hashlib.blake2b(digest_size=20)
+        header = {
+            "slug": slug,
+            "module_version": self.module_version(slug, modules_dir),
+            "cells": cells,
+            "outputs": outputs,
+            "inputs": state,
+            "buffer_paths": buffer_paths,
+            "options": options or {},
+        }
+        h.update(json.dumps(header, sort_keys=True, default=repr).encode("utf-8"))
+        for buffer in buffers:
+            h.update(memoryview(buffer).cast("B"))
+        return h.hexdigest()
+
+    def module_version(self, slug: str, modules_dir: Optional[str] = None) -> str:
+        "Hash of the compiled notebook module, or '' if it isn't cached locally"
+        filename = os.path.join(modules_dir or self.modules_dir, slug + ".js")
+        try:
+            with open(filename, "rb") as f:
+                return hashlib.blake2b(f.read(), digest_size=20).hexdigest()
+        except OSError:
+            return ""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        "The value stored for key, or None"
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as f:
+                header, _, data = f.read().partition(b"\n")
+            header = json.loads(header)
+        except (OSError, ValueError):
+            return None
+        # the access time is unreliable (noatime mounts), mark it as used
+        os.utime(filename)
+        buffers = []
+        offset = 0
+        data = memoryview(data)
+        for size in header["buffer_sizes"]:
+            buffers.append(data[offset : offset + size])
+            offset += size
+        value = header["value"]
+        _put_buffers(value, header["buffer_paths"], buffers)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        state, buffer_paths, buffers = _remove_buffers(value)
+        buffers = [memoryview(b).cast("B") for b in buffers]
+        header = {
+            "value": state,
+            "buffer_paths": buffer_paths,
+            "buffer_sizes": [b.nbytes for b in buffers],
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self._filename(key)
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for buffer in buffers:
+                f.write(buffer)
+        os.replace(tmp, filename)
+        self.evict()
+
+    def evict(self) -> None:
+        "Removes the least recently used outputs until they fit in max_bytes"
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".out"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".out"):
+                os.remove(entry.path)
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".out")
@@ -8,6 +8,20 @@ import pytest
 
 from ipykernel.comm import Comm
 from ipywidgets import Widget
+from ipywidgets.widgets import widget as widget_module
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--update-benchmarks',
+        action='store_true',
+        help='record the results of test_benchmarks.py as the new baselines',
+    )
+    parser.addoption(
+        '--benchmarks',
+        action='store_true',
+        help='also fail when timings are much worse than their baselines',
+    )
+
 
 class MockComm(Comm):
     """A mock Comm object.
@@ -40,13 +54,20 @@ undefined = object()
 def mock_comm():
     _widget_attrs['_comm_default'] = getattr(Widget, '_comm_default', undefined)
     Widget._comm_default = lambda self: MockComm()
-    _widget_attrs['_ipython_display_'] = Widget._ipython_display_
+    _widget_attrs['_ipython_display_'] = getattr(Widget, '_ipython_display_', undefined)
     def raise_not_implemented(*args, **kwargs):
         raise NotImplementedError()
     Widget._ipython_display_ = raise_not_implemented
+    # newer ipywidgets create comms with comm.create_comm
+    create_comm = getattr(widget_module, 'comm', None)
+    if create_comm is not None:
+        original_create_comm = create_comm.create_comm
+        create_comm.create_comm = lambda *args, **kwargs: MockComm()
 
     yield MockComm()
 
+    if create_comm is not None:
+        create_comm.create_comm = original_create_comm
     for attr, value in _widget_attrs.items():
         if value is undefined:
             delattr(Widget, attr)
@@ -0,0 +1,17 @@
+// Compiled notebook module for test_headless.py:  doubled = x * 2, and
+// squared = x * x computed in Python
+export default function define(runtime, observer) {
+  const main = runtime.module();
+  main.variable(observer('x')).define('x', [], () => 1);
+  main.variable(observer('doubled')).define('doubled', ['x'], (x) => x * 2);
+  main.variable(observer('total')).define('total', ['data'], (data) =>
+    data.reduce((sum, row) => sum + row.value, 0)
+  );
+  main.variable(observer('data')).define('data', [], () => []);
+  main
+    .variable(observer('squared'))
+    .define('squared', ['jupyter', 'x'], (jupyter, x) =>
+      jupyter.call('square', [x])
+    );
+  return main;
+}
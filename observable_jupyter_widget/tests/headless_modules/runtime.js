@@ -0,0 +1,105 @@
+// A tiny stand-in for @observablehq/runtime used by test_headless.py, with
+// just enough of its API for embed() in iframe_code.js. Everything is
+// recomputed in definition order after any change; values may be Promises.
+class Variable {
+  constructor(module, observer) {
+    this._module = module;
+    this._observer = observer;
+  }
+  define(...args) {
+    const name = typeof args[0] === 'string' ? args.shift() : null;
+    const inputs = Array.isArray(args[0]) ? args.shift() : [];
+    let definition = args[0];
+    if (typeof definition !== 'function') {
+      const value = definition;
+      definition = () => value;
+    }
+    Object.assign(this, { _name: name, _inputs: inputs, _definition: definition });
+    if (name) {
+      this._module._scope.set(name, this);
+    }
+    this._module._schedule();
+    return this;
+  }
+}
+
+class Module {
+  constructor(runtime) {
+    this._runtime = runtime;
+    this._scope = new Map();
+    this._variables = [];
+  }
+  variable(observer) {
+    const variable = new Variable(this, observer);
+    this._variables.push(variable);
+    return variable;
+  }
+  redefine(name, value) {
+    const variable = this._scope.get(name);
+    if (!variable) {
+      throw new Error(name + ' is not defined');
+    }
+    return variable.define(name, [], () => value);
+  }
+  _schedule() {
+    clearTimeout(this._timer);
+    this._timer = setTimeout(() => this._compute(), 0);
+  }
+  _compute() {
+    const values = new Map();
+    const builtins = this._runtime._builtins;
+    const get = (v) => {
+      if (!values.has(v)) {
+        const inputs = v._inputs.map((name) =>
+          this._scope.has(name)
+            ? get(this._scope.get(name))
+            : Promise.resolve(builtins[name]())
+        );
+        values.set(
+          v,
+          Promise.all(inputs).then((args) => v._definition(...args))
+        );
+      }
+      return values.get(v);
+    };
+    for (const variable of this._variables) {
+      const observer = variable._observer;
+      if (observer && observer.fulfilled) {
+        if (observer.pending) {
+          observer.pending();
+        }
+        get(variable).then(
+          (value) => observer.fulfilled(value, variable._name),
+          (error) => observer.rejected && observer.rejected(error)
+        );
+      }
+    }
+  }
+}
+
+export class Library {}
+
+export class Runtime {
+  constructor(builtins = new Library()) {
+    this._builtins = builtins;
+  }
+  module(define, observer) {
+    if (define === undefined) {
+      return this._init || new Module(this);
+    }
+    const module = (this._init = new Module(this));
+    try {
+      define(this, observer);
+    } finally {
+      this._init = null;
+    }
+    return module;
+  }
+  dispose() {}
+}
+
+export class Inspector {
+  static into() {
+    return () => new Inspector();
+  }
+}
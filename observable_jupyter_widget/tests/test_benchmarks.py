@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+"""
+Benchmarks of the paths whose cost grows with the data: encoding inputs, the
+bytes sent per redefine() and receiving outputs into .value.
+
+Results are compared with benchmark_baseline.json. Sizes in bytes are exact,
+times are compared as speedups over JSON (which vary less between machines
+than times do), and only with --benchmarks since they still depend on the
+machine and its load. After an intended change, record new baselines with
+
+    pytest observable_jupyter_widget/tests/test_benchmarks.py --update-benchmarks -s
+"""
+import json
+import os
+import timeit
+
+import numpy as np
+import pandas as pd
+import pytest
+from ipywidgets.widgets.widget import _remove_buffers
+
+from .._blobs import BlobStore
+from .._serialization import encode
+from ..widget import ObservableWidget, jsonify
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+SIZES = [1_000, 10_000, 100_000]
+# how much worse than the baseline a result can be before failing
+BYTES_TOLERANCE = 1.1
+SPEEDUP_TOLERANCE = 0.5
+
+
+class Results:
+    def __init__(self, baseline, update, check_times):
+        self.baseline = baseline
+        self.update = update
+        self.check_times = check_times
+        self.results = {}
+
+    def bytes(self, name, value):
+        self.results[name] = value
+        expected = self.baseline.get(name)
+        if expected is not None and not self.update:
+            assert (
+                value <= expected * BYTES_TOLERANCE
+            ), f"{name} is {value} bytes, baseline {expected}"
+
+    def speedup(self, name, value):
+        self.results[name] = round(value, 2)
+        expected = self.baseline.get(name)
+        if expected is not None and self.check_times and not self.update:
+            assert (
+                value >= expected * SPEEDUP_TOLERANCE
+            ), f"{name} is {value:.2f}x, baseline {expected}x"
+
+
+@pytest.fixture(scope="module")
+def results(request):
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    update = request.config.getoption("--update-benchmarks")
+    check_times = request.config.getoption("--benchmarks")
+    results = Results(baseline, update, check_times)
+    yield results
+    print(json.dumps(results.results, indent=2, sort_keys=True))
+    if update:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({**baseline, **results.results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "x": rng.random(rows),
+            "n": np.arange(rows, dtype="int32"),
+            "label": [f"item {i % 100}" for i in range(rows)],
+        }
+    )
+
+
+def best_time(fn, repeat=3):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def sent_bytes(*comms):
+    "Bytes of JSON and buffers sent through these MockComms, clearing their logs"
+    total = 0
+    for comm in comms:
+        for _, kwargs in comm.log_send:
+            total += len(json.dumps(kwargs["data"]))
+            total += sum(memoryview(b).nbytes for b in kwargs.get("buffers") or [])
+        comm.log_send.clear()
+    return total
+
+
+def test_encoding_inputs(results):
+    for rows in SIZES:
+        df = make_frame(rows)
+        json_time = best_time(lambda: jsonify(df))
+        encode_time = best_time(lambda: _remove_buffers(encode(df)))
+        results.speedup(f"encode_speedup_{rows}", json_time / encode_time)
+
+
+def test_bytes_per_redefine(mock_comm, results):
+    for rows in SIZES:
+        BlobStore.instance().close()
+        store = BlobStore.instance()
+        w = ObservableWidget("@fakeauthor/fakenotebook")
+        df = make_frame(rows)
+        sent_bytes(w.comm, store.comm)
+        w.redefine(data=df)
+        results.bytes(f"redefine_bytes_{rows}", sent_bytes(w.comm, store.comm))
+        # a re-run cell with the same data
+        w.redefine(data=df.copy())
+        results.bytes(f"redefine_again_bytes_{rows}", sent_bytes(w.comm, store.comm))
+        w.close()
+
+
+def outputs_message(value, binary):
+    "The JSON and buffers of an 'outputs' message from the view"
+    if binary:
+        value = encode(value)
+    else:
+        value = json.loads(value.to_json(orient="records"))
+    state, buffer_paths, buffers = _remove_buffers(
+        {"type": "outputs", "outputs": {"data": value}, "partial": True}
+    )
+    return json.dumps({**state, "buffer_paths": buffer_paths}), buffers
+
+
+def test_receiving_outputs(results):
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+
+    def receive(message, buffers):
+        content = json.loads(message)
+        w._handle_custom_msg(w, content, [bytes(b) for b in buffers])
+        return w.value_as_frame("data")
+
+    for rows in SIZES:
+        df = make_frame(rows)
+        times = {}
+        for kind in ("json", "binary"):
+            message, buffers = outputs_message(df, kind == "binary")
+            size = len(message) + sum(b.nbytes for b in buffers)
+            results.bytes(f"outputs_bytes_{kind}_{rows}", size)
+            assert receive(message, buffers)["n"].tolist() == df["n"].tolist()
+            times[kind] = best_time(lambda: receive(message, buffers))
+        results.speedup(f"outputs_speedup_{rows}", times["json"] / times["binary"])
+    w.close()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .._serialization import is_deferred
+from .._waiting import MapError
+from ..headless import HeadlessRuntime
+from ..module_store import ModuleStore, RUNTIME_VERSION
+from ..widget import ObservableWidget
+
+# runtime.js here is a minimal stand-in for @observablehq/runtime
+MODULES_DIR = os.path.join(os.path.dirname(__file__), "headless_modules")
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# a compiled notebook importing from another one, like those the API serves
+REAL_NOTEBOOK = """\
+import define1 from "https://api.observablehq.com/@fakeauthor/imported.js?v=3";
+
+export default function define(runtime, observer) {
+  const main = runtime.module();
+  main.variable(observer("x")).define("x", () => 1);
+  const child1 = runtime.module(define1);
+  main.import("base", child1);
+  main.variable(observer("total")).define("total", ["base", "x"], (base, x) => base + x);
+  main.variable(observer("delayed")).define("delayed", ["Promises", "x"], (Promises, x) =>
+    Promises.delay(10, x * 2)
+  );
+  main.variable(observer("counter")).define("counter", ["x"], function* (x) {
+    for (let i = 1; i <= 3; i++) yield x * i;
+  });
+  main.variable(observer("squared")).define("squared", ["jupyter", "x"], (jupyter, x) =>
+    jupyter.call("square", [x])
+  );
+  return main;
+}
+"""
+IMPORTED_NOTEBOOK = """\
+export default function define(runtime, observer) {
+  const main = runtime.module();
+  main.variable(observer("base")).define("base", () => 10);
+  return main;
+}
+"""
+
+pytestmark = pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+
+
+@pytest.mark.parametrize("output_mode", ["aggregate", "per_cell"])
+def test_headless_inputs_and_outputs(output_mode):
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 5},
+        outputs=["doubled", "total"],
+        output_mode=output_mode,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        assert w.wait_for(["doubled", "total"], timeout=10)["doubled"] == 10
+        w.redefine(data=pd.DataFrame({"value": np.array([1.5, 2.5])}))
+        value = w.wait_for(["total"], timeout=10, next_value=True)
+        assert value == {"doubled": 10, "total": 4}
+    finally:
+        w.close()
+    assert not w._headless.running
+
+
+def test_headless_replaced_inputs():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 5},
+        outputs=["doubled"],
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        assert w.wait_for(["doubled"], timeout=10)["doubled"] == 10
+        w.inputs = {"x": 7}
+        assert w.wait_for(timeout=10, next_value=True)["doubled"] == 14
+    finally:
+        w.close()
+
+
+def test_headless_fetch_outputs_over_budget():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 5},
+        outputs=["doubled", "data"],
+        output_budget=20,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        w.redefine(data=[{"value": i} for i in range(10)])
+        value = w.wait_for(["data"], timeout=10, next_value=True)
+        assert value["doubled"] == 10
+        assert is_deferred(value["data"]) and value["data"]["length"] == 10
+        assert w.fetch("data", offset=8, timeout=10) == [{"value": 8}, {"value": 9}]
+        with pytest.raises(KeyError):
+            w.fetch("nonexistent", timeout=10)
+    finally:
+        w.close()
+
+
+def test_headless_fetch_slices_binary_outputs():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        outputs=["data"],
+        output_budget=20,
+        binary_outputs=True,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        w.redefine(data=[{"value": float(i), "name": str(i)} for i in range(10)])
+        value = w.wait_for(timeout=10, next_value=True)
+        assert is_deferred(value["data"]) and value["data"]["length"] == 10
+        df = w.fetch("data", offset=8, timeout=10)
+        assert df["value"].tolist() == [8.0, 9.0] and df["name"].tolist() == ["8", "9"]
+
+        w.redefine(data=np.arange(10, dtype="int32"))
+        w.wait_for(timeout=10, next_value=True)
+        arr = w.fetch("data", offset=2, limit=3, timeout=10)
+        assert arr.dtype == "int32" and arr.tolist() == [2, 3, 4]
+    finally:
+        w.close()
+
+
+def test_headless_budget_counts_binary_outputs():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        outputs=["data"],
+        output_budget=200,
+        binary_outputs=True,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        w.redefine(data=np.arange(5, dtype="int32"))
+        w.wait_for(timeout=10, next_value=True)
+        assert w.as_numpy("data").tolist() == [0, 1, 2, 3, 4]
+
+        w.redefine(data=np.arange(100, dtype="float64"))
+        value = w.wait_for(timeout=10, next_value=True)
+        assert is_deferred(value["data"]) and value["data"]["size"] > 800
+    finally:
+        w.close()
+
+
+def test_headless_calls_python_handlers():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        outputs=["squared"],
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    w.register_handler("square", lambda x: x * x)
+    try:
+        w.redefine(x=7)
+        assert w.wait_for(["squared"], timeout=10)["squared"] == 49
+    finally:
+        w.close()
+
+
+def test_headless_append_keeps_a_window_of_rows():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"data": [{"value": 1}]},
+        outputs=["total"],
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        assert w.wait_for(["total"], timeout=10)["total"] == 1
+        w.append("data", pd.DataFrame({"value": [2.0, 3.0]}))
+        assert w.wait_for(timeout=10, next_value=True)["total"] == 6
+        w.append("data", [{"value": 10}], window=2)
+        assert w.wait_for(timeout=10, next_value=True)["total"] == 13
+    finally:
+        w.close()
+
+
+def test_headless_binary_outputs():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        outputs=["data"],
+        binary_outputs=True,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        rows = [{"value": 1.5, "name": "a", "ok": True}, {"value": None, "ok": False}]
+        w.redefine(data=rows)
+        w.wait_for(timeout=10, next_value=True)
+        df = w.value_as_frame("data")
+        assert df["value"].dtype == "float64" and np.isnan(df["value"][1])
+        assert df["name"][0] == "a" and pd.isna(df["name"][1])
+        assert df["ok"].tolist() == [True, False]
+
+        w.redefine(data=np.arange(5, dtype="int32"))
+        w.wait_for(timeout=10, next_value=True)
+        arr = w.as_numpy("data")
+        assert arr.dtype == "int32" and arr.tolist() == [0, 1, 2, 3, 4]
+    finally:
+        w.close()
+
+
+def test_headless_stats():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 5},
+        outputs=["doubled"],
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    try:
+        w.wait_for(["doubled"], timeout=10)
+        deadline = time.monotonic() + 10
+        while "doubled" not in w.stats.get("cells", {}):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert w.stats_summary()["cell_computations"] >= 1
+        assert w.stats_summary()["module_load_ms"] >= 0
+    finally:
+        w.close()
+
+
+def test_headless_map():
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 5},
+        outputs=["doubled"],
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    progress = []
+    try:
+        inputs = [{"x": i} for i in range(10)]
+        results = w.map(
+            inputs, workers=3, timeout=10, on_progress=lambda *p: progress.append(p)
+        )
+        assert results == [{"doubled": i * 2} for i in range(10)]
+        assert progress[-1] == (10, 10)
+        with pytest.raises(MapError) as e:
+            w.map([{"x": 1}, {"nonexistent": 1}], ["doubled", "total"], timeout=10)
+        assert e.value.results == [{"doubled": 2, "total": 0}, None]
+        assert "nonexistent" in e.value.errors[1]
+        # the widget's own notebook is unaffected
+        assert w.wait_for(["doubled"], timeout=10)["doubled"] == 10
+    finally:
+        w.close()
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_headless_lazy_computes_only_needed_cells(lazy):
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook",
+        inputs={"x": 4},
+        outputs=["doubled"],
+        lazy=lazy,
+        runtime=HeadlessRuntime(MODULES_DIR),
+    )
+    calls = []
+    w.register_handler("square", lambda x: calls.append(x) or x * x)
+    try:
+        # recomputed now that the handler is registered
+        w.redefine(x=4)
+        assert w.wait_for(["doubled"], timeout=10)["doubled"] == 8
+        deadline = time.monotonic() + (0.5 if lazy else 10)
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # squared calls Python, and no output depends on it
+        assert bool(calls) == (not lazy)
+    finally:
+        w.close()
+
+
+def real_runtime():
+    """dist/runtime.js of the pinned @observablehq/runtime, installed with
+    yarn or cached by the module store, or None"""
+    package = os.path.join(ROOT, "node_modules", "@observablehq", "runtime")
+    try:
+        with open(os.path.join(package, "package.json")) as f:
+            if json.load(f)["version"] == RUNTIME_VERSION:
+                return os.path.join(package, "dist", "runtime.js")
+    except (OSError, ValueError, KeyError):
+        pass
+    store = ModuleStore(offline=True)
+    if store.cached([]):
+        return os.path.join(store.directory, "runtime.js")
+    return None
+
+
+@pytest.mark.skipif(
+    real_runtime() is None,
+    reason=f"needs @observablehq/runtime@{RUNTIME_VERSION} (yarn install)",
+)
+def test_headless_real_runtime(tmp_path):
+    shutil.copy(real_runtime(), tmp_path / "runtime.js")
+    (tmp_path / "@fakeauthor").mkdir()
+    (tmp_path / "@fakeauthor" / "real.js").write_text(REAL_NOTEBOOK)
+    (tmp_path / "@fakeauthor" / "imported.js").write_text(IMPORTED_NOTEBOOK)
+    outputs = ["total", "delayed", "counter", "squared"]
+    w = ObservableWidget(
+        "@fakeauthor/real",
+        inputs={"x": 2},
+        outputs=outputs,
+        runtime=HeadlessRuntime(str(tmp_path)),
+    )
+    w.register_handler("square", lambda x: x * x)
+    try:
+        w.redefine(x=3)
+        expected = {"total": 13, "delayed": 6, "counter": 9, "squared": 9}
+        deadline = time.monotonic() + 10
+        # generators yield once per animation frame
+        while (w.value or {}) != expected:
+            assert time.monotonic() < deadline, f"value is {w.value}"
+            time.sleep(0.05)
+    finally:
+        w.close()
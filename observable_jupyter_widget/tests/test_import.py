@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import json
+import subprocess
+import sys
+
+# milliseconds to import the package once ipywidgets and IPython are loaded,
+# which kernels have done already. It's about 25ms on a laptop. Only checked
+# with --benchmarks, otherwise the generous limit catches regressions like
+# importing pandas on any machine.
+IMPORT_BUDGET_MS = 200
+IMPORT_LIMIT_MS = 1000
+
+# only needed once something blocks on the frontend or patches the event loop
+LAZY_MODULES = ["ipython_blocking", "nest_asyncio", "nbclient", "pandas", "numpy"]
+
+
+def import_package():
+    "Cumulative import time in ms, and the lazy modules that were imported"
+    code = (
+        "import ipywidgets, IPython.display, json, sys\n"
+        "import observable_jupyter_widget\n"
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        _, _, cumulative, name = (
+            part.strip() for part in line.replace(":", "|").split("|")
+        )
+        if name == "observable_jupyter_widget":
+            return int(cumulative) / 1000, json.loads(result.stdout)
+    raise AssertionError("observable_jupyter_widget wasn't imported")
+
+
+def test_import_is_lazy():
+    _, imported = import_package()
+    assert imported == []
+
+
+def test_import_time_budget(request):
+    budget = IMPORT_LIMIT_MS
+    if request.config.getoption("--benchmarks"):
+        budget = IMPORT_BUDGET_MS
+    best = min(import_package()[0] for _ in range(3))
+    assert best < budget, f"import took {best:.0f}ms"
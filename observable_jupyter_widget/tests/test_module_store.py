@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import json
+import time
+
+import pytest
+
+from ..headless import _iframe_code_path
+from ..module_store import ModuleStore, UPSTREAM_URLS
+
+
+def test_offline_reads_cached_modules(tmp_path):
+    (tmp_path / "@user").mkdir()
+    (tmp_path / "@user" / "notebook.js").write_text("export default 1")
+    store = ModuleStore(str(tmp_path), offline=True)
+    assert store.get("@user/notebook.js") == b"export default 1"
+    with pytest.raises(FileNotFoundError):
+        store.get("@user/missing.js")
+
+
+def test_fresh_modules_are_not_refetched(tmp_path, monkeypatch):
+    (tmp_path / "runtime.js").write_text("runtime")
+    (tmp_path / "runtime.js.json").write_text(json.dumps({"fetched_at": time.time()}))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("should not fetch")
+
+    monkeypatch.setattr("urllib.request.urlopen", fail)
+    assert ModuleStore(str(tmp_path)).get("runtime.js") == b"runtime"
+
+
+def test_rejects_paths_outside_the_store(tmp_path):
+    store = ModuleStore(str(tmp_path), offline=True)
+    for path in ["../secret.js", "/etc/passwd", "@user/notebook.py"]:
+        with pytest.raises(ValueError):
+            store.get(path)
+
+
+def test_cached_includes_imported_notebooks(tmp_path):
+    store = ModuleStore(str(tmp_path), offline=True)
+    for path in UPSTREAM_URLS:
+        (tmp_path / path).write_text("")
+    (tmp_path / "@user").mkdir()
+    (tmp_path / "@user" / "notebook.js").write_text(
+        'import x from "https://api.observablehq.com/@user/other.js?v=3"'
+    )
+    assert not store.cached(["@user/notebook"])
+    (tmp_path / "@user" / "other.js").write_text("export default 1")
+    assert store.cached(["@user/notebook"])
+    # from an older runtime version
+    meta = {"url": "https://cdn.jsdelivr.net/npm/@observablehq/runtime@4/x.js"}
+    (tmp_path / "runtime.js.json").write_text(json.dumps(meta))
+    assert not store.cached(["@user/notebook"])
+
+
+def test_embeds_use_the_cached_runtime_version():
+    with open(_iframe_code_path()) as f:
+        assert UPSTREAM_URLS["runtime.js"] in f.read()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ..output_cache import OutputCache
+from ..widget import ObservableWidget
+
+
+def make_cache(tmp_path, **kwargs):
+    return OutputCache(
+        str(tmp_path / "outputs"), modules_dir=str(tmp_path / "modules"), **kwargs
+    )
+
+
+def test_key_depends_on_inputs_and_module(tmp_path):
+    cache = make_cache(tmp_path)
+    df = pd.DataFrame({"x": np.arange(10)})
+    key = cache.key("@a/b", None, ["y"], {"data": df})
+    assert cache.key("@a/b", None, ["y"], {"data": df.copy()}) == key
+    assert cache.key("@a/b", None, ["y"], {"data": df + 1}) != key
+    assert cache.key("@a/b", None, ["z"], {"data": df}) != key
+    (tmp_path / "modules" / "@a").mkdir(parents=True)
+    (tmp_path / "modules" / "@a" / "b.js").write_text("export default 1")
+    assert cache.key("@a/b", None, ["y"], {"data": df}) != key
+
+
+def test_outputs_are_cached_across_widgets(tmp_path):
+    cache = make_cache(tmp_path)
+    w = ObservableWidget("@a/b", inputs={"x": 1}, outputs=["y"], output_cache=cache)
+    w.set_state({"value": {"y": 2, "z": memoryview(b"abc")}})
+    w.redefine(x=2)
+    w.set_state({"value": {"y": 4}})
+    w.close()
+
+    w = ObservableWidget("@a/b", inputs={"x": 1}, outputs=["y"], output_cache=cache)
+    assert w.value["y"] == 2
+    assert bytes(w.value["z"]) == b"abc"
+    w.close()
+    w = ObservableWidget("@a/b", inputs={"x": 2}, outputs=["y"], output_cache=cache)
+    assert w.value is None
+    w.close()
+
+
+def test_outputs_are_cached_per_widget_options(tmp_path):
+    cache = make_cache(tmp_path)
+    w = ObservableWidget("@a/b", outputs=["y"], output_cache=cache)
+    w.set_state({"value": {"y": [1, 2]}})
+    w.close()
+
+    w = ObservableWidget("@a/b", outputs=["y"], output_cache=cache)
+    assert w.value == {"y": [1, 2]}
+    w.close()
+    for options in [{"binary_outputs": True}, {"output_budget": 10}, {"lazy": True}]:
+        w = ObservableWidget("@a/b", outputs=["y"], output_cache=cache, **options)
+        assert w.value is None
+        w.close()
+
+
+def test_least_recently_used_outputs_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=2500)
+    for age, key in [(30, "a"), (20, "b")]:
+        cache.put(key, {"y": "x" * 1000})
+        then = time.time() - age
+        os.utime(cache._filename(key), (then, then))
+    cache.get("a")
+    cache.put("c", {"y": "x" * 1000})
+    assert cache.get("a") == {"y": "x" * 1000}
+    assert cache.get("b") is None
+    assert cache.get("c") == {"y": "x" * 1000}
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import asyncio
+import queue
+import threading
+import time
+
+from .._rpc import RpcServer
+
+
+def make_server():
+    replies = queue.Queue()
+    return RpcServer(replies.put), replies
+
+
+def test_calls_sync_and_async_handlers():
+    server, replies = make_server()
+
+    async def add(a, b):
+        return a + b
+
+    server.register("add", add)
+    server.register("upper", lambda text: text.upper())
+    server.call("1", "add", [1, 2])
+    assert replies.get(timeout=5) == {"type": "reply", "request_id": "1", "value": 3}
+    server.call("2", "upper", {"text": "hi"})
+    assert replies.get(timeout=5)["value"] == "HI"
+    server.call("3", "missing", [])
+    assert "missing" in replies.get(timeout=5)["error"]
+
+
+def test_new_calls_supersede_older_ones():
+    server, replies = make_server()
+
+    async def slow(n):
+        await asyncio.sleep(0.05)
+        return n
+
+    server.register("slow", slow, max_in_flight=1, supersede=True)
+    for i in range(3):
+        server.call(str(i), "slow", [i])
+    received = [replies.get(timeout=5) for _ in range(3)]
+    assert [r.get("cancelled") for r in received[:2]] == [True, True]
+    assert received[2]["value"] == 2
+
+
+def test_max_in_flight_and_cache():
+    server, replies = make_server()
+    running = []
+    peak = []
+
+    async def query(n):
+        running.append(n)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(n)
+        return n * 10
+
+    server.register("query", query, max_in_flight=2, cache_size=1)
+    for i in range(5):
+        server.call(str(i), "query", [i])
+    values = sorted(replies.get(timeout=5)["value"] for _ in range(5))
+    assert values == [0, 10, 20, 30, 40]
+    assert max(peak) == 2
+
+    calls = len(peak)
+    server.call("again", "query", [4])
+    assert replies.get(timeout=5)["value"] == 40
+    assert len(peak) == calls  # cached
+
+
+def test_superseded_sync_handlers_keep_their_slot():
+    server, replies = make_server()
+    release = threading.Event()
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def blocking(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        release.wait(5)
+        with lock:
+            running.remove(n)
+        return n
+
+    server.register("blocking", blocking, max_in_flight=1, supersede=True)
+    server.call("0", "blocking", [0])
+    # running in its thread, not cancelled before it started
+    deadline = time.monotonic() + 5
+    while not running and time.monotonic() < deadline:
+        time.sleep(0.001)
+    for i in range(1, 3):
+        server.call(str(i), "blocking", [i])
+    received = [replies.get(timeout=5) for _ in range(2)]
+    assert [r.get("cancelled") for r in received] == [True, True]
+    time.sleep(0.05)
+    assert peak == [1]
+    release.set()
+    assert replies.get(timeout=5)["value"] == 2
+    assert peak == [1, 1]
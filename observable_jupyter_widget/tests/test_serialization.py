@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from ipywidgets.widgets.widget import _remove_buffers
+
+from .._blobs import BlobStore
+from .._serialization import TYPE_KEY, content_hash, encode
+from ..widget import ObservableWidget
+
+
+def test_dataframe_columns_are_binary():
+    df = pd.DataFrame(
+        {
+            "a": np.array([1, 2, 3], dtype="int32"),
+            "b": [0.5, np.nan, 2.0],
+            "c": ["x", None, "z"],
+            "d": [True, False, True],
+        }
+    )
+    encoded = encode(df)
+    assert encoded[TYPE_KEY] == "dataframe"
+    assert encoded["length"] == 3
+    a, b, c, d = encoded["columns"]
+    assert a["dtype"] == "int32"
+    assert np.frombuffer(a["data"], dtype="<i4").tolist() == [1, 2, 3]
+    assert np.isnan(np.frombuffer(b["data"], dtype="<f8")[1])
+    assert c == {"name": "c", "values": ["x", None, "z"]}
+    assert d["dtype"] == "bool"
+
+
+def test_int64_becomes_float64():
+    encoded = encode(np.arange(4).reshape(2, 2))
+    assert encoded["dtype"] == "float64"
+    assert encoded["shape"] == [2, 2]
+    assert np.frombuffer(encoded["data"], dtype="<f8").tolist() == [0, 1, 2, 3]
+
+
+def test_timedelta_and_tz_aware_columns_are_binary(mock_comm):
+    df = pd.DataFrame(
+        {
+            "delta": pd.to_timedelta([1.5, None, 60], unit="s"),
+            "at": pd.to_datetime(
+                ["2021-01-01 01:00", None, "2021-06-01 00:00"]
+            ).tz_localize("Europe/Paris"),
+        }
+    )
+    delta, at = encode(df)["columns"]
+    assert delta["dtype"] == "float64"
+    ms = np.frombuffer(delta["data"], dtype="<f8")
+    assert ms[0] == 1500 and np.isnan(ms[1]) and ms[2] == 60000
+    assert at["dtype"] == "datetime"
+    ms = np.frombuffer(at["data"], dtype="<f8")
+    assert ms[0] == pd.Timestamp("2021-01-01 00:00", tz="UTC").value / 1e6
+    assert np.isnan(ms[1])
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"df": df})
+    assert w.inputs["df"] is df
+
+
+def test_unserializable_inputs_are_rejected(mock_comm):
+    df = pd.DataFrame({"x": [1, 2], "when": [datetime.date(2021, 1, 1), None]})
+    with pytest.raises(TypeError, match="'df', column 'when'.*date"):
+        ObservableWidget("@fakeauthor/fakenotebook", inputs={"df": df})
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"n": 1})
+    versions = dict(w._input_versions)
+    with pytest.raises(TypeError, match="'delta'.*timedelta"):
+        w.redefine(delta=[datetime.timedelta(seconds=1)])
+    assert w.inputs == {"n": 1}
+    assert w._input_versions == versions
+
+
+def test_inputs_state_uses_buffers(mock_comm):
+    df = pd.DataFrame({"x": np.linspace(0, 1, 1000)})
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"data": df, "n": 1})
+    state, buffer_paths, buffers = _remove_buffers(w.get_state())
+    assert buffer_paths == [["inputs", "data", "columns", 0, "data"]]
+    assert len(buffers[0]) == 8000
+    assert state["inputs"]["n"] == 1
+
+
+def test_content_hash_depends_only_on_content():
+    df = pd.DataFrame({"x": np.arange(10.0), "s": list("abcdefghij")})
+    assert content_hash(df) == content_hash(df.copy())
+    changed = df.copy()
+    changed.loc[3, "s"] = "z"
+    assert content_hash(changed) != content_hash(df)
+    assert content_hash(np.zeros(4)) != content_hash(np.zeros((2, 2)))
+
+
+def test_large_inputs_are_sent_once(mock_comm):
+    BlobStore.instance().close()
+    store = BlobStore.instance()
+    df = pd.DataFrame({"x": np.linspace(0, 1, 100000)})
+    a = ObservableWidget("@fakeauthor/fakenotebook", inputs={"data": df})
+    b = ObservableWidget("@fakeauthor/fakenotebook", inputs={"data": df.copy()})
+    a.redefine(data=df)
+    sent = [kw["data"]["content"] for _, kw in store.comm.log_send]
+    assert [m["type"] for m in sent] == ["blob"]
+    ref = {TYPE_KEY: "blob", "hash": content_hash(df)}
+    assert a.get_state()["inputs"]["data"] == ref
+    assert b.get_state()["inputs"]["data"] == ref
+
+    # dropped once no widget uses it
+    a.close()
+    b.redefine(data=None)
+    sent = [kw["data"]["content"] for _, kw in store.comm.log_send]
+    assert sent[-1] == {"type": "drop", "hash": ref["hash"]}
+    assert store._encoded == {}
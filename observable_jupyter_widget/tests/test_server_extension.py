@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) Thomas Ballinger.
+# Distributed under the terms of the Modified BSD License.
+
+import asyncio
+
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from .. import load_jupyter_server_extension
+from .._server_extension import _handlers, URL_PREFIX
+from ..module_store import ModuleStore
+
+
+def get(store, path, iframe_code=None):
+    "Response of a server with the extension's handlers to GET path"
+
+    async def main():
+        app = web.Application(_handlers("/", store, iframe_code))
+        sock, port = bind_unused_port()
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        try:
+            url = f"http://127.0.0.1:{port}/{URL_PREFIX}{path}"
+            return await AsyncHTTPClient().fetch(url, raise_error=False)
+        finally:
+            server.stop()
+
+    return asyncio.run(main())
+
+
+def cached_store(tmp_path, **kwargs):
+    (tmp_path / "@user").mkdir()
+    (tmp_path / "@user" / "notebook.js").write_text(
+        'import x from "https://api.observablehq.com/@user/other.js?v=3"'
+    )
+    return ModuleStore(str(tmp_path), **kwargs)
+
+
+def test_serves_cached_modules_to_opaque_origins(tmp_path):
+    store = cached_store(tmp_path, offline=True)
+    response = get(store, "modules/@user/notebook.js")
+    assert response.code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "null"
+    assert response.headers["Content-Type"].startswith("text/javascript")
+    # imports come through the server too
+    assert b"/observable-jupyter-widget/modules/@user/other.js" in response.body
+
+    response = get(store, "iframe_code.js", b"export {}")
+    assert response.code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "null"
+
+
+def test_only_fetches_when_enabled(tmp_path, monkeypatch):
+    fetched = []
+
+    def fetch(self, path, filename, meta):
+        fetched.append(path)
+        return b"export default 1"
+
+    monkeypatch.setattr(ModuleStore, "_fetch", fetch)
+    store = cached_store(tmp_path, offline=True)
+    assert get(store, "modules/@user/missing.js").code == 404
+    assert fetched == []
+
+    store.offline = False
+    assert get(store, "modules/@user/missing.js").code == 200
+    assert fetched == ["@user/missing.js"]
+
+
+def test_rejects_paths_outside_the_store(tmp_path):
+    store = cached_store(tmp_path, offline=True)
+    assert get(store, "modules/@user/notebook.py").code == 404
+    assert get(store, "modules/..%2F..%2Fsecret.js").code == 400
+
+
+def test_classic_notebook_finds_the_extension():
+    # nbserver_extensions imports the package and calls this
+    assert callable(load_jupyter_server_extension)
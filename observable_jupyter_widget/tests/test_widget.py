@@ -4,11 +4,17 @@
 # Copyright (c) Thomas Ballinger.
 # Distributed under the terms of the Modified BSD License.
 
+import asyncio
+import threading
+import time
+
 import pytest
 import pandas as pd
 import numpy as np
 import json
 
+from .._waiting import MapError
+from ..module_store import ModuleStore, UPSTREAM_URLS
 from ..widget import jsonify, ObservableWidget
 
 
@@ -27,3 +33,221 @@ def test_input_serialization():
     df = pd.DataFrame(data, columns=["c", "a"])
     tidied = json.loads(jsonify(df))
     assert tidied
+
+
+def test_redefine_sends_only_changed_cells(mock_comm):
+    df = pd.DataFrame({"x": np.arange(100.0)})
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"data": df, "n": 1})
+    w.comm.log_send.clear()
+    w.redefine(n=2)
+    w.redefine(n=3)
+    assert w.inputs["n"] == 3
+    assert w._input_versions == {"data": 1, "n": 3}
+    _, kwargs = w.comm.log_send[-1]
+    assert kwargs["data"]["content"] == {
+        "type": "inputs",
+        "inputs": {"n": 3},
+        "versions": {"n": 3},
+        "buffer_paths": [],
+    }
+    # the inputs traitlet itself was never resent
+    assert all(kw["data"]["method"] == "custom" for _, kw in w.comm.log_send)
+
+
+def test_append_sends_only_new_rows(mock_comm):
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"data": []})
+    w.comm.log_send.clear()
+    w.append("data", [{"a": 1}], window=100)
+    w.append("data", np.array([2.0, 3.0]))
+    first, second = [kw["data"]["content"] for _, kw in w.comm.log_send]
+    assert first == {
+        "type": "append",
+        "cell": "data",
+        "rows": [{"a": 1}],
+        "window": 100,
+        "seq": 1,
+        "buffer_paths": [],
+    }
+    assert second["buffer_paths"] == [["rows", "data"]]
+    assert second["seq"] == 2
+    assert w.inputs == {"data": []}
+
+
+def test_per_cell_outputs_are_merged():
+    w = ObservableWidget("@fakeauthor/fakenotebook", output_mode="per_cell")
+    changes = []
+    w.observe(changes.append, "value")
+    w._handle_custom_msg(w, {"type": "outputs", "outputs": {"a": 1}}, [])
+    w._handle_custom_msg(w, {"type": "outputs", "outputs": {"b": 2}}, [])
+    w._handle_custom_msg(w, {"type": "outputs", "outputs": {"a": 3}}, [])
+    assert w.value == {"a": 3, "b": 2}
+    assert len(changes) == 3
+
+
+def test_observe_debounced():
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+    seen = []
+    debounced = w.observe_debounced(lambda change: seen.append(change.new), wait=60)
+    for i in range(5):
+        w.set_state({"value": {"x": i}})
+    assert seen == []
+    assert debounced.pending
+    debounced.flush()
+    assert seen == [{"x": 4}]
+    w.unobserve(debounced, "value")
+
+
+def test_hold_inputs_sends_one_message(mock_comm):
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+    w.comm.log_send.clear()
+    with w.hold_inputs():
+        w.redefine(a=1)
+        with w.hold_inputs():
+            w.redefine(b=2)
+        w.redefine(a=3)
+        assert w.comm.log_send == []
+    assert len(w.comm.log_send) == 1
+    _, kwargs = w.comm.log_send[0]
+    content = kwargs["data"]["content"]
+    assert content["inputs"] == {"a": 3, "b": 2}
+    assert content["versions"] == {"a": 2, "b": 1}
+
+
+def test_wait_for():
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+    with pytest.raises(TimeoutError):
+        w.wait_for(["a"], timeout=0.01)
+    w.set_state({"value": {"a": 1}})
+    assert w.wait_for(["a"]) == {"a": 1}
+
+    timer = threading.Timer(0.05, w.set_state, [{"value": {"a": 2}}])
+    timer.start()
+    assert w.wait_for(["a"], timeout=5, next_value=True) == {"a": 2}
+
+
+def test_wait_for_next_value_computed_from_the_inputs(mock_comm):
+    w = ObservableWidget("@fakeauthor/fakenotebook", inputs={"n": 1})
+    w.redefine(n=2)
+
+    def outputs(n, appends=0):
+        computed_from = {"versions": {"n": n}, "appends": appends}
+        return {"value": {"a": n + appends}, "_computed_from": computed_from}
+
+    # computed before the redefine, e.g. held back by max_output_hz
+    threading.Timer(0.02, w.set_state, [outputs(1)]).start()
+    threading.Timer(0.1, w.set_state, [outputs(2)]).start()
+    assert w.wait_for(["a"], timeout=5, next_value=True) == {"a": 2}
+
+    w.append("n", [1])
+    threading.Timer(0.02, w.set_state, [outputs(2)]).start()
+    threading.Timer(0.1, w.set_state, [outputs(2, appends=1)]).start()
+    assert w.wait_for(timeout=5, next_value=True) == {"a": 3}
+
+
+def test_wait_for_next_value_of_the_cells_per_cell(mock_comm):
+    w = ObservableWidget(
+        "@fakeauthor/fakenotebook", inputs={"n": 1}, output_mode="per_cell"
+    )
+    w.redefine(n=2)
+
+    def outputs(cell, n):
+        computed_from = {cell: {"versions": {"n": n}, "appends": 0}}
+        msg = {"type": "outputs", "outputs": {cell: n}, "computed_from": computed_from}
+        return lambda: w._handle_custom_msg(w, msg, [])
+
+    # another cell computed from the new inputs doesn't count
+    threading.Timer(0.02, outputs("b", 2)).start()
+    threading.Timer(0.1, outputs("a", 2)).start()
+    assert w.wait_for(["a"], timeout=5, next_value=True) == {"a": 2, "b": 2}
+
+
+def test_wait_for_async():
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.01, w.set_state, {"value": {"a": 1}})
+        loop.call_later(0.02, w.set_state, {"value": {"a": 1, "b": 2}})
+        return await w.wait_for_async(["a", "b"], timeout=5)
+
+    assert asyncio.run(main()) == {"a": 1, "b": 2}
+
+
+def test_stats_summary(mock_comm):
+    w = ObservableWidget("@fakeauthor/fakenotebook")
+    w._handle_custom_msg(
+        w,
+        {
+            "type": "stats",
+            "time_to_ready_ms": 800.0,
+            "load": {"runtime_ms": 120.0, "module_ms": 300.0},
+            "messages": {
+                "to_kernel": {"count": 3, "bytes": 1200},
+                "from_kernel": {"count": 1, "bytes": 40},
+            },
+            "cells": {
+                "a": {"count": 2, "total_ms": 5.0, "max_ms": 4.0, "last_ms": 1.0},
+                "b": {"count": 1, "total_ms": 9.0, "max_ms": 9.0, "last_ms": 9.0},
+            },
+        },
+        [],
+    )
+    summary = w.stats_summary()
+    assert summary["time_to_ready_ms"] == 800.0
+    assert summary["time_to_first_output_ms"] is None
+    assert summary["module_load_ms"] == 300.0
+    assert summary["messages_to_kernel"] == 3 and summary["bytes_to_kernel"] == 1200
+    assert summary["cell_computations"] == 3 and summary["cell_compute_ms"] == 14.0
+    assert (summary["slowest_cell"], summary["slowest_cell_ms"]) == ("b", 9.0)
+
+    w.comm.log_send.clear()
+    w.reset_stats()
+    assert w.stats_summary()["messages_to_kernel"] == 0
+    assert w.stats["time_to_ready_ms"] == 800.0
+    contents = [kw["data"].get("content") for _, kw in w.comm.log_send]
+    assert {"type": "reset_stats", "buffer_paths": []} in contents
+
+
+def test_map_needs_a_displayed_view(mock_comm):
+    w = ObservableWidget("@fakeauthor/fakenotebook", outputs=["y"])
+    with pytest.raises(RuntimeError):
+        w.map([{"x": 1}])
+
+    w.set_state({"_view_count": 1})
+    errors = []
+
+    def run():
+        try:
+            w.map([{"x": 1}, {"x": 2}])
+        except MapError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while not w._batches:
+        time.sleep(0.01)
+    w.set_state({"_view_count": 0})
+    thread.join(5)
+    assert errors[0].errors == {
+        0: "the widget's views were closed",
+        1: "the widget's views were closed",
+    }
+
+
+def test_local_modules_are_only_fetched_once(mock_comm, tmp_path, monkeypatch):
+    monkeypatch.setenv("OBSERVABLE_JUPYTER_WIDGET_MODULES", str(tmp_path))
+    fetched = []
+
+    def fetch(self, path, filename, meta):
+        fetched.append(path)
+        with open(filename, "w") as f:
+            f.write("export default 1")
+        return b"export default 1"
+
+    monkeypatch.setattr(ModuleStore, "_fetch", fetch)
+    (tmp_path / "@user").mkdir()
+    ObservableWidget("@user/notebook", local_modules=True)
+    assert sorted(fetched) == sorted([*UPSTREAM_URLS, "@user/notebook.js"])
+    fetched.clear()
+    ObservableWidget("@user/notebook", local_modules=True)
+    assert fetched == []
@@ -8,21 +8,53 @@
 Observable Embed Widget
 """
 import json
-from typing import List, Dict, Any, Union
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Union
 import time
 import asyncio
 
 from IPython.display import display
-from ipywidgets import DOMWidget, ValueWidget
+from ipywidgets import DOMWidget, ValueWidget, widget_serialization
+from ipywidgets.widgets.widget import _put_buffers, _remove_buffers
 import traitlets
-import ipython_blocking
-import nest_asyncio
 
+from ._blobs import BlobStore
 from ._frontend import module_name, module_version
-
-
-# applause for this hack
-nest_asyncio.apply()
+from ._debounce import Debounced
+from ._rpc import RpcServer
+from ._waiting import Batch, Replies, ValueWaiter
+from .headless import HeadlessRuntime
+from .output_cache import OutputCache
+from ._serialization import (
+    TYPE_KEY,
+    check_inputs,
+    decode,
+    encode,
+    inputs_to_json,
+    is_dataframe,
+    is_deferred,
+    is_ndarray,
+)
+
+_colab_checked = False
+
+
+def _enable_colab_widgets() -> None:
+    "Colab support: https://github.com/googlecolab/colabtools/issues/498"
+    global _colab_checked
+    if _colab_checked:
+        return
+    _colab_checked = True
+    try:
+        if "google.colab" in sys.modules:
+            from google.colab import output
+
+            output.enable_custom_widget_manager()
+    except ImportError:
+        pass
 
 
 class ObservableWidget(DOMWidget, ValueWidget):
@@ -39,10 +71,84 @@ class ObservableWidget(DOMWidget, ValueWidget):
     outputs = traitlets.List(default_value=None, allow_none=True).tag(sync=True)
 
     # Each time this changes the widget will be updated
-    inputs = traitlets.Dict(default_value=None, allow_none=True).tag(sync=True)
+    # DataFrames and NumPy arrays are sent as binary buffers, see _serialization.py
+    # Large ones are sent once to the page's BlobStore and referenced by hash.
+    _blob_store = traitlets.Instance(BlobStore, allow_none=True).tag(
+        sync=True, **widget_serialization
+    )
+    inputs = traitlets.Dict(default_value=None, allow_none=True).tag(
+        sync=True, to_json=inputs_to_json
+    )
+    # Incremented each time a cell is redefined so the frontend only sends
+    # changed cells to the iframe.
+    _input_versions = traitlets.Dict().tag(sync=True)
+
+    # "aggregate" sends every output whenever any of them changes,
+    # "per_cell" observes each output cell separately and sends only changed cells
+    output_mode = traitlets.Enum(
+        ("aggregate", "per_cell"), default_value="aggregate"
+    ).tag(sync=True)
+
+    # Outputs are posted at most this many times a second, intermediate
+    # values are dropped (latest wins). 0 means no limit.
+    max_output_hz = traitlets.Float(0).tag(sync=True)
+
+    # Load the runtime and notebook modules through the Jupyter server
+    # extension's on-disk cache instead of from the CDN and api.observablehq.com
+    local_modules = traitlets.Bool(False).tag(sync=True)
+
+    # "suspend_offscreen" pauses the notebook while the widget is scrolled out
+    # of view, "always" keeps computing it (and updating value) regardless
+    execution_policy = traitlets.Enum(
+        ("suspend_offscreen", "always"), default_value="suspend_offscreen"
+    ).tag(sync=True)
+
+    # Outputs whose JSON is larger than this many bytes are replaced in .value
+    # by a placeholder and have to be fetched with .fetch(). 0 means no limit.
+    output_budget = traitlets.Int(0).tag(sync=True)
+
+    # Send typed arrays, arrays of numbers and arrays of row objects back as
+    # binary columns, read with value_as_frame() and as_numpy()
+    binary_outputs = traitlets.Bool(False).tag(sync=True)
+
+    # "leader" runs the notebook in one view of the widget (e.g. when it's also
+    # shown in a sidecar), other views show a placeholder; "independent" runs
+    # it in every view
+    view_sharing = traitlets.Enum(
+        ("leader", "independent"), default_value="independent"
+    ).tag(sync=True)
+
+    # Only compute the displayed cells, the outputs and the cells they depend
+    # on, rather than every cell in the notebook
+    lazy = traitlets.Bool(False).tag(sync=True)
+
+    # Keep a static copy of the rendered notebook in the widget state, so
+    # exported or reopened notebooks show it without recomputing
+    snapshot = traitlets.Bool(False).tag(sync=True)
+
+    # The rendered HTML and height and the input versions it was rendered
+    # with, set by the frontend when snapshot is True
+    _snapshot = traitlets.Dict(default_value=None, allow_none=True).tag(
+        sync=True, echo_update=False
+    )
+
+    # Timings and message counts, updated by the frontend at most once a
+    # second, see stats_summary()
+    stats = traitlets.Dict(read_only=True)
+
+    # Counted by the frontend as views are displayed and removed (ipywidgets
+    # leaves it None, untracked), so map() knows whether a view can run it
+    _view_count = traitlets.Int(0, allow_none=True).tag(sync=True)
 
     # This should only be changed from the JavaScript side
-    value = traitlets.Dict(default_value=None, allow_none=True).tag(sync=True)
+    value = traitlets.Dict(default_value=None, allow_none=True).tag(
+        sync=True, echo_update=False
+    )
+    # The input versions and number of appends value was computed from, set
+    # with it (output_mode="aggregate"), see wait_for()
+    _computed_from = traitlets.Dict(default_value=None, allow_none=True).tag(
+        sync=True, echo_update=False
+    )
 
     def __init__(
         self,
@@ -52,15 +158,83 @@ class ObservableWidget(DOMWidget, ValueWidget):
         inputs: Dict = None,
         outputs: List[str] = None,
         display_logo=True,
+        output_mode: str = "aggregate",
+        max_output_hz: float = 0,
+        runtime: HeadlessRuntime = None,
+        local_modules: bool = False,
+        execution_policy: str = "suspend_offscreen",
+        output_budget: int = 0,
+        binary_outputs: bool = False,
+        view_sharing: str = "independent",
+        snapshot: bool = False,
+        output_cache: OutputCache = None,
+        lazy: bool = False,
     ) -> None:
         """Embeds a set of cells or an entire Observable notebook.
 
-        Every cell of the Observable notebook runs, just like when opening a notebook on observablehq.com.
+        Every cell of the Observable notebook runs, just like when opening a notebook on observablehq.com,
+        unless lazy=True: then only the displayed cells, the outputs and the cells they depend on are
+        computed, which saves expensive cells that aren't used but skips cells run for their side effects.
         Cells are unordered: cells are always rendered in the order they appear in the Observable notebook.
         Cells in inputs
 
+        With output_mode="per_cell" each output cell is observed separately and
+        only cells that change are sent back and merged into .value.
+
+        max_output_hz limits how often outputs are sent back, e.g. while a
+        viewof slider is being dragged. The last value is always sent.
+
+        Pass runtime=HeadlessRuntime(modules_dir) to run the notebook in a
+        Node.js process instead of the browser, e.g. under papermill.
+
+        With local_modules=True the notebook and the Observable runtime are
+        served by the Jupyter server from an on-disk cache (see
+        module_store.prefetch) so embeds work offline or behind a firewall.
+        They're cached when the widget is created if they aren't yet, which
+        raises FileNotFoundError if they can't be fetched. Cached modules are
+        only updated by module_store.prefetch.
+
+        By default embeds stop computing while they're scrolled offscreen. Use
+        execution_policy="always" for widgets whose value is needed anyway.
+
+        Outputs larger than output_budget bytes of JSON aren't sent to the
+        kernel on every change, .value holds a placeholder and .fetch(cell)
+        gets the value when it's needed.
+
+        With binary_outputs=True, outputs like a selection of 200k rows arrive
+        as binary columns instead of a list of dicts: .value holds them
+        encoded and value_as_frame(cell) or as_numpy(cell) build a DataFrame
+        or array directly on the received buffers.
+
+        A widget displayed more than once runs its notebook in every view,
+        which multiplies the computation and outputs sent. With
+        view_sharing="leader" it runs in one view only, the others offer to
+        move it there.
+
+        With snapshot=True the widget state keeps a static copy of the last
+        rendering alongside .value. Exported HTML and reopened notebooks show
+        it instead of running the notebook again, until inputs change.
+
+        Pass output_cache=OutputCache() to store the first value computed for
+        these inputs on disk. When an earlier run stored one, .value is set
+        from it right away, e.g. after "Restart and Run All".
         """
+        _enable_colab_widgets()
         super().__init__()
+        self.on_msg(self._handle_custom_msg)
+        # redefinitions collected by hold_inputs()
+        self._held_inputs = {}
+        self._hold_inputs_depth = 0
+        self._outputs_lock = threading.Lock()
+        # append() calls so far, and what each cell's value was computed from
+        # in output_mode="per_cell"
+        self._appends_sent = 0
+        self._cells_computed_from = {}
+        self._replies = Replies()
+        # map() calls waiting for results, by request id
+        self._batches = {}
+        self._rpc = RpcServer(self._send_reply)
+        self._blob_store = BlobStore.instance()
 
         if (
             slug.startswith("http")
@@ -71,8 +245,6 @@ class ObservableWidget(DOMWidget, ValueWidget):
                 "notebook identifier looks like a url, please path a specifier like @observablehq/a-taste-of-observable or d/4575c6c14b706a4f"
             )
 
-        jsonified_inputs = jsonify(inputs or {})
-
         if cells:
             for cell in cells:
                 if not isinstance(cell, str):
@@ -83,18 +255,539 @@ class ObservableWidget(DOMWidget, ValueWidget):
                 if not isinstance(cell, str):
                     raise ValueError("Cell names should be strings.")
 
+        check_inputs(inputs or {})
+
         self.slug = slug
         self.cells = cells
-        self.inputs = inputs
+        with self.hold_sync():
+            self.inputs = dict(inputs or {})
         self.outputs = outputs
+        self.output_mode = output_mode
+        self.max_output_hz = max_output_hz
+        self.local_modules = local_modules
+        if local_modules:
+            # the server extension only serves cached modules
+            from .module_store import ModuleStore
+
+            store = ModuleStore.from_environment()
+            if not store.cached([slug]):
+                store.prefetch([slug])
+        self.execution_policy = execution_policy
+        self.output_budget = output_budget
+        self.binary_outputs = binary_outputs
+        self.view_sharing = view_sharing
+        self.snapshot = snapshot
+        self.lazy = lazy
+
+        # the key to store the first complete value under, see OutputCache
+        self._output_cache = output_cache
+        self._output_cache_key = None
+        if output_cache is not None:
+            key = output_cache.key(
+                slug,
+                cells,
+                outputs,
+                self.inputs,
+                runtime.modules_dir if isinstance(runtime, HeadlessRuntime) else None,
+                self._embed_options(),
+            )
+            cached = output_cache.get(key)
+            if cached is not None:
+                self.value = cached
+            else:
+                self._output_cache_key = key
+
+        self._headless = None
+        if runtime is not None:
+            self._headless = runtime.start(self)
+            # the first inputs message starts the notebook, even if empty
+            self._headless.send_inputs(
+                self._blob_store.resolve(inputs_to_json(self.inputs, self)),
+                self._input_versions,
+            )
+
+    def _embed_options(self) -> Dict[str, Any]:
+        "Options for embed() in iframe_code.js"
+        return {
+            "outputMode": self.output_mode,
+            "maxOutputHz": self.max_output_hz,
+            "outputBudget": self.output_budget,
+            "binaryOutputs": self.binary_outputs,
+            "lazy": self.lazy,
+        }
+
+    def _handle_custom_msg(self, _, content, buffers):
+        if buffers:
+            _put_buffers(content, content["buffer_paths"], buffers)
+        if content.get("type") == "outputs":
+            self._receive_outputs(
+                content["outputs"],
+                content.get("partial", True),
+                content.get("computed_from"),
+            )
+        elif content.get("type") == "mapped":
+            batch = self._batches.get(content["request_id"])
+            if batch is not None:
+                batch.receive(
+                    content["index"], content.get("value"), content.get("error")
+                )
+        elif content.get("type") == "fetched":
+            self._replies.resolve(content["request_id"], content)
+        elif content.get("type") == "call":
+            self._rpc.call(content["request_id"], content["name"], content.get("args"))
+        elif content.get("type") == "cancel":
+            self._rpc.cancel(content["request_id"])
+        elif content.get("type") == "stats":
+            # from views and headless runtimes
+            stats = {
+                k: v for k, v in content.items() if k not in ("type", "buffer_paths")
+            }
+            self.set_trait("stats", {**self.stats, **stats})
+
+    def _receive_outputs(
+        self, outputs: Dict[str, Any], partial: bool, computed_from=None
+    ):
+        # partial outputs from output_mode="per_cell" only contain changed
+        # cells, and say what each was computed from
+        with self._outputs_lock:
+            if partial:
+                self._cells_computed_from.update(computed_from or {})
+                self.set_state({"value": {**(self.value or {}), **outputs}})
+            else:
+                self.set_state({"value": outputs, "_computed_from": computed_from})
+
+    def close(self):
+        headless = getattr(self, "_headless", None)
+        if headless is not None:
+            headless.close()
+        if self._blob_store is not None:
+            self._blob_store.release(self)
+        super().close()
+
+    @traitlets.observe("value")
+    def _store_output(self, change):
+        key = self._output_cache_key
+        value = change.new
+        if key is None or not value:
+            return
+        if self.outputs is not None:
+            complete = all(name in value for name in self.outputs)
+        else:
+            # per_cell values arrive one cell at a time
+            complete = self.output_mode == "aggregate"
+        if complete and not any(is_deferred(v) for v in value.values()):
+            self._output_cache_key = None
+            self._output_cache.put(key, value)
+
+    @traitlets.observe("inputs")
+    def _on_inputs_replaced(self, change):
+        # Replacing the whole dict resends every cell.
+        self._output_cache_key = None
+        versions = dict(self._input_versions)
+        for name in change.new or {}:
+            versions[name] = versions.get(name, 0) + 1
+        self._input_versions = versions
+        # views get the new dict through the sync, a headless runtime doesn't
+        # (not set yet while the widget is constructed, see __init__)
+        headless = getattr(self, "_headless", None)
+        if headless is not None:
+            headless.send_inputs(
+                self._blob_store.resolve(inputs_to_json(change.new or {}, self)),
+                versions,
+            )
 
     def redefine(self, **kwargs):
         "Redefine an Observable cell with a Python value."
         # this could be any cell in the Observable notebook (not limited to widget.cells)
-        kwargs["-invalid-cell-name-nonce"] = time.time()
-        self.inputs = kwargs
+        # Only these cells are sent. self.inputs and self._input_versions are
+        # updated in place so traitlets doesn't resync the whole dicts, but they
+        # stay current for get_state() when the page is reloaded.
+        check_inputs(kwargs)
+        if self.inputs is None:
+            self.inputs = {}
+        self._output_cache_key = None
+        self.inputs.update(kwargs)
+        for name in kwargs:
+            self._input_versions[name] = self._input_versions.get(name, 0) + 1
+        if self._hold_inputs_depth:
+            self._held_inputs.update(kwargs)
+        else:
+            self._send_inputs(kwargs)
         # TODO block and return outputs?
 
+    @contextmanager
+    def hold_inputs(self):
+        """Collect redefine() calls and send them in a single message at the end
+        of the with block, so dependent cells are recomputed once.
+
+        >>> with w.hold_inputs():
+        ...     w.redefine(width=400)
+        ...     w.redefine(height=300)
+        """
+        self._hold_inputs_depth += 1
+        try:
+            yield
+        finally:
+            self._hold_inputs_depth -= 1
+            if not self._hold_inputs_depth and self._held_inputs:
+                held, self._held_inputs = self._held_inputs, {}
+                self._send_inputs(held)
+
+    def _send_inputs(self, inputs: Dict[str, Any]):
+        self._send_message(
+            {
+                "type": "inputs",
+                "inputs": inputs_to_json(inputs, self),
+                "versions": {name: self._input_versions[name] for name in inputs},
+            }
+        )
+
+    def _send_message(self, msg: Dict[str, Any]) -> None:
+        "Sends an encoded message to the frontend, with memoryviews as buffers"
+        if self._headless is not None:
+            self._headless.send(self._blob_store.resolve(msg))
+        state, buffer_paths, buffers = _remove_buffers(msg)
+        self.send({**state, "buffer_paths": buffer_paths}, buffers)
+
+    def append(self, cell: str, rows, *, window: int = None) -> None:
+        """Append rows to the array in an Observable cell, e.g. for live data.
+
+        Only the new rows are sent, the iframe keeps the array and redefines
+        the cell with it so dependent cells recompute. rows can be a list, a
+        DataFrame or a NumPy array. With window=N only the last N rows are
+        kept. Appending starts from the cell's last redefined value if that's
+        a list or DataFrame, otherwise from an empty array.
+
+        Appended rows aren't part of the widget's state, a reloaded page only
+        has the inputs.
+        """
+        self._output_cache_key = None
+        self._appends_sent += 1
+        self._send_message(
+            {
+                "type": "append",
+                "cell": cell,
+                "rows": encode(rows),
+                "window": window,
+                "seq": self._appends_sent,
+            }
+        )
+
+    def observe_debounced(self, handler, names="value", wait: float = 0.2) -> Debounced:
+        """Like observe(), but handler only runs once changes have stopped
+        for wait seconds, with the most recent change.
+
+        Returns the wrapped handler, which can be passed to unobserve()."""
+        debounced = Debounced(handler, wait)
+        self.observe(debounced, names=names)
+        return debounced
+
+    def _value_waiter(self, cells, next_value):
+        cells = list(cells or [])
+        # the inputs sent so far, which the next value has to be computed from
+        versions = dict(self._input_versions)
+        appends = self._appends_sent
+
+        def is_current(computed_from, untagged):
+            if computed_from is None:
+                return untagged
+            computed_versions = computed_from.get("versions") or {}
+            return computed_from.get("appends", 0) >= appends and all(
+                computed_versions.get(name, 0) >= version
+                for name, version in versions.items()
+            )
+
+        def computed_from_inputs(untagged):
+            if self.output_mode == "aggregate":
+                return is_current(self._computed_from, untagged)
+            # the cells waited for, or any cell, were computed again since
+            if cells:
+                return all(
+                    is_current(self._cells_computed_from.get(cell), untagged)
+                    for cell in cells
+                )
+            tags = list(self._cells_computed_from.values())
+            return any(is_current(t, untagged) for t in tags) if tags else untagged
+
+        def has_cells(value):
+            if value is None or not all(cell in value for cell in cells):
+                return False
+            # values set without saying what they were computed from count
+            return not next_value or computed_from_inputs(untagged=True)
+
+        # Headless outputs arrive on another thread, the value computed from
+        # the inputs sent so far may be there already.
+        arrived = next_value and has_cells(self.value)
+        arrived = arrived and computed_from_inputs(untagged=False)
+        return ValueWaiter(
+            self,
+            has_cells,
+            "value",
+            next_change=next_value and not arrived,
+            # headless outputs arrive on another thread, not as kernel messages
+            pump_kernel=self._headless is None,
+        )
+
+    def wait_for(
+        self,
+        cells: List[str] = None,
+        timeout: float = None,
+        *,
+        next_value: bool = False,
+    ) -> Dict[str, Any]:
+        """Block until .value has a value for each of cells, then return .value.
+
+        With next_value=True this waits for a value computed from the inputs
+        sent so far, e.g. the result of a redefine() or append() call just
+        made. Values computed from earlier inputs, or in output_mode="per_cell"
+        those of other cells, don't count, nor does the current value unless
+        it's known to be computed from these inputs.
+        Raises TimeoutError after timeout seconds.
+        Messages from the frontend are processed as they arrive while waiting.
+        """
+        self._value_waiter(cells, next_value).wait(timeout)
+        return self.value
+
+    async def wait_for_async(
+        self,
+        cells: List[str] = None,
+        timeout: float = None,
+        *,
+        next_value: bool = False,
+    ) -> Dict[str, Any]:
+        """Async version of wait_for().
+
+        The kernel doesn't handle widget messages while the cell awaiting this
+        is running, so in a notebook run it in a task, e.g.
+        asyncio.ensure_future(w.wait_for_async(...)), or use wait_for()."""
+        await self._value_waiter(cells, next_value).wait_async(timeout)
+        return self.value
+
+    def register_handler(
+        self,
+        name: str,
+        handler,
+        *,
+        max_in_flight: int = 4,
+        cache_size: int = 0,
+        supersede: bool = False,
+    ) -> None:
+        """Make a Python function callable from the Observable notebook.
+
+        Cells call it with `jupyter.call(name, args)`, which returns a Promise
+        of its return value: args is a list of positional arguments or an
+        object of keyword arguments. DataFrames and arrays are returned in
+        binary, as with inputs. Exceptions reject the Promise.
+
+        Coroutine functions run as tasks on the kernel's event loop, other
+        functions in a thread pool, at most max_in_flight calls at once; the
+        rest wait their turn. With supersede=True a new call cancels the calls
+        still waiting or running (their Promises reject), so e.g. panning a
+        map only runs the query for where it ended up. That's any other call
+        to the handler, from whichever cell or view, so only use it for a
+        handler called from one place. A cancelled call to a function (not a
+        coroutine) can't be stopped, it holds its slot until it returns. The
+        results of the last cache_size distinct args are cached.
+        """
+        self._rpc.register(
+            name,
+            handler,
+            max_in_flight=max_in_flight,
+            cache_size=cache_size,
+            supersede=supersede,
+        )
+
+    def unregister_handler(self, name: str) -> None:
+        self._rpc.unregister(name)
+
+    def _send_reply(self, reply: Dict[str, Any]) -> None:
+        if "value" in reply:
+            reply = {**reply, "value": encode(reply["value"])}
+        self._send_message(reply)
+
+    def _send_fetch(self, cell: str, offset: int, limit: int) -> str:
+        request_id = self._replies.new_request()
+        self._send_message(
+            {
+                "type": "fetch",
+                "request_id": request_id,
+                "cell": cell,
+                "offset": offset,
+                "limit": limit,
+            }
+        )
+        return request_id
+
+    def fetch(
+        self,
+        cell: str,
+        *,
+        offset: int = 0,
+        limit: int = None,
+        timeout: float = None,
+    ) -> Any:
+        """Get the current value of an output cell from the frontend.
+
+        This is how to read outputs over output_budget, which .value only has
+        placeholders for. If the value is a list, or a DataFrame or array
+        sent in binary (binary_outputs=True), offset and limit select the
+        items or rows to fetch, e.g. to page through a large selection.
+        Raises KeyError if the cell has no value yet and TimeoutError after
+        timeout seconds (e.g. if the widget hasn't been displayed).
+        """
+        request_id = self._send_fetch(cell, offset, limit)
+        reply = self._replies.wait(
+            request_id, timeout, pump_kernel=self._headless is None
+        )
+        return _fetched_value(reply)
+
+    async def fetch_async(
+        self,
+        cell: str,
+        *,
+        offset: int = 0,
+        limit: int = None,
+        timeout: float = None,
+    ) -> Any:
+        "Async version of fetch(), see wait_for_async() about running it in a task."
+        request_id = self._send_fetch(cell, offset, limit)
+        return _fetched_value(await self._replies.wait_async(request_id, timeout))
+
+    def map(
+        self,
+        inputs: List[Dict[str, Any]],
+        outputs: List[str] = None,
+        *,
+        workers: int = 4,
+        timeout: float = None,
+        on_progress: Callable[[int, int], None] = None,
+    ) -> List[Dict[str, Any]]:
+        """Run the notebook once for each dict of inputs and return the
+        outputs computed for each, in order.
+
+        >>> w.map([{"data": df} for df in datasets], ["positions"])
+
+        Each input set is evaluated in a new Observable runtime, up to
+        `workers` at a time, in hidden iframes of a displayed view (or in the
+        headless process). The widget's own notebook and .value aren't
+        changed. outputs defaults to the widget's outputs; cells can't use
+        jupyter.call(). on_progress(done, total) is called as results arrive.
+
+        Raises MapError if any input set failed, had no result after timeout
+        seconds or the widget's views were closed, with the results of the
+        others. Raises RuntimeError without a timeout if no view is displayed
+        (display the widget in an earlier cell).
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if self._headless is None and not self._view_count and timeout is None:
+            raise RuntimeError(
+                "map() runs in a displayed view of the widget, display it first "
+                "or pass a timeout"
+            )
+        batch = Batch(len(inputs), on_progress)
+        request_id = uuid.uuid4().hex
+        self._batches[request_id] = batch
+
+        def on_view_count(change):
+            if self._headless is None and not change.new:
+                batch.fail_remaining("the widget's views were closed")
+
+        self.observe(on_view_count, "_view_count")
+        try:
+            self._send_message(
+                {
+                    "type": "map",
+                    "request_id": request_id,
+                    "inputs": [encode(dict(i)) for i in inputs],
+                    "outputs": outputs or self.outputs,
+                    "workers": workers,
+                }
+            )
+            try:
+                batch.wait(timeout, pump_kernel=self._headless is None)
+            except TimeoutError:
+                self._send_message({"type": "cancel_map", "request_id": request_id})
+                batch.time_out(timeout)
+        finally:
+            self.unobserve(on_view_count, "_view_count")
+            del self._batches[request_id]
+        results = batch.result()
+        return [{name: decode(v) for name, v in r.items()} for r in results]
+
+    def stats_summary(self) -> Dict[str, Any]:
+        """.stats as flat numbers for monitoring, with times in milliseconds:
+
+        time_to_ready_ms         render until the notebook could take inputs
+                                 (iframe boot, runtime and module loading)
+        time_to_first_output_ms  render until the first outputs were sent
+        runtime_load_ms          importing the Observable runtime
+        module_load_ms           importing the notebook module
+        messages_to_kernel       outputs and calls sent by the widget, with
+        bytes_to_kernel          about the size of their JSON (estimated
+                                 from a sample of long arrays) and buffers
+        messages_from_kernel     inputs, appends and replies received
+        bytes_from_kernel
+        cell_computations        cells computed, and the total time
+        cell_compute_ms          between each becoming pending and its value
+        slowest_cell             the cell with the longest total, and that
+        slowest_cell_ms          total
+
+        Timings are missing until the widget has been displayed (or run
+        headless) and counts are since the last reset_stats().
+        """
+        stats = self.stats
+        load = stats.get("load") or {}
+        messages = stats.get("messages") or {}
+        cells = stats.get("cells") or {}
+        summary = {
+            "time_to_ready_ms": stats.get("time_to_ready_ms"),
+            "time_to_first_output_ms": stats.get("time_to_first_output_ms"),
+            "runtime_load_ms": load.get("runtime_ms"),
+            "module_load_ms": load.get("module_ms"),
+        }
+        for direction in ("to_kernel", "from_kernel"):
+            counts = messages.get(direction) or {}
+            summary[f"messages_{direction}"] = counts.get("count", 0)
+            summary[f"bytes_{direction}"] = counts.get("bytes", 0)
+        summary["cell_computations"] = sum(c["count"] for c in cells.values())
+        summary["cell_compute_ms"] = sum(c["total_ms"] for c in cells.values())
+        slowest = max(cells, key=lambda name: cells[name]["total_ms"], default=None)
+        summary["slowest_cell"] = slowest
+        summary["slowest_cell_ms"] = (
+            cells[slowest]["total_ms"] if slowest is not None else None
+        )
+        return summary
+
+    def reset_stats(self) -> None:
+        "Zero the message counts and cell timings in .stats"
+        stats = {k: v for k, v in self.stats.items() if k not in ("messages", "cells")}
+        self.set_trait("stats", stats)
+        self._send_message({"type": "reset_stats"})
+
+    def value_as_frame(self, cell: str):
+        """The value of an output cell as a pandas DataFrame.
+
+        With binary_outputs=True its numeric, boolean and date columns are
+        NumPy arrays over the bytes sent from the browser, otherwise it's
+        built from the list of records in .value."""
+        import pandas as pd
+
+        value = decode((self.value or {})[cell])
+        if is_dataframe(value):
+            return value
+        return pd.DataFrame(value)
+
+    def as_numpy(self, cell: str):
+        """The value of an output cell as a NumPy array, without a copy for
+        typed arrays and arrays of numbers sent with binary_outputs=True."""
+        import numpy as np
+
+        value = (self.value or {})[cell]
+        if isinstance(value, dict) and value.get(TYPE_KEY) == "dataframe":
+            return decode(value).to_numpy()
+        return np.asarray(decode(value))
+
     @property
     def output(self):
         return self.get_output()
@@ -244,6 +937,12 @@ def interactive_embed(
 """
 
 
+def _fetched_value(reply: Dict[str, Any]) -> Any:
+    if "error" in reply:
+        raise KeyError(reply["error"])
+    return decode(reply.get("value"))
+
+
 class ExampleEmbed(ObservableWidget):
     def __init__(self):
         inputs = {"extraCell": 123}
@@ -263,5 +962,10 @@ def jsonify(obj):
 
 class DataJSONEncoder(json.JSONEncoder):
     def default(self, obj):
-        if type(obj).__name__ == "DataFrame":  # Pandas DataFrame
-            return json.dumps(obj.to_dict(orient="records"))
+        if is_dataframe(obj):  # Pandas DataFrame
+            return obj.to_dict(orient="records")
+        if is_ndarray(obj):
+            return obj.tolist()
+        if type(obj).__module__ == "numpy" and hasattr(obj, "item"):
+            return obj.item()
+        return super().default(obj)
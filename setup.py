@@ -29,7 +29,7 @@ jstargets = [
 ]
 
 
-package_data_spec = {name: ["nbextension/**js*", "labextension/**"]}
+package_data_spec = {name: ["nbextension/**js*", "labextension/**", "node/*"]}
 
 
 data_files_spec = [
@@ -45,6 +45,8 @@ data_files_spec = [
     ),
     ("share/jupyter/labextensions/observable-jupyter-widget", ".", "install.json"),
     ("etc/jupyter/nbconfig/notebook.d", ".", "observable_jupyter_widget.json"),
+    ("etc/jupyter/jupyter_server_config.d", "jupyter-config/jupyter_server_config.d", "observable_jupyter_widget.json"),
+    ("etc/jupyter/jupyter_notebook_config.d", "jupyter-config/jupyter_notebook_config.d", "observable_jupyter_widget.json"),
 ]
 
 
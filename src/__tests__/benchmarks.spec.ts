@@ -0,0 +1,208 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+// Benchmarks of the frontend paths whose cost grows with the number of embeds
+// or the size of the data. Results are compared with benchmark_baseline.json,
+// sizes in bytes exactly and times as ratios, which vary less between
+// machines, only with BENCHMARK_TIMES=1 since they still depend on the
+// machine and its load. Record new baselines after an intended change with
+//
+//   UPDATE_BENCHMARKS=1 yarn test benchmarks
+
+import * as fs from 'fs';
+import * as path from 'path';
+
+import {
+  dispatchMessage,
+  listenToSizeAndValuesAndReady,
+  prepareForTransfer,
+} from '../wrapper_code';
+import { resolveBlobs, TYPE_KEY } from '../blob_store';
+// @ts-ignore: iframe_code.js has no type declarations
+import { cleanOutput, encodeOutput } from '../iframe_code';
+
+const BASELINE_PATH = path.join(__dirname, 'benchmark_baseline.json');
+const UPDATE = Boolean(process.env.UPDATE_BENCHMARKS);
+const CHECK_TIMES = Boolean(process.env.BENCHMARK_TIMES);
+// how much worse than the baseline a result can be before failing
+const BYTES_TOLERANCE = 1.1;
+const TIME_TOLERANCE = 2;
+
+const baseline: Record<string, number> = JSON.parse(
+  fs.readFileSync(BASELINE_PATH, 'utf8')
+);
+const results: Record<string, number> = {};
+
+function checkBytes(name: string, value: number): void {
+  results[name] = value;
+  if (!UPDATE && name in baseline) {
+    expect(value).toBeLessThanOrEqual(baseline[name] * BYTES_TOLERANCE);
+  }
+}
+
+// how many times faster than the JSON equivalent
+function checkSpeedup(name: string, value: number): void {
+  results[name] = Math.round(value * 100) / 100;
+  if (CHECK_TIMES && !UPDATE && name in baseline) {
+    expect(value).toBeGreaterThanOrEqual(baseline[name] / TIME_TOLERANCE);
+  }
+}
+
+// cost relative to a smaller case, where lower is better
+function checkRatio(name: string, value: number): void {
+  results[name] = Math.round(value * 100) / 100;
+  if (CHECK_TIMES && !UPDATE && name in baseline) {
+    expect(value).toBeLessThanOrEqual(baseline[name] * TIME_TOLERANCE);
+  }
+}
+
+afterAll(() => {
+  console.log('benchmarks:', results);
+  if (UPDATE) {
+    const merged: Record<string, number> = { ...baseline, ...results };
+    const sorted: Record<string, number> = {};
+    Object.keys(merged)
+      .sort()
+      .forEach((key) => (sorted[key] = merged[key]));
+    fs.writeFileSync(BASELINE_PATH, JSON.stringify(sorted, null, 2) + '\n');
+  }
+});
+
+async function bestTime(fn: () => any, repeat = 3): Promise<number> {
+  let best = Infinity;
+  for (let i = 0; i < repeat; i++) {
+    const start = performance.now();
+    await fn();
+    best = Math.min(best, performance.now() - start);
+  }
+  return best;
+}
+
+function makeRows(n: number): Record<string, any>[] {
+  const rows = new Array(n);
+  for (let i = 0; i < n; i++) {
+    rows[i] = { x: i / n, n: i, label: `item ${i % 100}` };
+  }
+  return rows;
+}
+
+// An encoded DataFrame as it arrives from the kernel, see _serialization.py
+function makeEncodedFrame(n: number): any {
+  const x = new Float64Array(n).map((_, i) => i / n);
+  const ns = new Int32Array(n).map((_, i) => i);
+  return {
+    [TYPE_KEY]: 'dataframe',
+    length: n,
+    columns: [
+      { name: 'x', dtype: 'float64', data: new DataView(x.buffer) },
+      { name: 'n', dtype: 'int32', data: new DataView(ns.buffer) },
+      {
+        name: 'label',
+        values: Array.from(ns, (i) => `item ${i % 100}`),
+      },
+    ],
+  };
+}
+
+// bytes of JSON plus buffers
+function messageBytes(value: any): number {
+  let buffers = 0;
+  const json = JSON.stringify(value, (_, v) => {
+    if (v instanceof ArrayBuffer) {
+      buffers += v.byteLength;
+      return null;
+    }
+    return v;
+  });
+  return json.length + buffers;
+}
+
+describe('benchmarks', () => {
+  it('routes messages at a cost independent of the number of embeds', () => {
+    const messages = 20000;
+    const costs: Record<number, number> = {};
+    for (const n of [10, 300]) {
+      const iframes: HTMLIFrameElement[] = [];
+      const unlisteners: (() => void)[] = [];
+      for (let i = 0; i < n; i++) {
+        const iframe = document.createElement('iframe');
+        document.body.appendChild(iframe);
+        iframes.push(iframe);
+        unlisteners.push(
+          listenToSizeAndValuesAndReady(
+            iframe,
+            () => undefined,
+            () => undefined
+          )
+        );
+      }
+      const events = iframes.map(
+        (iframe) =>
+          ({
+            source: iframe.contentWindow,
+            data: { type: 'outputs', outputs: {} },
+          } as MessageEvent)
+      );
+      events.forEach(dispatchMessage);
+      const start = performance.now();
+      for (let i = 0; i < messages; i++) {
+        dispatchMessage(events[i % n]);
+      }
+      costs[n] = (performance.now() - start) / messages;
+      unlisteners.forEach((unlisten) => unlisten());
+      iframes.forEach((iframe) => iframe.remove());
+    }
+    checkRatio('dispatch_cost_300_vs_10', costs[300] / costs[10]);
+  });
+
+  it('prepares inputs for each embed', async () => {
+    const rows = 100000;
+    const encoded = makeEncodedFrame(rows);
+    const hash = 'abc';
+    const store = { get: async () => encoded };
+    const changed = { data: { [TYPE_KEY]: 'blob', hash } };
+    // what each view does in onInputs before posting to its iframe
+    const prepare = async () => {
+      const transfer: ArrayBuffer[] = [];
+      prepareForTransfer(await resolveBlobs(changed, store), transfer);
+      return transfer;
+    };
+    const transfer = await prepare();
+    checkBytes(
+      `inputs_buffer_bytes_per_embed_${rows}`,
+      transfer.reduce((sum, b) => sum + b.byteLength, 0)
+    );
+    const records = makeRows(rows);
+    const embeds = 10;
+    const binaryTime = await bestTime(async () => {
+      for (let i = 0; i < embeds; i++) {
+        await prepare();
+      }
+    });
+    const jsonTime = await bestTime(() => {
+      for (let i = 0; i < embeds; i++) {
+        JSON.parse(JSON.stringify(records));
+      }
+    });
+    checkSpeedup(`inputs_speedup_${rows}`, jsonTime / binaryTime);
+  });
+
+  it('serializes outputs', async () => {
+    for (const rows of [1000, 10000, 100000]) {
+      const value = makeRows(rows);
+      checkBytes(
+        `outputs_bytes_json_${rows}`,
+        messageBytes(cleanOutput('data', value))
+      );
+      checkBytes(
+        `outputs_bytes_binary_${rows}`,
+        messageBytes(encodeOutput('data', value, true))
+      );
+      const jsonTime = await bestTime(() => cleanOutput('data', value));
+      const binaryTime = await bestTime(() =>
+        encodeOutput('data', value, true)
+      );
+      checkSpeedup(`outputs_speedup_${rows}`, jsonTime / binaryTime);
+    }
+  });
+});
@@ -0,0 +1,92 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+import {
+  dispatchMessage,
+  listenToSizeAndValuesAndReady,
+} from '../wrapper_code';
+
+function addEmbeds(n: number) {
+  const received: any[][] = [];
+  const iframes: HTMLIFrameElement[] = [];
+  const unlisteners: (() => void)[] = [];
+  for (let i = 0; i < n; i++) {
+    const iframe = document.createElement('iframe');
+    document.body.appendChild(iframe);
+    iframes.push(iframe);
+    received.push([]);
+    unlisteners.push(
+      listenToSizeAndValuesAndReady(
+        iframe,
+        (values) => received[i].push(values),
+        () => undefined
+      )
+    );
+  }
+  const remove = () => {
+    unlisteners.forEach((unlisten) => unlisten());
+    iframes.forEach((iframe) => iframe.remove());
+  };
+  return { iframes, received, remove };
+}
+
+function message(iframe: HTMLIFrameElement, data: any): MessageEvent {
+  return { source: iframe.contentWindow, data } as MessageEvent;
+}
+
+describe('message dispatcher', () => {
+  it('routes messages to the embed they came from', () => {
+    const { iframes, received, remove } = addEmbeds(3);
+    dispatchMessage(
+      message(iframes[1], { type: 'outputs', outputs: { a: 1 } })
+    );
+    dispatchMessage(message(iframes[1], { type: 'iframeSize', height: 42 }));
+    expect(received).toEqual([[], [{ a: 1 }], []]);
+    expect(iframes[1].height).toEqual('42');
+    remove();
+  });
+
+  it('stops routing to removed embeds', () => {
+    const { iframes, received, remove } = addEmbeds(2);
+    remove();
+    dispatchMessage(message(iframes[0], { type: 'outputs', outputs: {} }));
+    expect(received).toEqual([[], []]);
+  });
+
+  it('drops messages from unknown windows', () => {
+    const { iframes, received, remove } = addEmbeds(2);
+    const other = document.createElement('iframe');
+    document.body.appendChild(other);
+    dispatchMessage(message(other, { type: 'outputs', outputs: { a: 1 } }));
+    dispatchMessage({
+      source: window,
+      data: { type: 'outputs', outputs: { b: 2 } },
+    } as MessageEvent);
+    dispatchMessage(message(iframes[0], { type: 'outputs', outputs: {} }));
+    expect(received).toEqual([[{}], []]);
+    other.remove();
+    remove();
+  });
+
+  // Benchmark: the cost of a message shouldn't grow with the number of embeds
+  it('costs the same with many embeds', () => {
+    const messages = 20000;
+    const costs: Record<number, number> = {};
+    for (const n of [10, 300]) {
+      const { iframes, remove } = addEmbeds(n);
+      const events = iframes.map((iframe) =>
+        message(iframe, { type: 'outputs', outputs: {} })
+      );
+      events.forEach(dispatchMessage); // warm up
+      const start = performance.now();
+      for (let i = 0; i < messages; i++) {
+        dispatchMessage(events[i % n]);
+      }
+      costs[n] = (performance.now() - start) / messages;
+      remove();
+    }
+    console.log('ms per message by number of embeds:', costs);
+    // scanning every iframe would be ~30x slower
+    expect(costs[300]).toBeLessThan(costs[10] * 5);
+  });
+});
@@ -0,0 +1,108 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+// @ts-ignore: iframe_code.js has no type declarations
+import { embed } from '../iframe_code';
+
+const RUNTIME_URL = 'test-runtime';
+const MODULES_URL = 'test-modules/';
+
+// what the observer function returned for each cell the notebook defined
+let observers: Map<string, any>;
+
+// Just enough of @observablehq/runtime for embed() to run a notebook
+class FakeModule {
+  constructor(public _runtime: FakeRuntime) {}
+
+  variable(observer: any) {
+    return {
+      define: (name: any, ...rest: any[]) => {
+        if (typeof name === 'string') {
+          observers.set(name, observer);
+        }
+      },
+    };
+  }
+
+  redefine() {
+    // no inputs are sent
+  }
+}
+
+class FakeRuntime {
+  module(define?: any, observer?: any) {
+    return define ? define(this, observer) : new FakeModule(this);
+  }
+
+  dispose() {
+    // nothing is running
+  }
+}
+
+// a notebook where output depends on hidden, and shown depends on nothing
+function define(runtime: any, observer: any) {
+  const main = runtime.module();
+  main.variable(observer('hidden')).define('hidden', () => 1);
+  main.variable(observer('shown')).define('shown', () => 2);
+  main
+    .variable(observer('output'))
+    .define('output', ['hidden'], (hidden: number) => hidden + 1);
+  main.variable(observer('unused')).define('unused', () => 3);
+  return main;
+}
+
+jest.doMock(
+  RUNTIME_URL,
+  () => ({
+    Runtime: FakeRuntime,
+    Library: class {},
+    Inspector: { into: () => () => ({ fulfilled() {} }) },
+  }),
+  { virtual: true }
+);
+jest.doMock(
+  `${MODULES_URL}@user/notebook.js?v=3`,
+  () => ({ default: define }),
+  { virtual: true }
+);
+
+// the observers of each cell once embed() has started the notebook
+async function observe(lazy: boolean): Promise<Map<string, any>> {
+  observers = new Map();
+  const into = document.createElement('div');
+  const dispose = await embed('@user/notebook', into, ['shown'], ['output'], {
+    lazy,
+    runtimeUrl: RUNTIME_URL,
+    modulesUrl: MODULES_URL,
+  });
+  window.dispatchEvent(
+    new MessageEvent('message', {
+      data: { type: 'inputs', inputs: {} },
+      source: window,
+    })
+  );
+  dispose();
+  return observers;
+}
+
+describe('embed', () => {
+  it('should observe every cell', async () => {
+    const observed = await observe(false);
+    for (const name of ['hidden', 'shown', 'output', 'unused']) {
+      expect(observed.get(name)).toBeDefined();
+    }
+    expect(observed.get('observableJupyterWidgetOutputCell')).toBeDefined();
+  });
+
+  it('should only observe displayed cells when lazy', async () => {
+    const observed = await observe(true);
+    expect(observed.get('shown')).toBeDefined();
+    expect(observed.get('observableJupyterWidgetOutputCell')).toBeDefined();
+    // the runtime computes these only if an observed cell depends on them,
+    // output through the synthetic output cell
+    expect(observed.get('hidden')).toBeUndefined();
+    expect(observed.get('output')).toBeUndefined();
+    expect(observed.get('unused')).toBeUndefined();
+    expect([...observed.keys()]).toContain('unused');
+  });
+});
@@ -0,0 +1,78 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+import { IframePool } from '../iframe_pool';
+
+function element(): HTMLElement {
+  const el = document.createElement('div');
+  document.body.appendChild(el);
+  return el;
+}
+
+describe('IframePool', () => {
+  const proto = Element.prototype as any;
+
+  beforeEach(() => {
+    jest.useFakeTimers();
+  });
+
+  afterEach(() => {
+    delete proto.moveBefore;
+    jest.useRealTimers();
+  });
+
+  it('positions frames over their view if they cannot be moved', () => {
+    const pool = new IframePool(1);
+    const into = element();
+    const frame = pool.checkout(undefined, '@a/b', into);
+    const container = frame.iframe.parentElement as HTMLElement;
+    expect(container.className).toBe('observable-iframe-pool');
+    jest.runOnlyPendingTimers(); // one warm frame
+    pool.release(frame);
+    expect(pool.idle.length).toBe(2);
+    expect(frame.iframe.isConnected).toBe(true);
+
+    frame.iframe.height = '120';
+    const again = element();
+    expect(pool.checkout(undefined, '@a/b', again)).toBe(frame);
+    expect(frame.iframe.parentElement).toBe(container);
+    expect(again.style.height).toBe('120px');
+    pool.release(frame);
+    expect(again.style.height).toBe('');
+  });
+
+  it('reuses released frames for the same notebook', () => {
+    proto.moveBefore = function (node: Node, child: Node | null) {
+      this.insertBefore(node, child);
+    };
+    const pool = new IframePool(1);
+    const frame = pool.checkout(undefined, '@a/b', element());
+    frame.run(
+      { slug: '@a/b', options: {} },
+      { onValues: jest.fn(), onReady: jest.fn() }
+    );
+    jest.runAllTimers(); // one warm frame
+    expect(pool.idle.length).toBe(1);
+    pool.release(frame);
+    expect(pool.idle.length).toBe(2);
+
+    const into = element();
+    expect(pool.checkout(undefined, '@a/b', into)).toBe(frame);
+    expect(frame.iframe.parentElement).toBe(into);
+    // another notebook gets the warm frame
+    const other = pool.checkout(undefined, '@c/d', element());
+    expect(other).not.toBe(frame);
+    expect(other.slug).toBe(undefined);
+  });
+
+  it('keeps frames for local modules separate', () => {
+    proto.moveBefore = function (node: Node, child: Node | null) {
+      this.insertBefore(node, child);
+    };
+    const pool = new IframePool(1);
+    pool.release(pool.checkout(undefined, '@a/b', element()));
+    const frame = pool.checkout('http://localhost/x/', '@a/b', element());
+    expect(frame.key).toBe('http://localhost/x/');
+    expect(pool.idle.every((f) => f.key === '')).toBe(true);
+  });
+});
@@ -4,9 +4,28 @@
 // Add any needed widget imports here (or from controls)
 // import {} from '@jupyter-widgets/base';
 
-import { createTestModel } from './utils';
+import { createTestModel, MockComm } from './utils';
 
-import { ObservableWidgetModel } from '..';
+import {
+  BlobStoreModel,
+  ObservableWidgetModel,
+  ObservableWidgetView,
+} from '..';
+import { resolveBlobs, TYPE_KEY } from '../blob_store';
+import { iframePool } from '../iframe_pool';
+import { approximateBytes } from '../widget';
+
+// the messages sent over a mock comm, and their size as JSON
+function sentMessages(send: jest.SpyInstance): any[] {
+  return send.mock.calls.map((call: any[]) => call[0]);
+}
+
+function sentBytes(send: jest.SpyInstance): number {
+  return sentMessages(send).reduce(
+    (total, data) => total + JSON.stringify(data).length,
+    0
+  );
+}
 
 describe('Example', () => {
   describe('ObservableWidgetModel', () => {
@@ -22,5 +41,219 @@ describe('Example', () => {
       expect(model).toBeInstanceOf(ObservableWidgetModel);
       expect(model.get('value')).toEqual('Foo Bar!');
     });
+
+    it('should merge redefined inputs', () => {
+      const model = createTestModel(ObservableWidgetModel, {
+        inputs: { a: 1 },
+        _input_versions: { a: 1 },
+      });
+      model.trigger(
+        'msg:custom',
+        {
+          type: 'inputs',
+          inputs: { b: 2 },
+          versions: { b: 1 },
+          buffer_paths: [],
+        },
+        []
+      );
+      expect(model.inputValues).toEqual({ a: 1, b: 2 });
+      expect(model.inputVersions).toEqual({ a: 1, b: 1 });
+    });
+
+    it('should keep appended rows within their window', () => {
+      const model = createTestModel(ObservableWidgetModel, {});
+      const append = (cell: string, rows: any[], window?: number) =>
+        model.trigger(
+          'msg:custom',
+          { type: 'append', cell, rows, window, buffer_paths: [] },
+          []
+        );
+      append('a', [1, 2]);
+      append('b', [1]);
+      append('a', [3, 4, 5], 3);
+      expect(model.appendLog.map((e) => e.seq)).toEqual([2, 3]);
+      model.trigger(
+        'msg:custom',
+        {
+          type: 'inputs',
+          inputs: { b: [] },
+          versions: { b: 1 },
+          buffer_paths: [],
+        },
+        []
+      );
+      expect(model.appendLog.map((e) => e.cell)).toEqual(['a']);
+    });
+  });
+
+  describe('stats', () => {
+    it('should count messages from the kernel until reset', () => {
+      jest.useFakeTimers();
+      const comm = new MockComm();
+      const send = jest.spyOn(comm, 'send');
+      const model = createTestModel(ObservableWidgetModel, {}, comm);
+      const content = { type: 'fetch', request_id: 'r', buffer_paths: [] };
+      model.trigger('msg:custom', content, [new DataView(new ArrayBuffer(8))]);
+      const { count, bytes } = model.stats.messages.from_kernel;
+      expect(count).toBe(1);
+      expect(bytes).toBeCloseTo(JSON.stringify(content).length + 8, -1);
+      jest.runAllTimers();
+      const [sent] = sentMessages(send);
+      expect(sent.content.type).toBe('stats');
+      expect(sent.content.messages.from_kernel.count).toBe(1);
+      model.trigger('msg:custom', { type: 'reset_stats' }, []);
+      expect(model.stats.messages.from_kernel.count).toBe(0);
+      jest.useRealTimers();
+    });
+
+    it('should estimate message sizes from a sample of long arrays', () => {
+      const rows = new Array(1000).fill({ x: 1.5, label: 'a' });
+      const json = JSON.stringify({ rows }).length;
+      expect(approximateBytes({ rows }) / json).toBeCloseTo(1, 2);
+      const buffer = new Float64Array(100);
+      expect(approximateBytes({ buffer })).toBeCloseTo(800, -2);
+    });
+
+    it('should send stats without flushing changed attributes', () => {
+      jest.useFakeTimers();
+      const run = (withStats: boolean) => {
+        const comm = new MockComm();
+        const send = jest.spyOn(comm, 'send');
+        const model = createTestModel(ObservableWidgetModel, {}, comm);
+        // changed locally, not saved
+        model.set('value', { a: 'x'.repeat(10000) });
+        if (withStats) {
+          model.countMessage('from_kernel', 10);
+        }
+        jest.runAllTimers();
+        return send;
+      };
+      const baseline = sentBytes(run(false));
+      const send = run(true);
+      expect(sentMessages(send).map((data) => data.method)).toEqual(['custom']);
+      expect(sentBytes(send) - baseline).toBeLessThan(1000);
+      jest.useRealTimers();
+    });
+  });
+
+  describe('ObservableWidgetView', () => {
+    it('should run the notebook in one view at a time', () => {
+      const model = createTestModel(ObservableWidgetModel, {
+        slug: '@a/b',
+        view_sharing: 'leader',
+      });
+      const render = () => {
+        const view = new ObservableWidgetView({ model });
+        view.render();
+        return view;
+      };
+      const first = render();
+      const second = render();
+      expect(model.leader).toBe(first);
+      expect(first.frame).toBeDefined();
+      expect(second.frame).toBeUndefined();
+      second.takeOver();
+      expect(model.leader).toBe(second);
+      expect(first.frame).toBeUndefined();
+      second.remove();
+      expect(model.leader).toBe(first);
+      expect(first.frame).toBeDefined();
+    });
+
+    it('should never sync the merged value in per_cell mode', () => {
+      jest.useFakeTimers();
+      const comm = new MockComm();
+      const send = jest.spyOn(comm, 'send');
+      const model = createTestModel(
+        ObservableWidgetModel,
+        { slug: '@a/b', output_mode: 'per_cell' },
+        comm
+      );
+      const view = new ObservableWidgetView({ model });
+      view.onPublishValues({ a: 1 }, true);
+      view.onPublishValues({ b: 2 }, true);
+      model.set('lazy', true);
+      model.save_changes();
+      jest.runAllTimers();
+      const messages = sentMessages(send);
+      const updates = messages.filter((data) => data.method === 'update');
+      expect(updates.map((data) => data.state)).toEqual([{ lazy: true }]);
+      const outputs = messages.filter(
+        (data) => data.method === 'custom' && data.content.type === 'outputs'
+      );
+      expect(outputs.map((data) => data.content.outputs)).toEqual([
+        { a: 1 },
+        { b: 2 },
+      ]);
+      expect(model.get_state().value).toEqual({ a: 1, b: 2 });
+      jest.useRealTimers();
+    });
+
+    it('should return its frame to the pool before it is detached', () => {
+      const proto = Element.prototype as any;
+      proto.moveBefore = function (node: Node, child: Node | null) {
+        this.insertBefore(node, child);
+      };
+      const model = createTestModel(ObservableWidgetModel, { slug: '@a/b' });
+      const view = new ObservableWidgetView({ model });
+      document.body.appendChild(view.el);
+      view.render();
+      const frame = view.frame!;
+      expect(view.el.contains(frame.iframe)).toBe(true);
+      view.processPhosphorMessage({ type: 'before-detach' });
+      view.el.remove();
+      view.remove();
+      expect(iframePool.idle).toContain(frame);
+      expect(frame.iframe.isConnected).toBe(true);
+      delete proto.moveBefore;
+    });
+
+    it('should show a current snapshot until inputs change', () => {
+      const model = createTestModel(ObservableWidgetModel, {
+        slug: '@a/b',
+        snapshot: true,
+        inputs: { a: 1 },
+        _input_versions: { a: 1 },
+        _snapshot: {
+          html: '<p>cached</p>',
+          height: 20,
+          input_versions: { a: 1 },
+        },
+      });
+      const view = new ObservableWidgetView({ model });
+      view.render();
+      expect(view.showingSnapshot).toBe(true);
+      expect(view.frame).toBeUndefined();
+      const iframe = view.el.querySelector('iframe') as HTMLIFrameElement;
+      expect(iframe.srcdoc).toContain('<p>cached</p>');
+      model.trigger(
+        'msg:custom',
+        {
+          type: 'inputs',
+          inputs: { a: 2 },
+          versions: { a: 2 },
+          buffer_paths: [],
+        },
+        []
+      );
+      expect(view.showingSnapshot).toBe(false);
+      expect(view.frame).toBeDefined();
+    });
+  });
+
+  describe('BlobStoreModel', () => {
+    it('should resolve references once the blob arrives', async () => {
+      const store = createTestModel(BlobStoreModel);
+      const ref = { [TYPE_KEY]: 'blob', hash: 'abc' };
+      const resolved = resolveBlobs({ a: ref, b: [ref, 1] }, store);
+      store.trigger(
+        'msg:custom',
+        { type: 'blob', hash: 'abc', value: [1, 2], buffer_paths: [] },
+        []
+      );
+      expect(await resolved).toEqual({ a: [1, 2], b: [[1, 2], 1] });
+      expect(store.blobs.has('abc')).toBe(true);
+    });
   });
 });
@@ -106,13 +106,15 @@ export interface Constructor<T> {
 
 export function createTestModel<T extends widgets.WidgetModel>(
   constructor: Constructor<T>,
-  attributes?: any
+  attributes?: any,
+  comm?: MockComm
 ): T {
   const id = widgets.uuid();
   const widget_manager = new DummyManager();
   const modelOptions = {
     widget_manager: widget_manager,
     model_id: id,
+    comm: comm,
   };
 
   return new constructor(attributes, modelOptions);
@@ -0,0 +1,91 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+import { WidgetModel, put_buffers } from '@jupyter-widgets/base';
+
+import { MODULE_NAME, MODULE_VERSION } from './version';
+
+// Must match TYPE_KEY in observable_jupyter_widget/_serialization.py
+export const TYPE_KEY = '__observable_jupyter_widget_type__';
+
+// Large DataFrames and arrays in inputs, sent once for the whole page and
+// referenced by content hash from each widget's inputs (see _blobs.py).
+export class BlobStoreModel extends WidgetModel {
+  defaults(): any {
+    return {
+      ...super.defaults(),
+      _model_name: BlobStoreModel.model_name,
+      _model_module: BlobStoreModel.model_module,
+      _model_module_version: BlobStoreModel.model_module_version,
+    };
+  }
+
+  initialize(attributes: any, options: any): void {
+    super.initialize(attributes, options);
+    this.blobs = new Map();
+    this.waiting = new Map();
+    this.on('msg:custom', this.onCustomMessage, this);
+  }
+
+  blobs: Map<string, any>;
+  waiting: Map<string, ((value: any) => void)[]>;
+
+  onCustomMessage(content: any, buffers: DataView[]): void {
+    if (content.type === 'blob') {
+      put_buffers(content, content.buffer_paths, buffers);
+      this.blobs.set(content.hash, content.value);
+      const waiting = this.waiting.get(content.hash) ?? [];
+      this.waiting.delete(content.hash);
+      waiting.forEach((resolve) => resolve(content.value));
+    } else if (content.type === 'drop') {
+      this.blobs.delete(content.hash);
+    }
+  }
+
+  get(hash: string): Promise<any> {
+    if (this.blobs.has(hash)) {
+      return Promise.resolve(this.blobs.get(hash));
+    }
+    return new Promise((resolve) => {
+      const waiting = this.waiting.get(hash);
+      if (waiting) {
+        waiting.push(resolve);
+      } else {
+        this.waiting.set(hash, [resolve]);
+        // e.g. after the page was reloaded
+        this.send({ type: 'request', hash }, {});
+      }
+    });
+  }
+
+  static model_name = 'BlobStoreModel';
+  static model_module = MODULE_NAME;
+  static model_module_version = MODULE_VERSION;
+}
+
+// Replaces blob references in encoded inputs with the encoded values
+export async function resolveBlobs(
+  value: any,
+  store: Pick<BlobStoreModel, 'get'> | null
+): Promise<any> {
+  if (
+    value === null ||
+    typeof value !== 'object' ||
+    value instanceof DataView
+  ) {
+    return value;
+  }
+  if (value[TYPE_KEY] === 'blob') {
+    return store!.get(value.hash);
+  }
+  if (Array.isArray(value)) {
+    return Promise.all(value.map((v) => resolveBlobs(v, store)));
+  }
+  const resolved: Record<string, any> = {};
+  await Promise.all(
+    Object.keys(value).map(async (key) => {
+      resolved[key] = await resolveBlobs(value[key], store);
+    })
+  );
+  return resolved;
+}
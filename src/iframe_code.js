@@ -1,8 +1,11 @@
 // This code is injected into the iframe via a .srcdoc property
-import {
-  Runtime,
-  Inspector,
-} from 'https://cdn.jsdelivr.net/npm/@observablehq/runtime@4/dist/runtime.js';
+
+// Defaults for embed()'s runtimeUrl and modulesUrl options. With
+// ObservableWidget(..., local_modules=True) both point at the Jupyter server
+// instead, see module_store.py.
+const RUNTIME_URL =
+  'https://cdn.jsdelivr.net/npm/@observablehq/runtime@4.18.0/dist/runtime.js';
+const MODULES_URL = 'https://api.observablehq.com/';
 
 export class DocumentBodyDimensionsMutationObserverMonitor {
   constructor() {
@@ -51,7 +54,94 @@ export class DocumentBodyDimensionsResizeObserverMonitor {
   }
 }
 
+// Schedules the runtime, which calls requestAnimationFrame to compute cells
+// (capturing it when the runtime module loads, so install() comes first).
+// The parent widget view picks a mode depending on whether the iframe is on
+// screen and the widget's execution_policy:
+//   'frame'      animation frames, as usual
+//   'timer'      setTimeout, which keeps running when the browser stops
+//                animation frames for offscreen iframes
+//   'suspended'  nothing is computed, and outputs and sizes are held back
+//                until the mode changes
+class Scheduler {
+  constructor() {
+    this.mode = 'frame';
+    this.callbacks = new Map();
+    this.lastId = 0;
+    this.scheduled = null;
+    this.resumeCallbacks = new Set();
+  }
+
+  install() {
+    const native = window.requestAnimationFrame;
+    this.nativeFrame = native ? native.bind(window) : null;
+    window.requestAnimationFrame = (callback) => this.request(callback);
+    window.cancelAnimationFrame = (id) => this.callbacks.delete(id);
+  }
+
+  get suspended() {
+    return this.mode === 'suspended';
+  }
+
+  request(callback) {
+    const id = ++this.lastId;
+    this.callbacks.set(id, callback);
+    this.schedule();
+    return id;
+  }
+
+  schedule() {
+    if (this.scheduled || this.suspended || !this.callbacks.size) {
+      return;
+    }
+    const token = {};
+    this.scheduled = token;
+    const run = () => {
+      if (this.scheduled !== token) {
+        return;
+      }
+      this.scheduled = null;
+      const callbacks = this.callbacks;
+      this.callbacks = new Map();
+      const now = performance.now();
+      for (const callback of callbacks.values()) {
+        callback(now);
+      }
+    };
+    if (this.mode === 'timer' || !this.nativeFrame) {
+      setTimeout(run, 16);
+    } else {
+      this.nativeFrame(run);
+    }
+  }
+
+  setMode(mode) {
+    this.mode = mode;
+    // a frame requested before may never come now
+    this.scheduled = null;
+    if (!this.suspended) {
+      const callbacks = [...this.resumeCallbacks];
+      this.resumeCallbacks.clear();
+      callbacks.forEach((callback) => callback());
+    }
+    this.schedule();
+  }
+
+  // called once when no longer suspended
+  onResume(callback) {
+    this.resumeCallbacks.add(callback);
+  }
+}
+
+const scheduler = new Scheduler();
+
+const postCurrentHeight = () => postHeight(document.body.clientHeight);
+
 function postHeight(height) {
+  if (scheduler.suspended) {
+    scheduler.onResume(postCurrentHeight);
+    return;
+  }
   window.parent.postMessage(
     {
       type: 'iframeSize',
@@ -69,104 +159,743 @@ export const monitor = () => {
   }
 };
 
-class JupyterWidgetOutputObserver {
-  pending() {
-    // could gray something out here
+// Static copy of the rendered cells for ObservableWidget.snapshot, with
+// canvases as images since their contents aren't part of the HTML
+export function snapshotHTML(into) {
+  const copy = into.cloneNode(true);
+  const canvases = into.querySelectorAll('canvas');
+  copy.querySelectorAll('canvas').forEach((canvas, i) => {
+    const img = document.createElement('img');
+    try {
+      img.src = canvases[i].toDataURL();
+    } catch (e) {
+      // tainted by a cross-origin image
+    }
+    img.setAttribute('style', canvas.getAttribute('style') || '');
+    img.style.width = (canvases[i].clientWidth || canvases[i].width) + 'px';
+    canvas.replaceWith(img);
+  });
+  copy.querySelectorAll('script').forEach((script) => script.remove());
+  return copy.innerHTML;
+}
+
+// Must match TYPE_KEY in observable_jupyter_widget/_serialization.py
+const TYPE_KEY = '__observable_jupyter_widget_type__';
+
+const TYPED_ARRAYS = {
+  int8: Int8Array,
+  uint8: Uint8Array,
+  int16: Int16Array,
+  uint16: Uint16Array,
+  int32: Int32Array,
+  uint32: Uint32Array,
+  float32: Float32Array,
+  float64: Float64Array,
+  bool: Uint8Array,
+  datetime: Float64Array,
+};
+
+function decodeArray(dtype, buffer) {
+  const array = new TYPED_ARRAYS[dtype](buffer);
+  if (dtype === 'bool') {
+    return Array.from(array, (v) => v !== 0);
+  } else if (dtype === 'datetime') {
+    return Array.from(array, (v) => (isNaN(v) ? null : new Date(v)));
   }
-  fulfilled(value) {
-    // postMessage does a "structured clone" which fails for DOM elements, functions, and more
-    // so let's jsonify
-    // We will probably wastefully jsonify again on the other side of the postMessage
-    const cleaned = {};
-    for (const name of Object.keys(value)) {
-      try {
-        let v = value[name];
-        if (v instanceof Set) {
-          v = Array.from(v);
-        } else if (v instanceof Map) {
-          v = Object.fromEntries(v);
+  return array;
+}
+
+// Python values arrive as JSON, except for DataFrames and NumPy arrays
+// which arrive as ArrayBuffers of column data.
+export function decodeInput(value) {
+  if (Array.isArray(value)) {
+    return value.map(decodeInput);
+  }
+  if (
+    value === null ||
+    typeof value !== 'object' ||
+    value instanceof ArrayBuffer
+  ) {
+    return value;
+  }
+  const type = value[TYPE_KEY];
+  if (type === 'dataframe') {
+    const names = value.columns.map((c) => c.name);
+    const columns = value.columns.map((c) =>
+      c.data ? decodeArray(c.dtype, c.data) : decodeInput(c.values)
+    );
+    // rows of objects, with a columns property like d3.csvParse returns
+    const rows = new Array(value.length);
+    for (let i = 0; i < value.length; i++) {
+      const row = {};
+      for (let j = 0; j < names.length; j++) {
+        row[names[j]] = columns[j][i];
+      }
+      rows[i] = row;
+    }
+    rows.columns = names;
+    return rows;
+  } else if (type === 'ndarray') {
+    const flat = decodeArray(value.dtype, value.data);
+    return reshape(flat, value.shape);
+  }
+  const decoded = {};
+  for (const name of Object.keys(value)) {
+    decoded[name] = decodeInput(value[name]);
+  }
+  return decoded;
+}
+
+// 1-D arrays stay typed arrays, higher dimensions become nested arrays of them
+function reshape(flat, shape) {
+  if (shape.length <= 1) {
+    return flat;
+  }
+  const [n, ...rest] = shape;
+  const stride = rest.reduce((a, b) => a * b, 1);
+  const nested = [];
+  for (let i = 0; i < n; i++) {
+    const slice = flat.subarray
+      ? flat.subarray(i * stride, (i + 1) * stride)
+      : flat.slice(i * stride, (i + 1) * stride);
+    nested.push(reshape(slice, rest));
+  }
+  return nested;
+}
+
+// postMessage does a "structured clone" which fails for DOM elements, functions, and more
+// so let's jsonify
+export function cleanOutput(name, v) {
+  try {
+    if (v instanceof Set) {
+      v = Array.from(v);
+    } else if (v instanceof Map) {
+      v = Object.fromEntries(v);
+    }
+    return JSON.parse(JSON.stringify(v));
+  } catch (e) {
+    console.log('error JSONifying value of cell', name, v);
+    return null;
+  }
+}
+
+const TYPED_ARRAY_DTYPES = new Map([
+  [Int8Array, 'int8'],
+  [Uint8Array, 'uint8'],
+  [Uint8ClampedArray, 'uint8'],
+  [Int16Array, 'int16'],
+  [Uint16Array, 'uint16'],
+  [Int32Array, 'int32'],
+  [Uint32Array, 'uint32'],
+  [Float32Array, 'float32'],
+  [Float64Array, 'float64'],
+]);
+
+// With binaryOutputs, typed arrays and arrays of numbers are posted as
+// 'ndarray's and arrays of row objects as 'dataframe's of column buffers,
+// encoded like inputs, so the kernel doesn't build Python objects per row.
+export function encodeOutput(name, v, binary) {
+  const encoded = binary ? encodeBinary(v) : null;
+  return encoded || cleanOutput(name, v);
+}
+
+function encodeBinary(v) {
+  const dtype = ArrayBuffer.isView(v) && TYPED_ARRAY_DTYPES.get(v.constructor);
+  if (dtype) {
+    const data = v.slice().buffer;
+    return { [TYPE_KEY]: 'ndarray', dtype, shape: [v.length], data };
+  }
+  if (!Array.isArray(v) || !v.length) {
+    return null;
+  }
+  if (v.every((x) => typeof x === 'number')) {
+    const data = Float64Array.from(v).buffer;
+    const shape = [v.length];
+    return { [TYPE_KEY]: 'ndarray', dtype: 'float64', shape, data };
+  }
+  const isRow = (row) =>
+    row !== null &&
+    typeof row === 'object' &&
+    Object.getPrototypeOf(row) === Object.prototype;
+  if (!v.every(isRow)) {
+    return null;
+  }
+  const names = new Set(v.columns || []);
+  for (const row of v) {
+    for (const key of Object.keys(row)) {
+      names.add(key);
+    }
+  }
+  return {
+    [TYPE_KEY]: 'dataframe',
+    length: v.length,
+    columns: [...names].map((name) => encodeColumn(name, v)),
+  };
+}
+
+function encodeColumn(name, rows) {
+  const values = rows.map((row) => row[name]);
+  const missing = (x) => x === null || x === undefined;
+  if (values.every((x) => typeof x === 'number' || missing(x))) {
+    // missing values become NaN
+    const data = Float64Array.from(values, (x) => (missing(x) ? NaN : x));
+    return { name, dtype: 'float64', data: data.buffer };
+  }
+  if (values.every((x) => typeof x === 'boolean')) {
+    const data = Uint8Array.from(values, Number);
+    return { name, dtype: 'bool', data: data.buffer };
+  }
+  if (values.every((x) => x instanceof Date || missing(x))) {
+    const data = Float64Array.from(values, (x) =>
+      missing(x) ? NaN : x.getTime()
+    );
+    return { name, dtype: 'datetime', data: data.buffer };
+  }
+  return { name, values: cleanOutput(name, values) };
+}
+
+// Number of rows of an ndarray (along its first axis) or dataframe encoded
+// by encodeBinary, undefined for other values
+function encodedLength(value) {
+  const type = value !== null && typeof value === 'object' && value[TYPE_KEY];
+  if (type === 'ndarray') {
+    return value.shape[0];
+  } else if (type === 'dataframe') {
+    return value.length;
+  }
+  return undefined;
+}
+
+// Rows start to end of an encoded ndarray or dataframe, see encodedLength
+function sliceEncoded(value, start, end) {
+  const length = encodedLength(value);
+  start = Math.min(start, length);
+  end = Math.max(start, Math.min(end, length));
+  const sliceData = (dtype, data, stride) => {
+    const bytes = TYPED_ARRAYS[dtype].BYTES_PER_ELEMENT * stride;
+    return data.slice(start * bytes, end * bytes);
+  };
+  if (value[TYPE_KEY] === 'ndarray') {
+    const [, ...rest] = value.shape;
+    const stride = rest.reduce((a, b) => a * b, 1);
+    return {
+      ...value,
+      shape: [end - start, ...rest],
+      data: sliceData(value.dtype, value.data, stride),
+    };
+  }
+  return {
+    ...value,
+    length: end - start,
+    columns: value.columns.map((column) =>
+      column.data
+        ? { ...column, data: sliceData(column.dtype, column.data, 1) }
+        : { ...column, values: column.values.slice(start, end) }
+    ),
+  };
+}
+
+// Bytes it takes to send an output: its JSON, plus the ArrayBuffers and typed
+// arrays in it (e.g. from binaryOutputs), which are sent as binary buffers
+function outputSize(value) {
+  let bytes = 0;
+  const json = JSON.stringify(value, (key, v) => {
+    if (v instanceof ArrayBuffer || ArrayBuffer.isView(v)) {
+      bytes += v.byteLength;
+      return null;
+    }
+    return v;
+  });
+  return (json || '').length + bytes;
+}
+
+class OutputPublisher {
+  // maxHz of 0 posts every output immediately. Otherwise outputs are posted
+  // at most maxHz times a second: the first right away, then whatever
+  // arrived during the interval is coalesced (latest value wins) and posted
+  // at its end.
+  constructor(maxHz = 0, budget = 0, binary = false) {
+    this.interval = maxHz > 0 ? 1000 / maxHz : 0;
+    this.budget = budget;
+    this.binary = binary;
+    // every output's latest value, for 'fetch' requests
+    this.latest = {};
+    this.lastPosted = -Infinity;
+    this.pending = null;
+    this.timer = null;
+    this.closed = false;
+    this.resume = () => this.flush();
+    // the input versions and number of appends outputs are computed from,
+    // replaced (not changed) when inputs arrive, see ObservableWidget.wait_for
+    this.computedFrom = { versions: {}, appends: 0 };
+  }
+
+  // drop anything pending and post nothing more
+  close() {
+    clearTimeout(this.timer);
+    this.pending = null;
+    this.closed = true;
+  }
+
+  // partial outputs only contain the cells that changed
+  publish(outputs, partial) {
+    this.latest = partial ? { ...this.latest, ...outputs } : outputs;
+    outputs = this.applyBudget(outputs);
+    // Partial outputs say what each cell was computed from, since those
+    // held back and merged may be from before the latest inputs.
+    let computedFrom = this.computedFrom;
+    if (partial) {
+      computedFrom = {};
+      for (const name of Object.keys(outputs)) {
+        computedFrom[name] = this.computedFrom;
+      }
+    }
+    if (!this.interval && !scheduler.suspended) {
+      this.post(outputs, partial, computedFrom);
+      return;
+    }
+    if (this.pending && partial) {
+      Object.assign(this.pending.outputs, outputs);
+      Object.assign(this.pending.computedFrom, computedFrom);
+    } else {
+      this.pending = { outputs: { ...outputs }, partial, computedFrom };
+    }
+    if (scheduler.suspended) {
+      scheduler.onResume(this.resume);
+      return;
+    }
+    const wait = this.lastPosted + this.interval - performance.now();
+    if (wait <= 0) {
+      this.flush();
+    } else if (this.timer === null) {
+      this.timer = setTimeout(() => this.flush(), wait);
+    }
+  }
+
+  // Outputs of more than budget bytes are replaced by placeholders, see
+  // ObservableWidget.fetch
+  applyBudget(outputs) {
+    if (!this.budget) {
+      return outputs;
+    }
+    const result = {};
+    for (const name of Object.keys(outputs)) {
+      const value = outputs[name];
+      const size = outputSize(value);
+      if (size <= this.budget) {
+        result[name] = value;
+      } else {
+        result[name] = { [TYPE_KEY]: 'deferred', size };
+        const length = Array.isArray(value)
+          ? value.length
+          : encodedLength(value);
+        if (length !== undefined) {
+          result[name].length = length;
         }
-        cleaned[name] = JSON.parse(JSON.stringify(v));
-      } catch (e) {
-        console.log('error JSONifying value of cell', name, v);
-        cleaned[name] = null;
       }
     }
+    return result;
+  }
+
+  // reply to a 'fetch' message, optionally a slice of a list, or of the
+  // rows of a binary encoded array or data frame
+  fetch({ request_id, cell, offset, limit }) {
+    const reply = { type: 'fetched', request_id };
+    if (!(cell in this.latest)) {
+      reply.error = `${cell} has no value yet`;
+      return reply;
+    }
+    let value = this.latest[cell];
+    const start = offset || 0;
+    const end = limit == null ? Infinity : start + limit;
+    if (Array.isArray(value)) {
+      reply.total = value.length;
+      value = value.slice(start, end);
+    } else if (encodedLength(value) !== undefined) {
+      reply.total = encodedLength(value);
+      value = sliceEncoded(value, start, end);
+    }
+    reply.value = value;
+    return reply;
+  }
+
+  flush() {
+    clearTimeout(this.timer);
+    this.timer = null;
+    if (scheduler.suspended) {
+      scheduler.onResume(this.resume);
+      return;
+    }
+    if (this.pending) {
+      const { outputs, partial, computedFrom } = this.pending;
+      this.pending = null;
+      this.lastPosted = performance.now();
+      this.post(outputs, partial, computedFrom);
+    }
+  }
+
+  // inputs or appended rows arrived, with versions by cell or the number of
+  // appends so far
+  received({ versions, appends }) {
+    const current = this.computedFrom;
+    this.computedFrom = {
+      versions: versions
+        ? { ...current.versions, ...versions }
+        : current.versions,
+      appends: Math.max(current.appends, appends || 0),
+    };
+  }
+
+  post(outputs, partial, computedFrom) {
+    if (this.closed) {
+      return;
+    }
     window.parent.postMessage(
       {
         type: 'outputs',
-        outputs: JSON.parse(JSON.stringify(cleaned)),
+        outputs,
+        partial,
+        computed_from: computedFrom,
       },
       '*'
     );
   }
+}
+
+// Available to notebook cells as `jupyter`:
+//   const rows = await jupyter.call('query', [x0, x1], { signal });
+// calls a Python function registered with ObservableWidget.register_handler.
+// The Promise rejects if the call fails, is superseded by a newer one, or is
+// aborted through the optional AbortSignal.
+class JupyterRPC {
+  constructor() {
+    this.pending = new Map();
+    // unique across iframes, replies are broadcast to every view
+    this.prefix = Math.random().toString(36).slice(2);
+    this.lastId = 0;
+  }
+
+  call(name, args = [], { signal } = {}) {
+    const request_id = `${this.prefix}-${++this.lastId}`;
+    return new Promise((resolve, reject) => {
+      if (signal && signal.aborted) {
+        reject(new Error(`call to ${name} was aborted`));
+        return;
+      }
+      this.pending.set(request_id, { name, resolve, reject });
+      if (signal) {
+        signal.addEventListener('abort', () => this.cancel(request_id));
+      }
+      window.parent.postMessage({ type: 'call', request_id, name, args }, '*');
+    });
+  }
+
+  cancel(request_id) {
+    const call = this.pending.get(request_id);
+    if (call) {
+      this.pending.delete(request_id);
+      window.parent.postMessage({ type: 'cancel', request_id }, '*');
+      call.reject(new Error(`call to ${call.name} was aborted`));
+    }
+  }
+
+  cancelAll() {
+    for (const request_id of [...this.pending.keys()]) {
+      this.cancel(request_id);
+    }
+  }
+
+  receive({ request_id, value, error, cancelled }) {
+    const call = this.pending.get(request_id);
+    if (!call) {
+      return;
+    }
+    this.pending.delete(request_id);
+    if (cancelled) {
+      call.reject(new Error(`call to ${call.name} was superseded`));
+    } else if (error !== undefined) {
+      call.reject(new Error(error));
+    } else {
+      call.resolve(decodeInput(value));
+    }
+  }
+}
+
+// How long each cell takes to compute, from the runtime marking it pending
+// until it's fulfilled or rejected, and how long the runtime and notebook
+// module took to load. Posted to the view at most once a second, see
+// ObservableWidget.stats.
+class CellStats {
+  constructor(load) {
+    this.load = load;
+    this.cells = {};
+    this.started = new Map();
+    this.timer = null;
+    this.closed = false;
+  }
+
+  // wraps the observer of a named cell (true if it has none)
+  observe(name, observer) {
+    const inner = typeof observer === 'object' ? observer : {};
+    return {
+      pending: (...args) => {
+        this.started.set(name, performance.now());
+        return inner.pending && inner.pending(...args);
+      },
+      fulfilled: (...args) => {
+        this.record(name);
+        return inner.fulfilled && inner.fulfilled(...args);
+      },
+      rejected: (...args) => {
+        this.record(name);
+        return inner.rejected && inner.rejected(...args);
+      },
+    };
+  }
+
+  record(name) {
+    const start = this.started.get(name);
+    if (start === undefined) {
+      // later values of a generator
+      return;
+    }
+    this.started.delete(name);
+    const ms = performance.now() - start;
+    if (!this.cells[name]) {
+      this.cells[name] = { count: 0, total_ms: 0, max_ms: 0, last_ms: 0 };
+    }
+    const cell = this.cells[name];
+    cell.count++;
+    cell.total_ms += ms;
+    cell.max_ms = Math.max(cell.max_ms, ms);
+    cell.last_ms = ms;
+    if (this.timer === null) {
+      this.timer = setTimeout(() => this.post(), 1000);
+    }
+  }
+
+  post() {
+    clearTimeout(this.timer);
+    this.timer = null;
+    if (!this.closed) {
+      const { load, cells } = this;
+      window.parent.postMessage({ type: 'stats', load, cells }, '*');
+    }
+  }
+
+  reset() {
+    this.cells = {};
+    this.post();
+  }
+
+  close() {
+    clearTimeout(this.timer);
+    this.closed = true;
+  }
+}
+
+// Observes a synthetic cell that depends on every output cell
+class JupyterWidgetOutputObserver {
+  constructor(publisher) {
+    this.publisher = publisher;
+  }
+  pending() {
+    // could gray something out here
+  }
+  fulfilled(value) {
+    const cleaned = {};
+    for (const name of Object.keys(value)) {
+      cleaned[name] = encodeOutput(name, value[name], this.publisher.binary);
+    }
+    this.publisher.publish(cleaned, false);
+  }
   rejected(error) {
     console.error('all values rejected:', error);
   }
 }
 
-// (slug: string, into: string | HTMLElement, cells?: string[], outputs?: string[])
-export const embed = async (slug, into, cells, outputs) => {
-  const moduleUrl = 'https://api.observablehq.com/' + slug + '.js?v=3';
+// Observes a single output cell, used with outputMode 'per_cell'
+class JupyterWidgetCellObserver {
+  constructor(name, publisher) {
+    this.name = name;
+    this.publisher = publisher;
+  }
+  pending() {}
+  fulfilled(value) {
+    const { name, publisher } = this;
+    publisher.publish(
+      { [name]: encodeOutput(name, value, publisher.binary) },
+      true
+    );
+  }
+  rejected(error) {
+    console.error('value of cell', this.name, 'rejected:', error);
+  }
+}
+
+// The cells whose values are sent back: outputs, or else the named cells,
+// or else every cell, with viewof cells' values rather than their views
+function outputVariablesOf(main, cells, outputs) {
+  // TODO allow a subset of these to be manually specified?
+  if (outputs) {
+    return new Set(outputs);
+  }
+  const outputVariables = new Set();
+  const candidateOutputVariables = cells ? cells : [...main._scope.keys()];
+  for (const cell of candidateOutputVariables) {
+    if (cell.slice(0, 7) === 'viewof ') {
+      outputVariables.add(cell.slice(7));
+    } else {
+      outputVariables.add(cell);
+    }
+  }
+  return outputVariables;
+}
+
+// A synthetic cell that depends on every output cell
+function defineOutputCell(main, observer, outputVariables) {
+  main
+    .variable(observer('observableJupyterWidgetOutputCell'))
+    .define(
+      'observableJupyterWidgetOutputCell',
+      [...outputVariables],
+      (...args) => {
+        const output = {};
+        [...outputVariables].forEach((name, i) => {
+          output[name] = args[i];
+        });
+        return output;
+      }
+    );
+}
+
+// (slug: string, into: string | HTMLElement, cells?: string[], outputs?: string[], options?: {outputMode?: 'aggregate' | 'per_cell', maxOutputHz?: number, outputBudget?: number, binaryOutputs?: boolean, lazy?: boolean, runtimeUrl?: string, modulesUrl?: string})
+export const embed = async (slug, into, cells, outputs, options = {}) => {
+  const {
+    outputMode = 'aggregate',
+    maxOutputHz = 0,
+    outputBudget = 0,
+    binaryOutputs = false,
+    lazy = false,
+    runtimeUrl = RUNTIME_URL,
+    modulesUrl = MODULES_URL,
+  } = options;
+  const publisher = new OutputPublisher(
+    maxOutputHz,
+    outputBudget,
+    binaryOutputs
+  );
+  const rpc = new JupyterRPC();
+  const started = performance.now();
+  const { Runtime, Inspector, Library } = await import(runtimeUrl);
+  const runtimeLoaded = performance.now();
+  const moduleUrl = modulesUrl + slug + '.js?v=3';
   const define = (await import(moduleUrl)).default;
-  const inspect = Inspector.into(into);
+  const stats = new CellStats({
+    runtime_ms: runtimeLoaded - started,
+    module_ms: performance.now() - runtimeLoaded,
+  });
+  // into is null when running headless in Node.js (see HeadlessRuntime)
+  const inspect = into ? Inspector.into(into) : null;
   const filter = cells ? (name) => cells.includes(name) : (name) => true;
 
   const newDefine = (runtime, observer) => {
     const main = define(runtime, observer);
-    let outputVariables = new Set();
-    // TODO allow a subset of these to be manually specified?
-    if (outputs) {
-      outputVariables = new Set(outputs);
-    } else {
-      const candidateOutputVariables = cells ? cells : [...main._scope.keys()];
-      for (const cell of candidateOutputVariables) {
-        if (cell.slice(0, 7) === 'viewof ') {
-          outputVariables.add(cell.slice(7));
-        } else {
-          outputVariables.add(cell);
-        }
+    const outputVariables = outputVariablesOf(main, cells, outputs);
+    if (outputMode === 'per_cell') {
+      // one observer per output so a change only posts that cell
+      for (const name of outputVariables) {
+        main
+          .variable(new JupyterWidgetCellObserver(name, publisher))
+          .define([name], (value) => value);
       }
+      return;
     }
-    main
-      .variable(observer('observableJupyterWidgetOutputCell'))
-      .define(
-        'observableJupyterWidgetOutputCell',
-        [...outputVariables],
-        (...args) => {
-          const output = {};
-          [...outputVariables].forEach((name, i) => {
-            output[name] = args[i];
-          });
-          return output;
-        }
-      );
+    defineOutputCell(main, observer, outputVariables);
   };
 
   let main;
 
   // TODO wait for this initial inputs message before actually running anything
-  window.addEventListener('message', (msg) => {
+  // arrays that rows are appended to, by cell name
+  const appended = new Map();
+  const appendRows = ({ cell, rows, window: size }) => {
+    let values = appended.get(cell);
+    if (!values) {
+      values = [];
+      appended.set(cell, values);
+    }
+    const decoded = decodeInput(rows);
+    for (let i = 0; i < decoded.length; i++) {
+      values.push(decoded[i]);
+    }
+    if (decoded.columns && !values.columns) {
+      values.columns = decoded.columns;
+    }
+    if (size && values.length > size) {
+      values.splice(0, values.length - size);
+    }
+    // the same array, redefined so dependent cells recompute
+    main.redefine(cell, values);
+  };
+
+  const onMessage = (msg) => {
+    if (msg.data.type === 'append' && msg.source === window.parent && main) {
+      publisher.received({ appends: msg.data.seq });
+      appendRows(msg.data);
+    }
+    if (msg.data.type === 'fetch' && msg.source === window.parent) {
+      window.parent.postMessage(publisher.fetch(msg.data), '*');
+    }
+    if (msg.data.type === 'reply' && msg.source === window.parent) {
+      rpc.receive(msg.data);
+    }
+    if (msg.data.type === 'reset_stats' && msg.source === window.parent) {
+      stats.reset();
+    }
+    if (msg.data.type === 'snapshot' && msg.source === window.parent && into) {
+      window.parent.postMessage(
+        {
+          type: 'snapshot',
+          html: snapshotHTML(into),
+          height: document.body.clientHeight,
+        },
+        '*'
+      );
+    }
     if (msg.data.type === 'inputs' && msg.source === window.parent) {
       // only the first time, start things up
       if (!main) {
-        const runtime = new Runtime();
+        const runtime = new Runtime(
+          Object.assign(new Library(), { jupyter: () => rpc })
+        );
         main = runtime.module(newDefine, (name) => {
           if (name === 'observableJupyterWidgetOutputCell') {
-            return new JupyterWidgetOutputObserver();
+            return new JupyterWidgetOutputObserver(publisher);
+          }
+          const displayed = filter(name) && inspect;
+          if (lazy && !displayed) {
+            // unobserved, so the runtime only computes it if a displayed or
+            // output cell depends on it
+            return undefined;
           }
-          return filter(name) ? inspect() : true;
+          const observer = displayed ? inspect() : true;
+          return name ? stats.observe(name, observer) : observer;
         });
+        window.addEventListener('unload', dispose);
       }
-      window.addEventListener('unload', () => {
-        main._runtime.dispose();
-      });
 
+      // All cells in one message are redefined synchronously, so the runtime
+      // recomputes their dependents once (see ObservableWidget.hold_inputs).
       const inputs = msg.data.inputs;
+      publisher.received(msg.data);
       for (let name of Object.keys(inputs)) {
         try {
           //console.log('redefining', name, 'to', inputs[name]);
-          main.redefine(name, inputs[name]);
+          const value = decodeInput(inputs[name]);
+          // ObservableWidget.append() adds to the value redefined last
+          appended.set(name, Array.isArray(value) ? value : null);
+          main.redefine(name, value);
         } catch (e) {
           if (e.message.endsWith(name + ' is not defined')) {
             console.log(
@@ -180,9 +909,125 @@ export const embed = async (slug, into, cells, outputs) => {
         }
       }
     }
-  });
+  };
+
+  // stops the notebook so the iframe can run another one
+  const dispose = () => {
+    window.removeEventListener('message', onMessage);
+    window.removeEventListener('unload', dispose);
+    publisher.close();
+    stats.close();
+    rpc.cancelAll();
+    if (main) {
+      main._runtime.dispose();
+    }
+    if (into) {
+      into.innerHTML = '';
+    }
+  };
 
+  window.addEventListener('message', onMessage);
   // iframe is ready to start receiving 'inputs' messages
   window.parent.postMessage({ type: 'ready' }, '*');
-  return main;
+  stats.post();
+  return dispose;
+};
+
+// Runs a notebook once in a new runtime with these (encoded) inputs and
+// resolves with its outputs, for ObservableWidget.map(). Only the cells the
+// outputs depend on are computed and nothing is displayed.
+export const evaluate = async (slug, outputs, inputs, options = {}) => {
+  const {
+    binaryOutputs = false,
+    runtimeUrl = RUNTIME_URL,
+    modulesUrl = MODULES_URL,
+  } = options;
+  const { Runtime, Library } = await import(runtimeUrl);
+  const define = (await import(modulesUrl + slug + '.js?v=3')).default;
+  const unavailable = () =>
+    Promise.reject(new Error('jupyter.call() is not available in map()'));
+  const runtime = new Runtime(
+    Object.assign(new Library(), { jupyter: () => ({ call: unavailable }) })
+  );
+  try {
+    return await new Promise((resolve, reject) => {
+      const observer = (name) =>
+        name === 'observableJupyterWidgetOutputCell'
+          ? { pending() {}, fulfilled: resolve, rejected: reject }
+          : undefined;
+      const main = runtime.module((runtime, observer) => {
+        const main = define(runtime, observer);
+        const outputVariables = outputVariablesOf(main, null, outputs);
+        defineOutputCell(main, observer, outputVariables);
+        return main;
+      }, observer);
+      for (const name of Object.keys(inputs)) {
+        main.redefine(name, decodeInput(inputs[name]));
+      }
+    }).then((value) => {
+      const encoded = {};
+      for (const name of Object.keys(value)) {
+        encoded[name] = encodeOutput(name, value[name], binaryOutputs);
+      }
+      return encoded;
+    });
+  } finally {
+    runtime.dispose();
+  }
+};
+
+// Frames from the iframe pool (see src/iframe_pool.ts) load the runtime
+// before they know which notebook they'll run, then run each notebook the
+// parent sends them in turn.
+export const serve = async (into, runtimeUrl = RUNTIME_URL) => {
+  scheduler.install();
+  window.addEventListener('message', (msg) => {
+    if (msg.source === window.parent && msg.data.type === 'schedule') {
+      scheduler.setMode(msg.data.mode);
+    }
+  });
+  await import(runtimeUrl);
+  // embed() is async, so each message waits for the previous one
+  let current = Promise.resolve(null);
+  window.addEventListener('message', (msg) => {
+    const { type } = msg.data;
+    if (
+      msg.source !== window.parent ||
+      (type !== 'embed' && type !== 'dispose')
+    ) {
+      return;
+    }
+    current = current
+      .then(async (dispose) => {
+        if (dispose) {
+          dispose();
+        }
+        if (type === 'embed') {
+          const { slug, cells, outputs, options } = msg.data;
+          return embed(slug, into, cells, outputs, options);
+        }
+        return null;
+      })
+      .catch((e) => {
+        console.error('could not embed', msg.data.slug, e);
+        return null;
+      });
+  });
+  // worker frames of ObservableWidget.map(), one input set at a time
+  window.addEventListener('message', (msg) => {
+    if (msg.source !== window.parent || msg.data.type !== 'evaluate') {
+      return;
+    }
+    const { slug, outputs, inputs, options } = msg.data;
+    evaluate(slug, outputs, inputs, options).then(
+      (value) => window.parent.postMessage({ type: 'evaluated', value }, '*'),
+      (error) =>
+        window.parent.postMessage(
+          { type: 'evaluated', error: String(error?.message ?? error) },
+          '*'
+        )
+    );
+  });
+  // the parent can send 'embed' messages now
+  window.parent.postMessage({ type: 'booted' }, '*');
 };
@@ -0,0 +1,410 @@
+// Copyright (c) Thomas Ballinger
+// Distributed under the terms of the Modified BSD License.
+
+import { MODULE_VERSION } from './version';
+import { Embed, listen, prepareForTransfer } from './wrapper_code';
+
+// this file gets copied over to lib manually, not compiled by tsc
+// eslint-disable-next-line @typescript-eslint/ban-ts-comment
+// @ts-ignore // some webpack import syntax doesn't work with TypeScript?
+import iframe_bundle_src from '!!raw-loader!./iframe_code.js';
+
+// Where the server extension serves cached modules, see _server_extension.py
+export function localAssetsUrl(): string {
+  let baseUrl = document.body.dataset.baseUrl || '/';
+  const config = document.getElementById('jupyter-config-data');
+  if (config) {
+    try {
+      baseUrl = JSON.parse(config.textContent || '{}').baseUrl || baseUrl;
+    } catch (e) {
+      console.warn('could not read jupyter-config-data', e);
+    }
+  }
+  // absolute, since the iframe has an opaque origin
+  return new URL(baseUrl + 'observable-jupyter-widget/', location.href).href;
+}
+
+let iframeCodeUrlPromise: Promise<string | undefined> | undefined;
+
+// iframe_code.js as served by the server extension, so each iframe imports
+// the same cached module instead of compiling its own inlined copy. Checked
+// once per page; undefined if the server extension isn't installed.
+function iframeCodeUrl(): Promise<string | undefined> {
+  if (!iframeCodeUrlPromise) {
+    const url = localAssetsUrl() + 'iframe_code.js?v=' + MODULE_VERSION;
+    iframeCodeUrlPromise = Promise.resolve()
+      .then(() => fetch(url))
+      .then(
+        (response) => (response.ok ? url : undefined),
+        () => undefined
+      );
+  }
+  return iframeCodeUrlPromise;
+}
+
+function stylesheetUrl(assetsUrl?: string): string {
+  return assetsUrl
+    ? assetsUrl + 'inspector.css'
+    : 'https://cdn.jsdelivr.net/npm/@observablehq/inspector@3.2.4/dist/inspector.css';
+}
+
+function get_srcdoc(iframeCodeUrl?: string, assetsUrl?: string) {
+  const stylesheet = stylesheetUrl(assetsUrl);
+  const iframeCode = iframeCodeUrl
+    ? `import { serve, monitor } from '${iframeCodeUrl}';`
+    : iframe_bundle_src;
+  const runtimeUrl = assetsUrl
+    ? JSON.stringify(assetsUrl + 'runtime.js').replace(/</g, '\\u003c')
+    : 'undefined';
+  return `<!DOCTYPE html>
+<link rel="stylesheet" href="${stylesheet}">
+<style>
+body {
+  margin: 0;
+}
+</style>
+<div style="overflow: auto;"></div>
+<script type="module">
+${iframeCode}
+
+const into = document.getElementsByTagName('div')[0];
+serve(into, ${runtimeUrl});
+monitor()
+// TODO how to clean up monitor or a window event listener when this cell gets rerun?
+</script>
+`;
+}
+
+// A page for a sandboxed iframe without scripts showing a snapshot of a
+// notebook's cells, see ObservableWidget.snapshot
+export function get_snapshot_srcdoc(html: string, assetsUrl?: string): string {
+  return `<!DOCTYPE html>
+<link rel="stylesheet" href="${stylesheetUrl(assetsUrl)}">
+<style>
+body {
+  margin: 0;
+}
+</style>
+<div style="overflow: auto;">${html}</div>
+`;
+}
+
+const noop = (): void => undefined;
+
+// A frame's style in a view, and while it waits in the pool's container
+const VIEW_STYLE = 'overflow: auto; min-width: 100%; width: 0px;';
+const IDLE_STYLE = 'position: absolute; left: -10000px; top: 0; width: 800px;';
+
+// Moving an iframe to a different parent element reloads it unless the
+// browser supports Element.moveBefore. Without it (Firefox, Safari), or while
+// a view isn't in the document yet, frames stay in the pool's container and
+// are positioned over their view.
+function canMoveFrames(): boolean {
+  return typeof (Element.prototype as any).moveBefore === 'function';
+}
+
+// The inset of the part of rect that isn't scrolled out of sight in el's
+// ancestors, e.g. a notebook panel
+function clipInset(el: HTMLElement, rect: DOMRect): string {
+  let { top, right, bottom, left } = rect;
+  for (let a = el.parentElement; a; a = a.parentElement) {
+    if (getComputedStyle(a).overflow !== 'visible') {
+      const r = a.getBoundingClientRect();
+      top = Math.max(top, r.top);
+      right = Math.min(right, r.right);
+      bottom = Math.max(top, Math.min(bottom, r.bottom));
+      left = Math.min(right, Math.max(left, r.left));
+    }
+  }
+  const inset = [
+    top - rect.top,
+    rect.right - right,
+    rect.bottom - bottom,
+    left - rect.left,
+  ];
+  return `inset(${inset.map((x) => x + 'px').join(' ')})`;
+}
+
+export interface EmbedConfig {
+  slug: string;
+  cells?: string[];
+  outputs?: string[];
+  options: Record<string, any>;
+}
+
+export interface FrameHandlers {
+  onValues: (values: any, partial: boolean, computedFrom: any) => void;
+  onReady: () => void;
+  onMessage?: (data: any) => void;
+}
+
+/**
+ * An iframe that has loaded the Observable runtime and runs whichever
+ * notebook it's given, one at a time.
+ */
+export class PooledFrame {
+  iframe: HTMLIFrameElement;
+  // assetsUrl the frame was booted with, or '' for the CDN
+  key: string;
+  // the notebook it last ran, already imported in the frame
+  slug?: string;
+  booted: Promise<void>;
+  private embed: Embed;
+  private unlisten: () => void;
+  // stops positioning the frame over a view, see cover()
+  private uncover?: () => void;
+
+  // the frame waits in parent until it's shown, it's inserted before its
+  // messages are listened to, see listen()
+  constructor(parent: HTMLElement, assetsUrl?: string) {
+    this.key = assetsUrl || '';
+    this.iframe = document.createElement('iframe');
+    this.iframe.setAttribute('sandbox', 'allow-scripts');
+    this.iframe.setAttribute('style', IDLE_STYLE);
+    this.iframe.setAttribute('aria-hidden', 'true');
+    this.iframe.setAttribute('frameBorder', '0');
+    iframeCodeUrl().then((url) => {
+      this.iframe.srcdoc = get_srcdoc(url, assetsUrl);
+    });
+    this.embed = { iframe: this.iframe, onValues: noop, onReady: noop };
+    this.booted = new Promise((resolve) => {
+      this.embed.onBooted = resolve;
+    });
+    parent.appendChild(this.iframe);
+    this.unlisten = listen(this.embed);
+  }
+
+  run(config: EmbedConfig, handlers: FrameHandlers): void {
+    this.slug = config.slug;
+    this.embed.onValues = noop;
+    this.embed.onMessage = undefined;
+    this.embed.onReady = () => {
+      // messages the previous notebook posted before it was disposed arrive
+      // before this, so they're dropped
+      this.embed.onValues = handlers.onValues;
+      this.embed.onMessage = handlers.onMessage;
+      handlers.onReady();
+    };
+    this.post({ type: 'embed', ...config });
+  }
+
+  // stop the notebook, the frame can run another one afterwards
+  stop(): void {
+    this.embed.onValues = noop;
+    this.embed.onReady = noop;
+    this.embed.onMessage = undefined;
+    this.post({ type: 'dispose' });
+    this.schedule('frame');
+  }
+
+  // Runs a notebook once with these inputs, see evaluate() in iframe_code.js.
+  // One at a time, in a frame that isn't running a notebook.
+  evaluate(job: {
+    slug: string;
+    outputs?: string[];
+    inputs: Record<string, any>;
+    options: Record<string, any>;
+  }): Promise<any> {
+    this.slug = job.slug;
+    return new Promise((resolve, reject) => {
+      this.embed.onMessage = (data) => {
+        if (data.type !== 'evaluated') {
+          return;
+        }
+        this.embed.onMessage = undefined;
+        if (data.error !== undefined) {
+          reject(new Error(data.error));
+        } else {
+          resolve(data.value);
+        }
+      };
+      this.post({ type: 'evaluate', ...job });
+    });
+  }
+
+  // see Scheduler in iframe_code.js
+  schedule(mode: 'frame' | 'timer' | 'suspended'): void {
+    this.post({ type: 'schedule', mode });
+  }
+
+  // Shows the frame in a view, moved into `into` or positioned over it
+  show(into: HTMLElement): void {
+    this.iframe.removeAttribute('aria-hidden');
+    if (canMoveFrames() && into.isConnected) {
+      this.iframe.setAttribute('style', VIEW_STYLE);
+      (into as any).moveBefore(this.iframe, null);
+    } else {
+      this.cover(into);
+    }
+  }
+
+  // Moves the frame out of sight into the pool's container
+  hide(container: HTMLElement): void {
+    this.uncover?.();
+    if (this.iframe.parentElement !== container) {
+      (container as any).moveBefore(this.iframe, null);
+    }
+    this.iframe.setAttribute('style', IDLE_STYLE);
+    this.iframe.setAttribute('aria-hidden', 'true');
+  }
+
+  // Keeps the frame, which stays where it is, over `placeholder` and the
+  // placeholder as high as the frame
+  private cover(placeholder: HTMLElement): void {
+    const iframe = this.iframe;
+    let style = '';
+    let scheduled = false;
+    const position = () => {
+      scheduled = false;
+      const rect = placeholder.getBoundingClientRect();
+      if (!placeholder.isConnected || !iframe.parentElement || !rect.width) {
+        style = IDLE_STYLE;
+      } else {
+        const origin = iframe.parentElement.getBoundingClientRect();
+        style = [
+          'position: absolute',
+          'overflow: auto',
+          `left: ${rect.left - origin.left}px`,
+          `top: ${rect.top - origin.top}px`,
+          `width: ${rect.width}px`,
+          `clip-path: ${clipInset(placeholder, rect)}`,
+        ].join('; ');
+      }
+      if (iframe.getAttribute('style') !== style) {
+        iframe.setAttribute('style', style);
+      }
+    };
+    const schedule = () => {
+      if (!scheduled) {
+        scheduled = true;
+        requestAnimationFrame(position);
+      }
+    };
+    const setHeight = () => {
+      placeholder.style.height = (iframe.height || '0') + 'px';
+    };
+    const resize = () => {
+      setHeight();
+      schedule();
+    };
+    setHeight();
+    position();
+    // the frame's height is set by iframeSize messages, see wrapper_code
+    const heights = new MutationObserver(resize);
+    heights.observe(iframe, { attributes: true, attributeFilter: ['height'] });
+    const sizes =
+      typeof ResizeObserver !== 'undefined'
+        ? new ResizeObserver(schedule)
+        : undefined;
+    sizes?.observe(placeholder);
+    // scrolling any element, and layout changes elsewhere on the page
+    window.addEventListener('scroll', schedule, true);
+    window.addEventListener('resize', schedule);
+    const poll = setInterval(schedule, 250);
+    this.uncover = () => {
+      this.uncover = undefined;
+      heights.disconnect();
+      sizes?.disconnect();
+      window.removeEventListener('scroll', schedule, true);
+      window.removeEventListener('resize', schedule);
+      clearInterval(poll);
+      placeholder.style.height = '';
+    };
+  }
+
+  destroy(): void {
+    this.uncover?.();
+    this.unlisten();
+    this.iframe.remove();
+  }
+
+  // buffers in the message (as DataViews) are copied and transferred
+  post(message: any): void {
+    const transfer: ArrayBuffer[] = [];
+    message = prepareForTransfer(message, transfer);
+    this.booted.then(() => {
+      this.iframe.contentWindow?.postMessage(message, '*', transfer);
+    });
+  }
+}
+
+/**
+ * Page-level pool of booted iframes, so rendering a view (e.g. re-running
+ * the cell that displays a widget) doesn't wait for a new iframe to load
+ * the runtime. Idle frames wait out of sight in an element in the document.
+ */
+export class IframePool {
+  idle: PooledFrame[] = [];
+  private container?: HTMLElement;
+
+  // warm frames kept ready per assetsUrl, and at most this many idle frames
+  constructor(public size = 2, public maxIdle = 8) {}
+
+  // A frame shown in `into`, preferably one that last ran the same notebook
+  checkout(
+    assetsUrl: string | undefined,
+    slug: string,
+    into: HTMLElement
+  ): PooledFrame {
+    const key = assetsUrl || '';
+    let i = this.idle.findIndex((f) => f.key === key && f.slug === slug);
+    if (i === -1) {
+      i = this.idle.findIndex((f) => f.key === key && f.slug === undefined);
+    }
+    if (i === -1) {
+      i = this.idle.findIndex((f) => f.key === key);
+    }
+    let frame: PooledFrame;
+    if (i !== -1) {
+      frame = this.idle.splice(i, 1)[0];
+    } else {
+      frame = new PooledFrame(this.getContainer(), assetsUrl);
+    }
+    frame.show(into);
+    setTimeout(() => this.fill(assetsUrl));
+    return frame;
+  }
+
+  // Called when a view stops running its notebook: the frame is stopped and
+  // kept for reuse if it's still in the document, otherwise destroyed. Views
+  // release frames moved into them before they're detached, see
+  // ObservableWidgetView.processPhosphorMessage.
+  release(frame: PooledFrame): void {
+    frame.stop();
+    const container = this.getContainer();
+    if (frame.iframe.isConnected && this.idle.length < this.maxIdle) {
+      frame.hide(container);
+      this.idle.push(frame);
+    } else {
+      frame.destroy();
+    }
+  }
+
+  private fill(assetsUrl?: string): void {
+    const key = assetsUrl || '';
+    let warm = this.idle.filter((f) => f.key === key && !f.slug).length;
+    while (warm < this.size && this.idle.length < this.maxIdle) {
+      const frame = new PooledFrame(this.getContainer(), assetsUrl);
+      this.idle.push(frame);
+      warm++;
+    }
+  }
+
+  private getContainer(): HTMLElement {
+    if (!this.container || !this.container.isConnected) {
+      // frames in a removed container have been unloaded
+      this.idle.forEach((frame) => frame.destroy());
+      this.idle = [];
+      this.container = document.createElement('div');
+      this.container.className = 'observable-iframe-pool';
+      this.container.setAttribute(
+        'style',
+        'position: absolute; left: 0; top: 0; width: 0; height: 0;'
+      );
+      document.body.appendChild(this.container);
+    }
+    return this.container;
+  }
+}
+
+export const iframePool = new IframePool();
@@ -5,17 +5,117 @@ import {
   DOMWidgetModel,
   DOMWidgetView,
   ISerializers,
+  put_buffers,
+  remove_buffers,
+  unpack_models,
 } from '@jupyter-widgets/base';
 
 import { MODULE_NAME, MODULE_VERSION } from './version';
-import { listenToSizeAndValuesAndReady, sendInputs } from './wrapper_code';
+import { sendInputs } from './wrapper_code';
+import { BlobStoreModel, resolveBlobs, TYPE_KEY } from './blob_store';
+import {
+  get_snapshot_srcdoc,
+  iframePool,
+  localAssetsUrl,
+  PooledFrame,
+} from './iframe_pool';
 import { logo } from './observable_logo';
-
-// this file gets copied over to lib manually, not compiled by tsc
-// eslint-disable-next-line @typescript-eslint/ban-ts-comment
-// @ts-ignore // some webpack import syntax doesn't work with TypeScript?
-import iframe_bundle_src from '!!raw-loader!./iframe_code.js';
 import '../css/widget.css';
+
+export { BlobStoreModel };
+
+interface AppendEntry {
+  seq: number;
+  cell: string;
+  rows: number;
+  content: any;
+}
+
+function emptyMessageCounts(): Record<string, any> {
+  return {
+    to_kernel: { count: 0, bytes: 0 },
+    from_kernel: { count: 0, bytes: 0 },
+  };
+}
+
+function bufferBytes(buffers: (ArrayBuffer | ArrayBufferView)[]): number {
+  return buffers.reduce((sum, buffer) => sum + buffer.byteLength, 0);
+}
+
+// elements of an array looked at by approximateBytes, the rest are assumed
+// to be the same size
+const SIZE_SAMPLE = 16;
+
+// About the size of value's JSON plus its binary buffers, for the message
+// counts in stats. Only a sample of a long array's elements is measured so
+// counting costs little next to the message itself.
+export function approximateBytes(value: any): number {
+  if (value === null || value === undefined) {
+    return 4;
+  }
+  switch (typeof value) {
+    case 'string':
+      return value.length + 2;
+    case 'number':
+    case 'boolean':
+      return String(value).length;
+    case 'object':
+      break;
+    default:
+      return 0;
+  }
+  if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+    return value.byteLength;
+  }
+  if (Array.isArray(value)) {
+    const n = Math.min(value.length, SIZE_SAMPLE);
+    if (!n) {
+      return 2;
+    }
+    let sampled = 0;
+    for (let i = 0; i < n; i++) {
+      sampled += approximateBytes(value[i]);
+    }
+    // brackets and commas
+    return Math.round((sampled * value.length) / n) + value.length + 1;
+  }
+  const keys = Object.keys(value);
+  // braces and commas
+  let bytes = Math.max(keys.length + 1, 2);
+  for (const key of keys) {
+    // quotes and colon
+    bytes += key.length + 3 + approximateBytes(value[key]);
+  }
+  return bytes;
+}
+
+// how long outputs have to settle before a snapshot is taken
+const SNAPSHOT_DELAY_MS = 1000;
+
+function sameVersions(
+  a: Record<string, number>,
+  b: Record<string, number>
+): boolean {
+  const keys = Object.keys(a);
+  return (
+    keys.length === Object.keys(b).length &&
+    keys.every((name) => a[name] === b[name])
+  );
+}
+
+function rowCount(rows: any): number {
+  if (Array.isArray(rows)) {
+    return rows.length;
+  }
+  if (rows && rows[TYPE_KEY] === 'dataframe') {
+    return rows.length;
+  }
+  if (rows && rows[TYPE_KEY] === 'ndarray') {
+    return rows.shape[0];
+  }
+  return 0;
+}
+
 export class ObservableWidgetModel extends DOMWidgetModel {
   defaults(): any {
     return {
@@ -27,15 +127,169 @@ export class ObservableWidgetModel extends DOMWidgetModel {
       _view_module: ObservableWidgetModel.view_module,
       _view_module_version: ObservableWidgetModel.view_module_version,
       value: undefined,
+      _computed_from: null,
       slug: '',
       cells: undefined,
       inputs: undefined,
+      _blob_store: null,
+      _input_versions: {},
       outputs: undefined,
+      output_mode: 'aggregate',
+      max_output_hz: 0,
+      local_modules: false,
+      execution_policy: 'suspend_offscreen',
+      output_budget: 0,
+      binary_outputs: false,
+      view_sharing: 'independent',
+      snapshot: false,
+      _snapshot: null,
+      lazy: false,
     };
   }
 
+  initialize(attributes: any, options: any): void {
+    super.initialize(attributes, options);
+    this.appendLog = [];
+    this.lastAppendSeq = 0;
+    this.appendsReceived = 0;
+    this.renderedViews = [];
+    this.stats = { messages: emptyMessageCounts(), cells: {} };
+    this.statsTimer = null;
+    this.onInputsState();
+    this.on('change:inputs change:_input_versions', this.onInputsState, this);
+    this.on('msg:custom', this.onCustomMessage, this);
+    this.on('change:value', () => (this.outputValues = undefined));
+  }
+
+  // Latest value and version of every redefined cell. Redefinitions arrive
+  // as custom messages containing only the changed cells, so these are kept
+  // here instead of in the synced inputs attribute.
+  // (no initializers: Backbone calls initialize() before they would run)
+  inputValues: Record<string, any>;
+  inputVersions: Record<string, number>;
+  // Rows appended to each cell since it was last redefined, for views
+  // rendered later, trimmed to each append's window.
+  appendLog: AppendEntry[];
+  lastAppendSeq: number;
+  // the seq of the last append from the kernel, appends dropped from
+  // appendLog are part of the inputs that replaced them
+  appendsReceived: number;
+  // views in the order they were rendered, and the one running the notebook
+  // if they share it (see ObservableWidgetView.lead)
+  renderedViews: ObservableWidgetView[];
+  leader?: ObservableWidgetView;
+  // In per_cell mode the kernel merges changed cells into widget.value
+  // itself, the merged value is kept here rather than in the value attribute
+  // so it isn't sent with the next unrelated save, see get_state()
+  outputValues?: Record<string, any>;
+  // see ObservableWidget.stats_summary(), sent at most once a second in a
+  // custom message so other changed attributes aren't flushed with them
+  stats: Record<string, any>;
+  statsTimer: any;
+
+  get_state(drop_defaults?: boolean): any {
+    const state = super.get_state(drop_defaults);
+    if (this.outputValues === undefined) {
+      return state;
+    }
+    return { ...state, value: this.outputValues };
+  }
+
+  countMessage(direction: 'to_kernel' | 'from_kernel', bytes: number): void {
+    const counts = this.stats.messages[direction];
+    counts.count++;
+    counts.bytes += bytes;
+    this.statsChanged();
+  }
+
+  updateStats(stats: Record<string, any>): void {
+    Object.assign(this.stats, stats);
+    this.statsChanged();
+  }
+
+  statsChanged(): void {
+    if (this.statsTimer === null) {
+      this.statsTimer = setTimeout(() => {
+        this.statsTimer = null;
+        this.send({ type: 'stats', ...this.stats }, {});
+      }, 1000);
+    }
+  }
+
+  onInputsState(): void {
+    const versions = { ...this.get('_input_versions') };
+    this.dropAppended(
+      Object.keys(versions).filter(
+        (name) => versions[name] !== this.inputVersions?.[name]
+      )
+    );
+    this.inputValues = { ...this.get('inputs') };
+    this.inputVersions = versions;
+    this.trigger('inputs');
+  }
+
+  dropAppended(cells: string[]): void {
+    this.appendLog = this.appendLog.filter((e) => !cells.includes(e.cell));
+  }
+
+  onAppend(content: any): void {
+    const { cell, window } = content;
+    this.appendsReceived = Math.max(this.appendsReceived, content.seq || 0);
+    this.appendLog.push({
+      seq: ++this.lastAppendSeq,
+      cell,
+      rows: rowCount(content.rows),
+      content,
+    });
+    if (window) {
+      let total = 0;
+      for (const entry of this.appendLog) {
+        total += entry.cell === cell ? entry.rows : 0;
+      }
+      this.appendLog = this.appendLog.filter((entry) => {
+        if (entry.cell !== cell || total - entry.rows < window) {
+          return true;
+        }
+        total -= entry.rows;
+        return false;
+      });
+    }
+    this.trigger('append');
+  }
+
+  onCustomMessage(content: any, buffers: DataView[]): void {
+    this.countMessage(
+      'from_kernel',
+      approximateBytes(content) + bufferBytes(buffers)
+    );
+    if (content.type === 'inputs') {
+      put_buffers(content, content.buffer_paths, buffers);
+      this.dropAppended(Object.keys(content.inputs));
+      Object.assign(this.inputValues, content.inputs);
+      Object.assign(this.inputVersions, content.versions);
+      this.trigger('inputs');
+    } else if (content.type === 'append') {
+      put_buffers(content, content.buffer_paths, buffers);
+      this.onAppend(content);
+    } else if (content.type === 'fetch') {
+      this.trigger('fetch', content);
+    } else if (content.type === 'reply') {
+      put_buffers(content, content.buffer_paths, buffers);
+      this.trigger('reply', content);
+    } else if (content.type === 'map') {
+      put_buffers(content, content.buffer_paths, buffers);
+      this.trigger('map', content);
+    } else if (content.type === 'cancel_map') {
+      this.trigger('cancel_map', content);
+    } else if (content.type === 'reset_stats') {
+      this.updateStats({ messages: emptyMessageCounts(), cells: {} });
+      this.trigger('reset_stats', content);
+    }
+  }
+
   static serializers: ISerializers = {
     ...DOMWidgetModel.serializers,
+    _blob_store: { deserialize: unpack_models },
   };
 
   static model_name = 'ObservableWidgetModel';
@@ -47,27 +301,38 @@ export class ObservableWidgetModel extends DOMWidgetModel {
 }
 
 export class ObservableWidgetView extends DOMWidgetView {
-  outputEl?: HTMLElement; // TODO remove this, it's just for debugging
+  frameEl: HTMLElement;
   iframe: HTMLIFrameElement;
-  queuedInputs: Record<string, any>[] = [];
-
-  // ugly hack until I figure out how to add code to the constructor
-  pAndR = (function promiseAndResolve(): [Promise<void>, () => void] {
-    let resolve: () => void;
-    const p = new Promise<void>((r) => {
-      resolve = r;
-    });
-    return [p, resolve!];
-  })();
-  iframeReadyForInputs: Promise<void> = this.pAndR[0];
-  setIframeReadyForInputs: () => void = this.pAndR[1];
+  // undefined while another view of the widget runs it, see view_sharing
+  frame?: PooledFrame;
+  visible = true;
+  visibilityObserver?: IntersectionObserver;
+  model: ObservableWidgetModel;
+  // input versions already sent to this view's iframe
+  sentVersions: Record<string, number> = {};
+  sentFirstInputs = false;
+  // the last entry of model.appendLog sent to this view's iframe
+  sentAppendSeq = 0;
+  // showing model's _snapshot instead of running the notebook
+  showingSnapshot = false;
+  snapshotTimer: any = null;
+  // stopped when its element was detached, see processPhosphorMessage
+  detachedWhileRunning = false;
+  // map() requests this view is running, by request id, see runMap
+  batches = new Map<string, { cancelled: boolean }>();
+  renderedAt = 0;
+  sentFirstOutput = false;
+  // Inputs and appends are posted in order, each once the blobs it
+  // references have arrived.
+  posted: Promise<void> = Promise.resolve();
+  // replaced each time this view starts running the notebook
+  iframeReadyForInputs: Promise<void>;
+  setIframeReadyForInputs: () => void;
 
   render(): void {
     this.el.classList.add('custom-widget');
 
     const slug = this.model.get('slug');
-    const cells = this.model.get('cells');
-    const outputs = this.model.get('outputs');
     const pretty_slug = slug.startsWith('d/') ? 'embedded notebook' : slug;
 
     // TODO make Observable logo optional
@@ -84,71 +349,462 @@ export class ObservableWidgetView extends DOMWidgetView {
     this.el.innerHTML = `
     <div>
     ${logoHTML}
-    <iframe sandbox="allow-scripts" style="overflow: auto; min-width: 100%; width: 0px;" frameBorder="0"></iframe>
-    <div class="value">output not available yet...</div>`;
+    <div class="observable-frame"></div>`;
+
+    this.frameEl = this.el.querySelector('.observable-frame') as HTMLElement;
+    this.listenTo(this.model, 'inputs', this.onInputs);
+    this.listenTo(this.model, 'fetch', this.forwardToFrame);
+    this.listenTo(this.model, 'reply', this.forwardToFrame);
+    this.listenTo(this.model, 'reset_stats', this.forwardToFrame);
+    this.listenTo(this.model, 'append', this.sendAppends);
+    this.listenTo(this.model, 'map', this.runMap);
+    this.listenTo(this.model, 'cancel_map', this.cancelMap);
+    this.listenTo(this.model, 'change:execution_policy', this.onVisibility);
+
+    const leader = this.model.leader;
+    this.model.renderedViews.push(this);
+    if (this.sharing && leader) {
+      this.follow();
+    } else {
+      this.start();
+    }
+  }
+
+  start(): void {
+    if (this.snapshotIsCurrent()) {
+      this.showSnapshot();
+    } else {
+      this.lead();
+    }
+  }
+
+  assetsUrl(): string | undefined {
+    return this.model.get('local_modules') ? localAssetsUrl() : undefined;
+  }
+
+  // A snapshot taken with the current inputs, see ObservableWidget.snapshot
+  snapshotIsCurrent(): boolean {
+    const snapshot = this.model.get('_snapshot');
+    return (
+      this.model.get('snapshot') &&
+      snapshot &&
+      sameVersions(snapshot.input_versions, this.model.inputVersions)
+    );
+  }
+
+  // Shows the notebook as last rendered, without running it, until inputs
+  // change or it's asked to run
+  showSnapshot(): void {
+    const { html, height } = this.model.get('_snapshot');
+    if (this.sharing) {
+      this.model.leader = this;
+    }
+    this.showingSnapshot = true;
+    const iframe = document.createElement('iframe');
+    // no allow-scripts: the HTML is only displayed
+    iframe.setAttribute('sandbox', '');
+    iframe.setAttribute('style', 'min-width: 100%; width: 0px;');
+    iframe.setAttribute('frameBorder', '0');
+    iframe.height = String(height);
+    iframe.srcdoc = get_snapshot_srcdoc(html, this.assetsUrl());
+    const button = document.createElement('button');
+    button.className = 'observable-snapshot-run';
+    button.textContent = 'Run';
+    button.title = 'This is a snapshot, run the notebook to interact with it';
+    button.addEventListener('click', () => this.lead());
+    this.frameEl.innerHTML = '';
+    this.frameEl.classList.add('observable-snapshot');
+    this.frameEl.append(iframe, button);
+  }
+
+  // With view_sharing 'leader' one view of a widget runs the notebook and
+  // sends its outputs, the others show a placeholder.
+  get sharing(): boolean {
+    return this.model.get('view_sharing') === 'leader';
+  }
 
-    this.el.querySelector('iframe')!.srcdoc = get_srcdoc(slug, cells, outputs);
-    this.outputEl = this.el.querySelector('.value') as HTMLElement;
-    this.iframe = this.el.querySelector('iframe') as HTMLIFrameElement;
+  // Runs the notebook in this view
+  lead(): void {
+    const slug = this.model.get('slug');
+    const cells = this.model.get('cells');
+    const outputs = this.model.get('outputs');
+    const outputMode = this.model.get('output_mode');
+    const maxOutputHz = this.model.get('max_output_hz');
+    const outputBudget = this.model.get('output_budget');
+    const binaryOutputs = this.model.get('binary_outputs');
+    const lazy = this.model.get('lazy');
+    const assetsUrl = this.assetsUrl();
+    const options: Record<string, any> = {
+      outputMode,
+      maxOutputHz,
+      outputBudget,
+      binaryOutputs,
+      lazy,
+    };
+    if (assetsUrl) {
+      options.runtimeUrl = assetsUrl + 'runtime.js';
+      options.modulesUrl = assetsUrl + 'modules/';
+    }
 
-    listenToSizeAndValuesAndReady(
-      this.iframe,
-      this.onPublishValues,
-      this.setIframeReadyForInputs
+    if (this.sharing) {
+      this.model.leader = this;
+    }
+    this.renderedAt = performance.now();
+    this.sentVersions = {};
+    this.sentFirstInputs = false;
+    this.sentAppendSeq = 0;
+    this.sentFirstOutput = false;
+    this.showingSnapshot = false;
+    this.frameEl.classList.remove('observable-snapshot');
+    this.iframeReadyForInputs = new Promise((resolve) => {
+      this.setIframeReadyForInputs = resolve;
+    });
+    this.frameEl.innerHTML = '';
+    // a pooled iframe that may already have the runtime loaded
+    this.frame = iframePool.checkout(assetsUrl, slug, this.frameEl);
+    this.iframe = this.frame.iframe;
+    this.frame.run(
+      { slug, cells, outputs, options },
+      {
+        onValues: this.onPublishValues,
+        onReady: this.onReady,
+        onMessage: this.onFrameMessage,
+      }
     );
     this.onInputs();
-    this.model.on('change:inputs', this.onInputs, this);
+
+    if (typeof IntersectionObserver !== 'undefined') {
+      this.visibilityObserver = new IntersectionObserver((entries) => {
+        this.visible = entries[entries.length - 1].isIntersecting;
+        this.onVisibility();
+      });
+      // the frame may be positioned over frameEl, see PooledFrame.show
+      this.visibilityObserver.observe(this.frameEl);
+    }
+  }
+
+  // Shows a placeholder while another view runs the notebook
+  follow(): void {
+    this.stopFrame();
+    this.frameEl.innerHTML = `<div class="observable-follower">
+    This widget is shown in another view.
+    <button>Show here</button>
+    </div>`;
+    this.frameEl
+      .querySelector('button')!
+      .addEventListener('click', () => this.takeOver());
+  }
+
+  // Moves the notebook from the leading view to this one. It restarts with
+  // the current inputs, interactions in the other view are lost.
+  takeOver(): void {
+    const leader = this.model.leader;
+    if (leader && leader !== this) {
+      leader.follow();
+    }
+    this.lead();
+  }
+
+  // ObservableWidget.map(): each input set is evaluated in a new runtime in
+  // one of `workers` hidden frames, and each result sent as it's ready.
+  // One view runs it: the leader, or the first independent view.
+  runMap = async (content: any): Promise<void> => {
+    const runner = this.sharing
+      ? this.model.leader
+      : this.model.renderedViews[0];
+    if (runner !== this) {
+      return;
+    }
+    const { request_id, inputs, outputs, workers } = content;
+    const slug = this.model.get('slug');
+    const assetsUrl = this.assetsUrl();
+    const options: Record<string, any> = {
+      binaryOutputs: this.model.get('binary_outputs'),
+    };
+    if (assetsUrl) {
+      options.runtimeUrl = assetsUrl + 'runtime.js';
+      options.modulesUrl = assetsUrl + 'modules/';
+    }
+    const batch = { cancelled: false };
+    this.batches.set(request_id, batch);
+    const container = document.createElement('div');
+    container.style.display = 'none';
+    this.el.appendChild(container);
+    let next = 0;
+    const worker = async () => {
+      const frame = iframePool.checkout(assetsUrl, slug, container);
+      // hidden frames get no animation frames
+      frame.schedule('timer');
+      try {
+        while (next < inputs.length && !batch.cancelled) {
+          const index = next++;
+          const result: Record<string, any> = {
+            type: 'mapped',
+            request_id,
+            index,
+          };
+          try {
+            result.value = await frame.evaluate({
+              slug,
+              outputs,
+              inputs: inputs[index],
+              options,
+            });
+          } catch (e) {
+            result.error = String((e as any)?.message ?? e);
+          }
+          if (!batch.cancelled) {
+            this.sendToKernel(result);
+          }
+        }
+      } finally {
+        iframePool.release(frame);
+      }
+    };
+    const count = Math.max(1, Math.min(workers, inputs.length));
+    await Promise.all(Array.from({ length: count }, worker));
+    this.batches.delete(request_id);
+    container.remove();
+  };
+
+  cancelMap = (content: any): void => {
+    const batch = this.batches.get(content.request_id);
+    if (batch) {
+      batch.cancelled = true;
+    }
+  };
+
+  stopFrame(): void {
+    this.showingSnapshot = false;
+    this.frameEl.classList.remove('observable-snapshot');
+    clearTimeout(this.snapshotTimer);
+    this.snapshotTimer = null;
+    this.visibilityObserver?.disconnect();
+    this.visibilityObserver = undefined;
+    if (this.frame) {
+      iframePool.release(this.frame);
+      this.frame = undefined;
+    }
+  }
+
+  // Offscreen embeds are suspended, or with execution_policy 'always' run
+  // on timers because browsers stop animation frames for offscreen iframes.
+  onVisibility(): void {
+    if (!this.frame) {
+      return;
+    } else if (this.visible) {
+      this.frame.schedule('frame');
+    } else if (this.model.get('execution_policy') === 'always') {
+      this.frame.schedule('timer');
+    } else {
+      this.frame.schedule('suspended');
+    }
+  }
+
+  // Jupyter detaches a view's element before removing it (e.g. when its cell
+  // is run again), which unloads an iframe moved into it. The frame goes back
+  // to the pool first, and the notebook restarts if the view is attached
+  // again.
+  processPhosphorMessage(msg: any): void {
+    super.processPhosphorMessage(msg);
+    if (msg.type === 'before-detach') {
+      if (this.frame && this.el.contains(this.frame.iframe)) {
+        this.stopFrame();
+        this.detachedWhileRunning = true;
+      }
+    } else if (msg.type === 'after-attach' && this.detachedWhileRunning) {
+      this.detachedWhileRunning = false;
+      if (!this.sharing || this.model.leader === this) {
+        this.start();
+      }
+    }
+  }
+
+  remove(): void {
+    this.stopFrame();
+    this.batches.forEach((batch) => (batch.cancelled = true));
+    const views = this.model.renderedViews;
+    views.splice(views.indexOf(this), 1);
+    if (this.model.leader === this) {
+      this.model.leader = undefined;
+      if (views.length) {
+        views[0].start();
+      }
+    }
+    super.remove();
+  }
+
+  onReady = (): void => {
+    this.model.updateStats({
+      time_to_ready_ms: performance.now() - this.renderedAt,
+    });
+    this.setIframeReadyForInputs();
+  };
+
+  // Waits until this view's iframe can take messages. False if this view
+  // isn't running the notebook, or stopped or restarted it meanwhile.
+  async frameReady(): Promise<boolean> {
+    const ready = this.iframeReadyForInputs;
+    if (!this.frame) {
+      return false;
+    }
+    await ready;
+    return this.isCurrent(ready);
+  }
+
+  isCurrent(ready: Promise<void>): boolean {
+    return this.frame !== undefined && ready === this.iframeReadyForInputs;
   }
 
   onInputs = async (): Promise<void> => {
-    const inputs: Record<string, any> = { ...this.model.get('inputs') };
-    for (const name of Object.keys(inputs)) {
-      // nonce, or some other value that is not a valid cell name on purpose
-      if (name.startsWith('-invalid-cell-name')) {
-        delete inputs[name];
+    if (this.showingSnapshot && !this.snapshotIsCurrent()) {
+      this.lead();
+      return;
+    }
+    if (!(await this.frameReady())) {
+      return;
+    }
+    // Only send cells redefined since the last time, so large unchanged
+    // inputs are neither copied again nor recomputed in the iframe.
+    const { inputValues, inputVersions } = this.model;
+    const changed: Record<string, any> = {};
+    const versions: Record<string, number> = {};
+    for (const name of Object.keys(inputValues)) {
+      const version = inputVersions[name] ?? 0;
+      if (this.sentVersions[name] !== version) {
+        changed[name] = inputValues[name];
+        versions[name] = version;
+        this.sentVersions[name] = version;
       }
     }
-    this.queuedInputs.push(inputs);
-    await this.iframeReadyForInputs;
-    // A lazy way to queue up inputs
-    let inputsToSend;
-    while ((inputsToSend = this.queuedInputs.shift())) {
-      sendInputs(this.iframe, inputsToSend);
+    const appends = this.model.appendsReceived;
+    // the first inputs message starts the runtime, even if it's empty
+    if (Object.keys(changed).length || !this.sentFirstInputs) {
+      const first = !this.sentFirstInputs;
+      this.sentFirstInputs = true;
+      const store: BlobStoreModel | null = this.model.get('_blob_store');
+      this.enqueue(async (iframe) => {
+        const inputs = await resolveBlobs(changed, store);
+        sendInputs(iframe, inputs, versions, appends);
+      });
+      if (first) {
+        // rows appended before this view was rendered
+        this.sendAppends();
+      }
     }
   };
 
-  onPublishValues = (values: Record<string, any>): void => {
-    console.log('publishing values:', values);
-    if (this.outputEl) {
-      this.outputEl.innerHTML =
-        '<span title="' +
-        JSON.stringify(values, null, 2).replace(/"/g, "'") +
-        '">hover to preview widget.value</span>';
+  sendAppends = async (): Promise<void> => {
+    if (this.showingSnapshot) {
+      this.lead();
+      return;
+    }
+    if (!(await this.frameReady())) {
+      return;
+    }
+    for (const entry of this.model.appendLog) {
+      if (entry.seq > this.sentAppendSeq) {
+        this.sentAppendSeq = entry.seq;
+        this.enqueue(() => this.frame!.post(entry.content));
+      }
     }
-    this.model.set('value', values);
-    this.touch();
   };
-}
 
-function get_srcdoc(slug: string, cells?: string[], outputs?: string[]) {
-  return `<!DOCTYPE html>
-<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@observablehq/inspector@3/dist/inspector.css">
-<style>
-body {
-  margin: 0;
-}
-</style>
-<div style="overflow: auto;"></div>
-<script type="module">
-${iframe_bundle_src}
-
-const slug = '${slug}';
-const into = document.getElementsByTagName('div')[0];
-const cells = ${cells ? JSON.stringify(cells) : 'undefined'};
-const outputs = ${outputs ? JSON.stringify(outputs) : 'undefined'}
-embed(slug, into, cells, outputs);
-monitor()
-// TODO how to clean up monitor or a window event listener when this cell gets rerun?
-</script>
-`;
+  // post is skipped if the frame is stopped or restarted before its turn
+  enqueue(post: (iframe: HTMLIFrameElement) => Promise<void> | void): void {
+    const ready = this.iframeReadyForInputs;
+    this.posted = this.posted
+      .then(async () => {
+        if (this.isCurrent(ready)) {
+          await post(this.iframe);
+        }
+      })
+      .catch((e) => console.error(e));
+  }
+
+  // ObservableWidget.fetch() requests and replies to jupyter.call()
+  forwardToFrame = async (content: any): Promise<void> => {
+    if (await this.frameReady()) {
+      this.frame!.post(content);
+    }
+  };
+
+  onFrameMessage = (data: any): void => {
+    if (data.type === 'stats') {
+      this.model.updateStats({ load: data.load, cells: data.cells });
+    } else if (data.type === 'snapshot') {
+      this.model.set('_snapshot', {
+        html: data.html,
+        height: data.height,
+        input_versions: { ...this.model.inputVersions },
+      });
+      this.touch();
+      this.model.countMessage('to_kernel', approximateBytes(data));
+    } else if (
+      data.type === 'fetched' ||
+      data.type === 'call' ||
+      data.type === 'cancel'
+    ) {
+      this.sendToKernel(data);
+    }
+  };
+
+  // ArrayBuffers of binary outputs are sent as message buffers
+  sendToKernel(content: any): void {
+    const { state, buffer_paths, buffers } = remove_buffers(content);
+    const message = { ...state, buffer_paths };
+    this.model.send(message, {}, buffers);
+    this.model.countMessage(
+      'to_kernel',
+      approximateBytes(message) + bufferBytes(buffers)
+    );
+  }
+
+  // computedFrom is what the values were computed from, see
+  // ObservableWidget.wait_for
+  onPublishValues = (
+    values: Record<string, any>,
+    partial: boolean,
+    computedFrom: any = null
+  ): void => {
+    const changed = values;
+    if (partial) {
+      values = {
+        ...(this.model.outputValues ?? this.model.get('value')),
+        ...changed,
+      };
+    }
+    if (!this.sentFirstOutput) {
+      this.sentFirstOutput = true;
+      this.model.updateStats({
+        time_to_first_output_ms: performance.now() - this.renderedAt,
+      });
+    }
+    if (this.model.get('snapshot')) {
+      this.requestSnapshot();
+    }
+    if (partial) {
+      // Only the changed cells are sent to the kernel, which merges them
+      // into widget.value itself.
+      this.model.outputValues = values;
+      this.sendToKernel({
+        type: 'outputs',
+        outputs: changed,
+        computed_from: computedFrom,
+      });
+    } else {
+      this.model.set({ value: values, _computed_from: computedFrom });
+      this.touch();
+      this.model.countMessage('to_kernel', approximateBytes({ value: values }));
+    }
+  };
+
+  // once outputs have settled
+  requestSnapshot(): void {
+    clearTimeout(this.snapshotTimer);
+    this.snapshotTimer = setTimeout(() => {
+      this.snapshotTimer = null;
+      this.frame?.post({ type: 'snapshot' });
+    }, SNAPSHOT_DELAY_MS);
+  }
 }
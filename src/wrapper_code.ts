@@ -1,43 +1,135 @@
-function getFrameByEvent(event: MessageEvent) {
-  return [...document.getElementsByTagName('iframe')].filter((iframe) => {
-    return iframe.contentWindow === event.source;
-  })[0];
+// Handlers may be replaced while registered, see PooledFrame
+export interface Embed {
+  iframe: HTMLIFrameElement;
+  onValues: (values: any, partial: boolean, computedFrom: any) => void;
+  onReady: () => void;
+  onBooted?: () => void;
+  // any other message
+  onMessage?: (data: any) => void;
 }
 
-// Each embed gets its own event listener.
+// Every embed, and the same embeds by the window messages arrive from. An
+// iframe's contentWindow is null until it's in the document, so it's listened
+// to once it's inserted, and bound again whenever it loads in case it was
+// reinserted. Moving it with moveBefore keeps its window. Messages from any
+// other window are dropped without looking at the embeds.
+const embeds = new Set<Embed>();
+const embedsByWindow = new WeakMap<Window, Embed>();
+
+// One listener on the window routes messages for all embeds.
+export function dispatchMessage(msg: MessageEvent): void {
+  const embed = msg.source
+    ? embedsByWindow.get(msg.source as Window)
+    : undefined;
+  if (!embed || !msg.data) {
+    return;
+  }
+  if (msg.data.type === 'iframeSize') {
+    embed.iframe.height = msg.data.height;
+  } else if (msg.data.type === 'outputs') {
+    embed.onValues(
+      msg.data.outputs,
+      !!msg.data.partial,
+      msg.data.computed_from
+    );
+  } else if (msg.data.type === 'ready') {
+    embed.onReady();
+  } else if (msg.data.type === 'booted' && embed.onBooted) {
+    embed.onBooted();
+  } else if (embed.onMessage) {
+    embed.onMessage(msg.data);
+  }
+}
+
+// The iframe should be in the document already, messages from it are dropped
+// until it is and has loaded. Returns a function to call when the embed is
+// removed.
 export function listenToSizeAndValuesAndReady(
   iframe: HTMLIFrameElement,
-  onValues: (values: any) => void,
+  onValues: (values: any, partial: boolean, computedFrom: any) => void,
   onReady: () => void
-): void {
-  function onMessage(msg: MessageEvent) {
-    if (!document.body.contains(iframe)) {
-      // iframe is gone
-      removeEventListener('message', onMessage);
+): () => void {
+  return listen({ iframe, onValues, onReady });
+}
+
+export function listen(embed: Embed): () => void {
+  const { iframe } = embed;
+  let bound: Window | null = null;
+  const bind = () => {
+    if (bound && embedsByWindow.get(bound) === embed) {
+      embedsByWindow.delete(bound);
     }
-    const senderIframe = getFrameByEvent(msg);
-    if (msg.data.type === 'iframeSize' && senderIframe === iframe) {
-      iframe.height = msg.data.height;
-    } else if (msg.data.type === 'outputs' && senderIframe === iframe) {
-      onValues(msg.data.outputs);
-    } else if (msg.data.type === 'ready' && senderIframe === iframe) {
-      onReady();
+    bound = iframe.contentWindow;
+    if (bound) {
+      embedsByWindow.set(bound, embed);
     }
+  };
+  if (embeds.size === 0) {
+    window.addEventListener('message', dispatchMessage);
   }
-
-  window.addEventListener('message', onMessage);
+  embeds.add(embed);
+  bind();
+  iframe.addEventListener('load', bind);
+  return () => {
+    if (!embeds.delete(embed)) {
+      return;
+    }
+    iframe.removeEventListener('load', bind);
+    if (bound && embedsByWindow.get(bound) === embed) {
+      embedsByWindow.delete(bound);
+    }
+    if (embeds.size === 0) {
+      window.removeEventListener('message', dispatchMessage);
+    }
+  };
 }
 
+// versions of the inputs, and the number of appends so far, are returned
+// with the outputs computed from them
 export function sendInputs(
   iframe: HTMLIFrameElement,
-  inputs: Record<string, any>
+  inputs: Record<string, any>,
+  versions: Record<string, number> = {},
+  appends = 0
 ): void {
   // TODO error handing when these cannot be serialized!
+  const transfer: ArrayBuffer[] = [];
   iframe.contentWindow!.postMessage(
     {
       type: 'inputs',
-      inputs,
+      inputs: prepareForTransfer(inputs, transfer),
+      versions,
+      appends,
     },
-    '*'
+    '*',
+    transfer
   );
 }
+
+// Binary buffers arrive from the kernel as DataViews into the comm message.
+// Each is copied once into its own ArrayBuffer which is then transferred
+// (not cloned) into the iframe. The model keeps the originals for other views.
+export function prepareForTransfer(
+  value: any,
+  transfer: ArrayBuffer[]
+): any {
+  if (value instanceof DataView) {
+    const buffer = value.buffer.slice(
+      value.byteOffset,
+      value.byteOffset + value.byteLength
+    );
+    transfer.push(buffer);
+    return buffer;
+  }
+  if (Array.isArray(value)) {
+    return value.map((v) => prepareForTransfer(v, transfer));
+  }
+  if (value !== null && typeof value === 'object') {
+    const prepared: Record<string, any> = {};
+    for (const key of Object.keys(value)) {
+      prepared[key] = prepareForTransfer(value[key], transfer);
+    }
+    return prepared;
+  }
+  return value;
+}